@@ -18,10 +18,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import math
 import unittest
 
 from titus.genpy import PFAEngine
+from titus.datatype import *
 from titus.errors import *
+import titus.lib1.core
     
 class TestLib1Core(unittest.TestCase):
     def testDoAddition(self):
@@ -201,6 +204,54 @@ action:
   - {/: [5, 3]}
 '''))
 
+    def testArithmeticIsSpecializedOnType(self):
+        plus = titus.lib1.core.provides["+"]
+        self.assertEqual(plus.genpy([AvroDouble(), AvroDouble(), AvroDouble()], ["x", "y"]), "((x) + (y))")
+        self.assertEqual(plus.genpy([AvroInt(), AvroInt(), AvroInt()], ["x", "y"]), "checkIntOverflow(((x) + (y)))")
+        self.assertEqual(plus.genpy([AvroLong(), AvroLong(), AvroLong()], ["x", "y"]), "checkLongOverflow(((x) + (y)))")
+
+        engine, = PFAEngine.fromYaml('''
+input: double
+output: double
+action:
+  - {/: [input, 0]}
+''')
+        self.assertTrue(math.isnan(engine.action(0.0)))
+
+    def testInlinedOperatorsWithNegativeLiterals(self):
+        for style in "pure", "fast":
+            engine, = PFAEngine.fromYaml('''
+input: int
+output: int
+action:
+  - {"**": [-2, input]}
+''', style=style)
+            self.assertEqual(engine.action(2), 4)
+            self.assertEqual(engine.action(3), -8)
+
+            engine, = PFAEngine.fromYaml('''
+input: double
+output: double
+action:
+  - {"**": [-2.0, input]}
+''', style=style)
+            self.assertEqual(engine.action(2.0), 4.0)
+
+            engine, = PFAEngine.fromYaml('''
+input: int
+output: {type: array, items: int}
+action:
+  - type: {type: array, items: int}
+    new:
+      - {"+": [input, -2]}
+      - {"-": [input, -2]}
+      - {"*": [-2, input]}
+      - {"u-": -2}
+      - {"%": [-7, input]}
+      - {"//": [-7, input]}
+''', style=style)
+            self.assertEqual(engine.action(3), [1, 5, -6, 2, 2, -3])
+
     def testIntegerDivision(self):
         engine, = PFAEngine.fromYaml('''
 input: "null"
@@ -222,6 +222,32 @@ action:
         self.assertAlmostEqual(engine.action(0.5), 3.54, places=2)
         self.assertAlmostEqual(engine.action(22.5), 22.77, places=2)
 
+    def testHypotOfNegativeLiteral(self):
+        for style in "pure", "fast":
+            engine, = PFAEngine.fromYaml('''
+input: double
+output: double
+action:
+  - {m.hypot: [-3.0, input]}
+''', style=style)
+            self.assertAlmostEqual(engine.action(4.0), 5.0, places=6)
+
+            engine, = PFAEngine.fromYaml('''
+input: double
+output: double
+action:
+  - {m.copysign: [input, -1.0]}
+''', style=style)
+            self.assertEqual(engine.action(3.0), -3.0)
+
+            engine, = PFAEngine.fromYaml('''
+input: double
+output: long
+action:
+  - {m.round: -2.5}
+''', style=style)
+            self.assertEqual(engine.action(0.0), -2)
+
     def testLn(self):
         engine, = PFAEngine.fromYaml('''
 input: double
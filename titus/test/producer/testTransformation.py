@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+# 
+# This file is part of Hadrian.
+# 
+# Licensed under the Hadrian Personal Use and Evaluation License (PUEL);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://raw.githubusercontent.com/opendatagroup/hadrian/master/LICENSE
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import unittest
+
+import numpy
+
+from titus.genpy import PFAEngine
+from titus.errors import PFARuntimeException
+
+class TestProducerTransformation(unittest.TestCase):
+    def testNumpyActionOnRecords(self):
+        engine, = PFAEngine.fromYaml('''
+input: {type: record, name: Input, fields: [{name: x, type: double}, {name: y, type: double}]}
+output: double
+action:
+  - let: {z: {"*": [input.x, 2]}}
+  - cond:
+      - if: {">": [z, 3]}
+        then: {m.sqrt: z}
+      - if: {"<": [input.y, 0]}
+        then: -1.0
+    else: {"+": [z, input.y]}
+''')
+        dataset = numpy.array([(1.0, 2.0), (5.0, 1.0), (0.5, -3.0)], dtype=[("x", "f8"), ("y", "f8")])
+        expected = [engine.action({"x": x, "y": y}) for x, y in dataset]
+
+        self.assertEqual(engine.actionNumpy(dataset).tolist(), expected)
+        self.assertEqual(engine.actionNumpy({"x": dataset["x"], "y": dataset["y"]}).tolist(), expected)
+        self.assertRaises(TypeError, lambda: engine.actionNumpy({"x": dataset["x"]}))
+
+    def testNumpyActionOnPrimitives(self):
+        engine, = PFAEngine.fromYaml('''
+input: double
+output: double
+action:
+  if: {">": [input, 1.0]}
+  then: {"*": [input, {m.pi: []}]}
+  else: 0.0
+''')
+        self.assertEqual(engine.actionNumpy(numpy.array([0.5, 2.0])).tolist(), [0.0, 2.0 * numpy.pi])
+
+        engine, = PFAEngine.fromYaml('''
+input: double
+output: double
+action: 3.5
+''')
+        self.assertEqual(engine.actionNumpy(numpy.arange(3.0)).tolist(), [3.5, 3.5, 3.5])
+
+    def assertMatchesAction(self, engine, dataset):
+        expected = [engine.action(x) for x in dataset]
+        actual = engine.actionNumpy(numpy.array(dataset)).tolist()
+        self.assertEqual(len(actual), len(expected))
+        for x, y in zip(actual, expected):
+            if isinstance(y, float) and math.isnan(y):
+                self.assertTrue(math.isnan(x))
+            else:
+                self.assertEqual(x, y)
+
+    def testNumpyActionMatchesActionAtEdgeValues(self):
+        engine, = PFAEngine.fromYaml('''
+input: double
+output: long
+action: {m.round: input}
+''')
+        self.assertMatchesAction(engine, [2.5, -2.5, 0.5, 1.5, -0.5, 3.49])
+        self.assertRaises(ValueError, lambda: engine.action(float("nan")))
+        self.assertRaises(ValueError, lambda: engine.actionNumpy(numpy.array([1.0, float("nan")])))
+        self.assertRaises(PFARuntimeException, lambda: engine.action(1e19))
+        self.assertRaises(PFARuntimeException, lambda: engine.actionNumpy(numpy.array([1.0, 1e19])))
+
+        engine, = PFAEngine.fromYaml('''
+input: double
+output: double
+action: {"/": [1.0, input]}
+''')
+        self.assertMatchesAction(engine, [0.0, -0.0, 2.0])
+
+        engine, = PFAEngine.fromYaml('''
+input: double
+output: double
+action: {m.exp: input}
+''')
+        self.assertMatchesAction(engine, [0.0, 700.0, float("-inf")])
+        self.assertRaises(OverflowError, lambda: engine.action(1000.0))
+        self.assertRaises(OverflowError, lambda: engine.actionNumpy(numpy.array([1.0, 1000.0])))
+
+        engine, = PFAEngine.fromYaml('''
+input: double
+output: double
+action: {"**": [input, 0.5]}
+''')
+        self.assertMatchesAction(engine, [4.0, 0.0])
+        self.assertRaises(ValueError, lambda: engine.action(-4.0))
+        self.assertRaises(ValueError, lambda: engine.actionNumpy(numpy.array([4.0, -4.0])))
+
+    def testNumpyActionChecksIntegerOverflow(self):
+        engine, = PFAEngine.fromYaml('''
+input: {type: record, name: Input, fields: [{name: a, type: int}, {name: b, type: int}]}
+output: int
+action:
+  - let: {s: {"+": [input.a, input.b]}}
+  - {"*": [s, 2]}
+''')
+        dataset = numpy.array([(1, 2), (1073741823, 0), (-5, 3)], dtype=[("a", "i4"), ("b", "i4")])
+        self.assertEqual(engine.actionNumpy(dataset).tolist(), [engine.action({"a": a, "b": b}) for a, b in dataset.tolist()])
+        overflowing = numpy.array([(1, 2), (1073741824, 0)], dtype=[("a", "i4"), ("b", "i4")])
+        self.assertRaises(PFARuntimeException, lambda: engine.action({"a": 1073741824, "b": 0}))
+        self.assertRaises(PFARuntimeException, lambda: engine.actionNumpy(overflowing))
+
+        engine, = PFAEngine.fromYaml('''
+input: long
+output: long
+action: {"*": [input, input]}
+''')
+        self.assertEqual(engine.actionNumpy(numpy.array([3037000499, -7])).tolist(), [engine.action(3037000499), 49])
+        self.assertRaises(PFARuntimeException, lambda: engine.action(3037000500))
+        self.assertRaises(PFARuntimeException, lambda: engine.actionNumpy(numpy.array([1, 3037000500])))
+
+        engine, = PFAEngine.fromYaml('''
+input: long
+output: long
+action: {"u-": input}
+''')
+        self.assertRaises(PFARuntimeException, lambda: engine.actionNumpy(numpy.array([-9223372036854775808])))
+
+    def testNumpyActionOnlyRaisesForRowsThatReachTheError(self):
+        dataset = numpy.array([(-7, 3), (7, -3), (5, 0), (-6, 4)], dtype=[("a", "i4"), ("b", "i4")])
+        for operator, output in ("%", "int"), ("%%", "double"):
+            engine, = PFAEngine.fromYaml('''
+input: {{type: record, name: Input, fields: [{{name: a, type: int}}, {{name: b, type: int}}]}}
+output: {1}
+action:
+  if: {{"!=": [input.b, 0]}}
+  then: {{"{0}": [input.a, input.b]}}
+  else: {{"{0}": [input.a, 1]}}
+'''.format(operator, output))
+            self.assertEqual(engine.actionNumpy(dataset).tolist(), [engine.action({"a": a, "b": b}) for a, b in dataset.tolist()])
+
+        engine, = PFAEngine.fromYaml('''
+input: {type: record, name: Input, fields: [{name: a, type: int}, {name: b, type: int}]}
+output: int
+action:
+  cond:
+    - {if: {"==": [input.b, 0]}, then: 0}
+    - {if: {"<": [input.a, 0]}, then: {"%%": [input.a, input.b]}}
+  else: {"%": [input.a, input.b]}
+''')
+        dataset = numpy.array([(-7, 3), (7, -3), (5, 0), (-5, 0), (7, 3)], dtype=[("a", "i4"), ("b", "i4")])
+        self.assertEqual(engine.actionNumpy(dataset).tolist(), [engine.action({"a": a, "b": b}) for a, b in dataset.tolist()])
+
+        engine, = PFAEngine.fromYaml('''
+input: {type: record, name: Input, fields: [{name: a, type: int}, {name: b, type: int}]}
+output: int
+action: {"%": [input.a, input.b]}
+''')
+        self.assertRaises(ZeroDivisionError, lambda: engine.action({"a": 1, "b": 0}))
+        self.assertRaises(ZeroDivisionError, lambda: engine.actionNumpy(dataset))
+
+    def testNumpyActionRejectsUnsupportedForms(self):
+        engine, = PFAEngine.fromYaml('''
+input: double
+output: double
+action: {u.f: [input]}
+fcns:
+  f: {params: [{x: double}], ret: double, do: x}
+''')
+        self.assertRaises(ValueError, lambda: engine.actionNumpy(numpy.array([1.0])))
+
+        engine, = PFAEngine.fromYaml('''
+input: double
+output: double
+method: emit
+action: {emit: input}
+''')
+        self.assertRaises(ValueError, lambda: engine.actionNumpy(numpy.array([1.0])))
+
+if __name__ == "__main__":
+    unittest.main()
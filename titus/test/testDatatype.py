@@ -20,8 +20,14 @@
 
 import json
 import unittest
+from cStringIO import StringIO
+
+from avro.datafile import DataFileReader, DataFileWriter
+from avro.io import DatumReader, DatumWriter
 
 from titus.datatype import *
+import titus.avrocodec
+import titus.errors
 
 class TestDataType(unittest.TestCase):
     def testPromoteNumbers(self):
@@ -260,5 +266,70 @@ class TestDataType(unittest.TestCase):
         # forwardDeclarationParser.getAvroType('''{"type": "array", "items": "Outer"}''') should be (Some(AvroArray(type1)))
         # forwardDeclarationParser.getAvroType('''{"type": "array", "items": "int"}''') should be (Some(AvroArray(AvroInt())))
 
+    def testAvroCodecMatchesAvroLibrary(self):
+        schema = '''{"type": "record", "name": "Tree", "fields": [{"name": "label", "type": {"type": "enum", "name": "Label", "symbols": ["A", "B"]}}, {"name": "weight", "type": "double"}, {"name": "ratio", "type": "float"}, {"name": "count", "type": "long"}, {"name": "id", "type": {"type": "fixed", "name": "Id", "size": 2}}, {"name": "raw", "type": "bytes"}, {"name": "tags", "type": {"type": "map", "values": ["null", "string", "int"]}}, {"name": "children", "type": {"type": "array", "items": "Tree"}}]}'''
+        tpe = ForwardDeclarationParser().parse([schema])[schema]
+
+        leaf = {"label": "B", "weight": -1.5, "ratio": 0.25, "count": -2**40, "id": "\x00\xff", "raw": "", "tags": {u"caf\u00e9": u"\u2603", "n": None, "i": 12345}, "children": []}
+        tree = {"label": "A", "weight": 3.0, "ratio": 1.0, "count": 63, "id": "ab", "raw": "\x01\x02", "tags": {"tagged": {"int": -64}}, "children": [leaf, leaf]}
+        untagged = dict(tree, tags={"tagged": -64})
+
+        buf = StringIO()
+        writer = titus.avrocodec.ContainerWriter(buf, tpe, {"extra": "meta"}, "deflate", blockSize=10)
+        for i in xrange(3):
+            writer.append(tree)
+        writer.flush()
+
+        reader = DataFileReader(StringIO(buf.getvalue()), DatumReader())
+        self.assertEqual(reader.get_meta("extra"), "meta")
+        self.assertEqual(list(reader), [untagged] * 3)
+        self.assertEqual(list(titus.avrocodec.ContainerReader(StringIO(buf.getvalue()))), [untagged] * 3)
+
+        buf = StringIO()
+        writer = DataFileWriter(buf, DatumWriter(), tpe.schema)
+        writer.append(untagged)
+        writer.flush()
+        self.assertEqual(list(titus.avrocodec.ContainerReader(StringIO(buf.getvalue()), tpe)), [untagged])
+
+    def testCompiledCheckDataMatchesCheckData(self):
+        schema = '''{"type": "record", "name": "Node", "fields": [{"name": "n", "type": "int"}, {"name": "x", "type": "double"}, {"name": "s", "type": "string"}, {"name": "b", "type": "bytes"}, {"name": "flag", "type": "boolean"}, {"name": "u", "type": ["null", "string", {"type": "array", "items": "Node"}]}, {"name": "m", "type": {"type": "map", "values": ["long", "null"]}}]}'''
+        tpe = ForwardDeclarationParser().parse([schema])[schema]
+        check = compileCheckData(tpe)
+
+        leaf = {"n": 1, "x": 2, "s": "str", "b": u"uni", "flag": "true", "u": None, "m": {}}
+        good = [leaf,
+                {"n": "3", "x": 1.5, "s": u"\u2603", "b": "raw", "flag": False, "u": u"tagless", "m": {"k": 3, u"j": None}},
+                {"n": 3, "x": 1.5, "s": u"s", "b": "raw", "flag": True, "u": {"array": [leaf, leaf]}, "m": {"k": {"long": 4}}},
+                {"n": 3, "x": 1.5, "s": u"s", "b": "raw", "flag": True, "u": [leaf], "m": {}}]
+        bad = [{"n": 1},
+               dict(leaf, n=1.5),
+               dict(leaf, u={"record": leaf}),
+               dict(leaf, u=3),
+               dict(leaf, m={3: 4}),
+               dict(leaf, m={"k": "v"}),
+               7]
+
+        for datum in good:
+            self.assertEqual(check(datum), checkData(datum, tpe))
+        for datum in bad:
+            self.assertRaises(TypeError, lambda: checkData(datum, tpe))
+            self.assertRaises(TypeError, lambda: check(datum))
+        self.assertTrue(compileCheckData(tpe) is check)
+
+    def testCompiledJsonDecoderMatchesJsonDecoder(self):
+        schema = '''{"type": "record", "name": "Cluster", "fields": [{"name": "id", "type": "string"}, {"name": "count", "type": "long"}, {"name": "weight", "type": "float", "default": 1.0}, {"name": "nothing", "type": "null"}, {"name": "kind", "type": {"type": "enum", "name": "Kind", "symbols": ["A", "B"]}}, {"name": "key", "type": {"type": "fixed", "name": "Key", "size": 2}}, {"name": "raw", "type": "bytes"}, {"name": "center", "type": {"type": "array", "items": "double"}}, {"name": "extra", "type": {"type": "map", "values": ["null", "int", "Cluster"]}}]}'''
+        tpe = AvroArray(ForwardDeclarationParser().parse([schema])[schema])
+        decode = compileJsonDecoder(tpe)
+
+        cluster = {"id": "one", "count": 3, "kind": "B", "key": "ab", "raw": "", "center": [1, 2.5], "extra": {"a": None, "b": {"int": 2}}}
+        nested = dict(cluster, weight=2, extra={"c": {"Cluster": cluster}})
+        self.assertEqual(decode([cluster, nested]), jsonDecoder(tpe, [cluster, nested]))
+        self.assertEqual(decode([]), [])
+
+        for bad in [{}, [dict(cluster, count="x")], [dict(cluster, kind="C")], [dict(cluster, key="abc")], [dict(cluster, extra={"a": 2})], [dict(cluster, extra={"a": {"long": 2}})], [dict((k, v) for k, v in cluster.items() if k != "id")]]:
+            self.assertRaises(titus.errors.AvroException, lambda: jsonDecoder(tpe, bad))
+            self.assertRaises(titus.errors.AvroException, lambda: decode(bad))
+        self.assertTrue(compileJsonDecoder(tpe) is decode)
+
 if __name__ == "__main__":
     unittest.main()
@@ -19,9 +19,15 @@
 # limitations under the License.
 
 import json
+import os
+import shutil
+import tempfile
 import unittest
+from cStringIO import StringIO
 
 from titus.genpy import PFAEngine
+from titus.errors import PFAInitializationException, PFAUserException
+from titus.checkpoint import Checkpointer
 
 class TestDumpstate(unittest.TestCase):
     def testPrivateCellsInt(self):
@@ -634,5 +640,113 @@ action:
         engine.action(2)
         self.assertEqual(engine.snapshot().pools["test"].init["zzz"], "5")
 
+    def testAvroSnapshot(self):
+        pfa = '''
+input: int
+output: long
+cells:
+  record:
+    type: {type: record, name: R, fields: [{name: a, type: [int, string, "null"]}, {name: b, type: {type: array, items: double}}]}
+    init: {a: {string: hey}, b: [1, 2]}
+  last:
+    type: ["null", int]
+    init: null
+pools:
+  counts:
+    type: {type: map, values: [int, string]}
+    init: {x: {}, y: {z: {int: 3}}}
+  total:
+    type: long
+    shared: true
+action:
+  - pool: counts
+    path: [{s.number: input}]
+    init: {value: {}, type: {type: map, values: [int, string]}}
+    to: {params: [{m: {type: map, values: [int, string]}}], ret: {type: map, values: [int, string]}, do: {map.add: [m, {string: one}, input]}}
+  - pool: total
+    path: [{string: all}]
+    init: 0
+    to: {params: [{x: long}], ret: long, do: {+: [x, input]}}
+  - cell: last
+    to: input
+  - {pool: total, path: [{string: all}]}
+'''
+        engine, = PFAEngine.fromYaml(pfa)
+        for i in xrange(100):
+            engine.action(i)
+
+        for codec in "null", "deflate":
+            buf = StringIO()
+            engine.snapshotAvro(buf, codec)
+
+            restored, = PFAEngine.fromYaml(pfa)
+            restored.restoreAvro(StringIO(buf.getvalue()))
+            self.assertEqual(restored.cells["record"].value, {"a": "hey", "b": [1.0, 2.0]})
+            self.assertEqual(restored.cells["last"].value, 99)
+            self.assertEqual(restored.pools["counts"].value, dict([("x", {}), ("y", {"z": 3})] + [(str(i), {"one": i}) for i in xrange(100)]))
+            self.assertEqual(restored.pools["total"].value, {"all": 4950})
+            self.assertEqual(restored.action(100), 5050)
+
+        other, = PFAEngine.fromYaml(pfa.replace("type: long", "type: double").replace("x: long", "x: double").replace("ret: long", "ret: double").replace("output: long", "output: double"))
+        self.assertRaises(PFAInitializationException, lambda: other.restoreAvro(StringIO(buf.getvalue())))
+
+    def testCheckpoint(self):
+        pfa = '''
+input: int
+output: int
+cells:
+  last: {type: int, init: 0}
+pools:
+  counts: {type: int, init: {}, rollback: true}
+action:
+  - cell: last
+    to: input
+  - pool: counts
+    path: [{s.number: input}]
+    init: 0
+    to: {params: [{x: int}], ret: int, do: {+: [x, 1]}}
+  - if: {"<": [input, 0]}
+    then: {error: "negative"}
+  - {pool: counts, path: [{s.number: input}]}
+'''
+        directory = tempfile.mkdtemp()
+        try:
+            def recovered():
+                engine, = PFAEngine.fromYaml(pfa)
+                checkpointer = Checkpointer(engine, directory, compactRatio=1e9)
+                self.assertTrue(checkpointer.recover())
+                checkpointer.close()
+                return engine.cells["last"].value, engine.pools["counts"].value
+
+            engine, = PFAEngine.fromYaml(pfa)
+            checkpointer = Checkpointer(engine, directory, compactRatio=1e9)
+            self.assertFalse(checkpointer.recover())
+
+            for i in xrange(30):
+                engine.action(i)
+            self.assertEqual(checkpointer.checkpoint(), 31)
+            self.assertEqual(checkpointer.checkpoint(), 0)
+
+            engine.action(31)
+            engine.action(45)
+            self.assertRaises(PFAUserException, lambda: engine.action(-3))
+            self.assertEqual(checkpointer.checkpoint(), 4)
+            self.assertEqual(recovered(), (-3, dict([(str(i), 1) for i in range(30) + [31, 45]])))
+
+            size = os.path.getsize(os.path.join(directory, "log.avro"))
+            with open(os.path.join(directory, "log.avro"), "ab") as stream:
+                stream.write("\x02\x40partial")
+            self.assertEqual(recovered()[0], -3)
+            self.assertEqual(os.path.getsize(os.path.join(directory, "log.avro")), size)
+
+            shutil.copy(os.path.join(directory, "log.avro"), os.path.join(directory, "old.avro"))
+            engine.action(2)
+            checkpointer.compact()
+            shutil.copy(os.path.join(directory, "old.avro"), os.path.join(directory, "log.avro"))
+            self.assertEqual(recovered(), (2, dict([(str(i), 1) for i in range(30) + [31, 45]], **{"2": 2})))
+            checkpointer.close()
+        finally:
+            shutil.rmtree(directory)
+
 if __name__ == "__main__":
     unittest.main()
@@ -19,11 +19,25 @@
 # limitations under the License.
 
 import json
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
 import unittest
+from cStringIO import StringIO
 
 from titus.reader import yamlToAst
-from titus.genpy import PFAEngine
+from titus.genpy import PFAEngine, accessedInputFields, compileFastAvroCorrector
 from titus.errors import *
+from titus.options import EngineOptions
+import titus.datatype
+import titus.diskpool
+import titus.genpy
+from titus.datatype import checkData
+from avro.datafile import DataFileReader, DataFileWriter
+from avro.io import DatumReader, DatumWriter
     
 class TestGeneratePython(unittest.TestCase):
     def testMetadataAccessName(self):
@@ -4110,6 +4124,30 @@ options:
             engine.action("hey")
         self.assertRaises(PFATimeoutException, go)
 
+    def testRoutineSpecificTimeouts(self):
+        engine, = PFAEngine.fromYaml('''
+input: int
+output: int
+begin:
+  - for: {x: 0}
+    while: {"!=": [x, -5]}
+    step: {x: {+: [x, 1]}}
+    do: [x]
+action:
+  - for: {x: 0}
+    while: {"<": [x, input]}
+    step: {x: {+: [x, 1]}}
+    do: [x]
+  - input
+options:
+  timeout.begin: 100
+''')
+        self.assertEqual(engine.options.timeout, -1)
+        self.assertEqual(engine.options.timeout_begin, 100)
+        self.assertEqual(engine.options.timeout_action, -1)
+        self.assertRaises(PFATimeoutException, lambda: engine.begin())
+        self.assertEqual(engine.action(100000), 100000)
+
     def testBeginAndEnd(self):
         engine, = PFAEngine.fromYaml('''
 input: string
@@ -4421,6 +4459,145 @@ pools:
         self.assertEqual(engine.action(False), 4)
         self.assertEqual(engine.action(False), 5)
 
+    def testRollbackJournal(self):
+        engine, = PFAEngine.fromYaml("""
+input: string
+output: int
+action:
+  - cell: x
+    to: {params: [{y: int}], ret: int, do: {+: [y, 1]}}
+  - cell: x
+    to: {params: [{y: int}], ret: int, do: {+: [y, 10]}}
+  - pool: p
+    path: [input]
+    init: 0
+    to: {params: [{y: int}], ret: int, do: {+: [y, 1]}}
+  - pool: p
+    path: [[a]]
+    init: 0
+    to: {params: [{y: int}], ret: int, do: {+: [y, 100]}}
+  - if: {"==": [input, {string: crash}]}
+    then: {error: "crash!"}
+  - cell: x
+cells:
+  x: {type: int, init: 0, rollback: true}
+pools:
+  p: {type: int, init: {a: 1, b: 2}, rollback: true}
+""")
+        self.assertEqual(engine.action("b"), 11)
+        self.assertRaises(PFAUserException, lambda: engine.action("crash"))
+        self.assertEqual(engine.cells["x"].value, 11)
+        self.assertEqual(engine.pools["p"].value, {"a": 101, "b": 3})
+
+        self.assertRaises(PFAUserException, lambda: engine.actionBatch(["a", "crash"]))
+        self.assertEqual(engine.cells["x"].value, 22)
+        self.assertEqual(engine.pools["p"].value, {"a": 202, "b": 3})
+
+    def testPathUpdatesDoNotAlias(self):
+        engine, = PFAEngine.fromYaml("""
+input: "null"
+output: {type: array, items: int}
+action:
+  - let: {before: {cell: m}}
+  - cell: m
+    path: [{string: a}, {string: x}]
+    to: {params: [{y: int}], ret: int, do: {+: [y, 1]}}
+  - let:
+      inner: {cell: m, path: [{string: a}]}
+      item: {pool: p, path: [{string: a}]}
+  - cell: m
+    path: [{string: a}, {string: x}]
+    to: {params: [{y: int}], ret: int, do: {+: [y, 1]}}
+  - pool: p
+    path: [{string: a}, {string: x}]
+    init: {value: {}, type: {type: map, values: int}}
+    to: {params: [{y: int}], ret: int, do: {+: [y, 1]}}
+  - pool: p
+    path: [{string: a}, {string: x}]
+    init: {value: {}, type: {type: map, values: int}}
+    to: {params: [{y: int}], ret: int, do: {+: [y, 1]}}
+  - cell: saved
+    to: {cell: m, path: [{string: b}]}
+  - cell: m
+    path: [{string: b}, {string: x}]
+    to: {params: [{y: int}], ret: int, do: {+: [y, 1]}}
+  - cell: m
+    path: [{string: b}, {string: x}]
+    to: {params: [{y: int}], ret: int, do: {+: [y, 1]}}
+  - let:
+      returned:
+        cell: m
+        path: [{string: a}, {string: x}]
+        to: {params: [{y: int}], ret: int, do: {+: [y, 1]}}
+  - cell: m
+    path: [{string: a}, {string: x}]
+    to: {params: [{y: int}], ret: int, do: {+: [y, 1]}}
+  - new:
+      - {attr: before, path: [{string: a}, {string: x}]}
+      - {attr: inner, path: [{string: x}]}
+      - {attr: item, path: [{string: x}]}
+      - {cell: saved, path: [{string: x}]}
+      - {attr: returned, path: [{string: a}, {string: x}]}
+      - {cell: m, path: [{string: a}, {string: x}]}
+      - {cell: m, path: [{string: b}, {string: x}]}
+      - {pool: p, path: [{string: a}, {string: x}]}
+    type: {type: array, items: int}
+cells:
+  m: {type: {type: map, values: {type: map, values: int}}, init: {a: {x: 1}, b: {x: 2}}}
+  saved: {type: {type: map, values: int}, init: {}}
+pools:
+  p: {type: {type: map, values: int}, init: {a: {x: 1}}}
+""")
+        self.assertEqual(engine.action(None), [1, 2, 1, 2, 4, 5, 4, 3])
+        held = engine.cells["m"].value
+        self.assertEqual(engine.action(None), [5, 6, 3, 4, 8, 9, 6, 5])
+        self.assertEqual(held, {"a": {"x": 5}, "b": {"x": 4}})
+
+    def testConcurrentSharedUpdates(self):
+        engines = PFAEngine.fromYaml("""
+input: string
+output: "null"
+action:
+  - cell: total
+    to: {params: [{y: int}], ret: int, do: {+: [y, 1]}}
+  - pool: counts
+    path: [input]
+    init: 0
+    to: {params: [{y: int}], ret: int, do: {+: [y, 1]}}
+  - cell: logged
+    to: {params: [{y: int}], ret: int, do: [{log: [y]}, {+: [y, 1]}]}
+  - null
+cells:
+  total: {type: int, init: 0, shared: true}
+  logged: {type: int, init: 0, shared: true}
+pools:
+  counts: {type: int, init: {}, shared: true}
+""", multiplicity=4)
+        logs = []
+        for engine in engines:
+            engine.log = lambda message, namespace: logs.append(message)
+
+        def run(engine):
+            for i in xrange(300):
+                engine.action(str(i % 100))
+
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            threads = [threading.Thread(target=run, args=(engine,)) for engine in engines]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(interval)
+
+        self.assertEqual(engines[0].cells["total"].value, 1200)
+        self.assertEqual(engines[0].cells["logged"].value, 1200)
+        self.assertEqual(len(logs), 1200)
+        self.assertEqual(engines[0].pools["counts"].value, dict((str(i), 12) for i in xrange(100)))
+        self.assertEqual(len(engines[0].pools["counts"].locks), engines[0].pools["counts"].lockStripes)
+
     def testCallUserFunction(self):
         engine, = PFAEngine.fromYaml('''
 input:
@@ -4672,5 +4849,512 @@ action:
         self.assertRaises(PFAUserException, lambda: engine.action(4))
         self.assertEqual(engine.action(5), 5)
 
+    def testActionBatchMap(self):
+        engine, = PFAEngine.fromYaml('''
+input: int
+output: long
+cells:
+  total: {type: int, init: 0, rollback: true}
+action:
+  - {cell: total, to: {params: [{x: int}], ret: int, do: {"+": [x, input]}}}
+  - if: {">": [input, 100]}
+    then: {error: "too big"}
+  - {"+": [{cell: total}, actionsStarted]}
+''')
+        self.assertEqual(engine.actionBatch([1, 2, 3]), [2, 5, 9])
+        self.assertEqual(engine.actionBatch(iter([4])), [14])
+        self.assertRaises(PFAUserException, lambda: engine.actionBatch([5, 1000]))
+        self.assertEqual(engine.cells["total"].value, 15)
+        self.assertEqual(engine.actionsStarted, 6)
+        self.assertEqual(engine.actionsFinished, 5)
+
+    def testActionBatchEmit(self):
+        engine, = PFAEngine.fromYaml('''
+input: int
+output: int
+method: emit
+action:
+  - for: {i: 0}
+    while: {"<": [i, input]}
+    step: {i: {"+": [i, 1]}}
+    do: {emit: i}
+''')
+        collected = []
+        engine.emit = collected.append
+        self.assertEqual(list(engine.actionBatch([2, 0, 3])), [0, 1, 0, 1, 2])
+        self.assertEqual(collected, [])
+        engine.action(1)
+        self.assertEqual(collected, [0])
+
+    def testActionBatchFold(self):
+        engine, = PFAEngine.fromYaml('''
+input: int
+output: int
+method: fold
+zero: 0
+action: {"+": [input, tally]}
+merge: {"+": [tallyOne, tallyTwo]}
+''')
+        self.assertEqual(engine.actionBatch(xrange(5)), [0, 1, 3, 6, 10])
+        self.assertEqual(engine.tally, 10)
+
+    def testInitialValuesSharedAcrossInstances(self):
+        one, two = PFAEngine.fromYaml('''
+input: string
+output: int
+cells:
+  counts: {type: {type: array, items: int}, init: [1, 2, 3]}
+pools:
+  seen: {type: int, init: {a: 1}}
+action:
+  - cell: counts
+    path: [0]
+    to: 100
+  - pool: seen
+    path: [input]
+    to: {params: [{x: int}], ret: int, do: {"+": [x, 1]}}
+    init: 0
+''', multiplicity=2)
+        self.assertIs(one.cells["counts"].value, two.cells["counts"].value)
+        self.assertIs(one.pools["seen"].value, two.pools["seen"].value)
+
+        self.assertEqual(one.action("a"), 2)
+        self.assertEqual(one.action("b"), 1)
+        self.assertEqual(one.cells["counts"].value, [100, 2, 3])
+        self.assertEqual(two.cells["counts"].value, [1, 2, 3])
+        self.assertEqual(one.pools["seen"].value, {"a": 2, "b": 1})
+        self.assertEqual(two.pools["seen"].value, {"a": 1})
+        self.assertEqual(two.action("a"), 2)
+
+    def testCompiledEngineCache(self):
+        pfa = '''
+input: int
+output: int
+cells:
+  counter: {type: {type: record, name: Counter, fields: [{name: n, type: int}]}, init: {n: 10}}
+pools:
+  seen: {type: int, init: {one: 1}}
+action:
+  - cell: counter
+    path: [[n]]
+    to: {params: [{x: int}], ret: int, do: {"+": [x, input]}}
+  - {"+": [{cell: counter, path: [[n]]}, {pool: seen, path: [[one]]}]}
+'''
+        cache = tempfile.mkdtemp()
+        try:
+            cold = PFAEngine.fromYaml(pfa, multiplicity=2, cache=cache)
+            fileNames = os.listdir(cache)
+            self.assertEqual(len(fileNames), 1)
+
+            warm = PFAEngine.fromYaml(pfa, multiplicity=2, cache=cache)
+            self.assertEqual(os.listdir(cache), fileNames)
+            for engines in cold, warm:
+                self.assertEqual(engines[0].action(5), 16)
+                self.assertEqual(engines[0].action(5), 21)
+                self.assertEqual(engines[1].action(1), 12)
+            self.assertEqual(json.loads(warm[0].snapshot().toJson(False))["cells"], json.loads(cold[0].snapshot().toJson(False))["cells"])
+
+            with open(os.path.join(cache, fileNames[0]), "wb") as f:
+                f.write("corrupted")
+            engine, = PFAEngine.fromYaml(pfa, cache=cache)
+            self.assertEqual(engine.action(5), 16)
+
+            engine, = PFAEngine.fromYaml(pfa.replace("n: 10", "n: 20"), cache=cache)
+            self.assertEqual(engine.action(5), 26)
+            self.assertEqual(len(os.listdir(cache)), 2)
+        finally:
+            shutil.rmtree(cache)
+
+    def testProfile(self):
+        pfa = '''
+name: Profiled
+input: double
+output: double
+action:
+  - {u.f: [{m.sqrt: input}]}
+fcns:
+  f:
+    params: [{x: double}]
+    ret: double
+    do: {m.exp: {u.g: x}}
+  g:
+    params: [{x: double}]
+    ret: double
+    do: {"*": [x, 2]}
+'''
+        engine, = PFAEngine.fromYaml(pfa)
+        self.assertRaises(PFAInitializationException, lambda: engine.profileReport())
+        for style in "pure", "fast":
+            self.assertTrue("profiler" not in PFAEngine.compileAst(yamlToAst(pfa), EngineOptions(None, None), style, True)[0])
+            self.assertTrue("profiler" in PFAEngine.compileAst(yamlToAst(pfa), EngineOptions(None, None), style, True, True)[0])
+
+        engine, = PFAEngine.fromYaml(pfa, profile=True)
+        for x in xrange(10):
+            engine.action(float(x))
+        report = dict((x["name"], x) for x in engine.profileReport())
+        self.assertEqual(set(report), set(["action", "u.f", "u.g", "m.sqrt", "m.exp", "*"]))
+        for x in report.values():
+            self.assertEqual(x["calls"], 10)
+        self.assertEqual(report["m.exp"]["pos"], "in field fcns.f.do of object from YAML line 10")
+        self.assertTrue(report["action"]["cumulativeTime"] >= report["u.f"]["cumulativeTime"] >= report["u.g"]["cumulativeTime"])
+
+        fd, fileName = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            engine.profileDump(fileName)
+            stats = pstats.Stats(fileName).stats
+        finally:
+            os.remove(fileName)
+        self.assertEqual(stats[("Profiled", 10, "m.exp [fcns.f.do]")][:2], (10, 10))
+        self.assertEqual(stats[("Profiled", 10, "m.exp [fcns.f.do]")][4].keys(), [("Profiled", 8, "u.f [fcns.f]")])
+
+    def testProfileEmitAndFold(self):
+        engine, = PFAEngine.fromYaml('''
+input: double
+output: double
+method: emit
+action:
+  - emit: [{m.sqrt: input}]
+''', profile=True)
+        emitted = []
+        engine.emit = emitted.append
+        for x in xrange(4):
+            engine.action(float(x * x))
+        self.assertEqual(emitted, [0.0, 1.0, 2.0, 3.0])
+        report = dict((x["name"], x) for x in engine.profileReport())
+        self.assertEqual(set(report), set(["action", "emit", "m.sqrt"]))
+        self.assertEqual(report["emit"]["calls"], 4)
+
+        engine, = PFAEngine.fromYaml('''
+input: int
+output: int
+method: fold
+zero: 0
+action: {"+": [tally, input]}
+merge: {"+": [tallyOne, tallyTwo]}
+''', profile=True)
+        for x in xrange(5):
+            engine.action(x)
+        self.assertEqual(engine.tally, 10)
+        self.assertEqual(engine.merge(3, 4), 7)
+        report = engine.profileReport()
+        self.assertEqual(sorted((x["name"], x["calls"]) for x in report), [("+", 1), ("+", 5), ("action", 5), ("merge", 1)])
+
+    def testMetrics(self):
+        pfa = '''
+input: int
+output: int
+method: emit
+cells:
+  total: {type: int, init: 0}
+pools:
+  seen: {type: int, init: {}}
+action:
+  - cell: total
+    to: {params: [{x: int}], ret: int, do: {"+": [x, input]}}
+  - pool: seen
+    path: [{s.number: input}]
+    init: 0
+    to: {params: [{x: int}], ret: int, do: {"+": [x, 1]}}
+  - if: {"<": [input, 0]}
+    then: {error: "negative", code: -7}
+  - log: [input]
+  - emit: input
+  - emit: {cell: total}
+'''
+        engine, = PFAEngine.fromYaml(pfa)
+        self.assertRaises(PFAInitializationException, lambda: engine.metricsSnapshot())
+
+        engine, = PFAEngine.fromYaml(pfa, metrics=True)
+        engine.log = lambda message, namespace: None
+        emitted = []
+        engine.emit = emitted.append
+        for x in [1, 2, 3, 2, -1]:
+            try:
+                engine.action(x)
+            except PFAUserException:
+                pass
+
+        metrics = engine.metricsSnapshot()
+        self.assertEqual(json.loads(json.dumps(metrics)), metrics)
+        self.assertEqual(len(emitted), 8)
+        self.assertEqual(metrics["emitted"], 8)
+        self.assertEqual(metrics["logged"], 4)
+        self.assertEqual(metrics["actionsStarted"], 5)
+        self.assertEqual(metrics["actionsFinished"], 4)
+        self.assertEqual(metrics["exceptions"], {"PFAUserException/-7": 1})
+        self.assertEqual(metrics["cellUpdates"], {"total": 5})
+        self.assertEqual(metrics["poolUpdates"], {"seen": 5})
+        self.assertEqual(metrics["poolSizes"], {"seen": 4})
+        self.assertEqual(set(metrics["latency"]), set(["action"]))
+        self.assertEqual(metrics["latency"]["action"]["count"], 5)
+        self.assertEqual(sum(count for bound, count in metrics["latency"]["action"]["buckets"]), 5)
+
+    def testDiskPool(self):
+        pfa = '''
+input: int
+output: {type: array, items: double}
+pools:
+  sums:
+    type: {type: array, items: double}
+    init: {"0": [0.0, 0.0]}
+    rollback: true
+action:
+  - pool: sums
+    path: [{s.number: {"%": [input, 37]}}]
+    init: {value: [0.0, 0.0], type: {type: array, items: double}}
+    to: {params: [{x: {type: array, items: double}}], ret: {type: array, items: double}, do: {a.replace: [x, 0, {+: [{attr: x, path: [0]}, input]}]}}
+  - pool: sums
+    path: [{s.number: {"%": [input, 37]}}, 1]
+    init: {value: [0.0, 0.0], type: {type: array, items: double}}
+    to: {params: [{x: double}], ret: double, do: {+: [x, 1]}}
+  - if: {"==": [input, 1000]}
+    then: {error: "rolled back"}
+  - {pool: sums, path: [{s.number: {"%": [input, 37]}}]}
+'''
+        memory, = PFAEngine.fromYaml(pfa)
+        disk, = PFAEngine.fromYaml(pfa, options={"pool.sums.storage": "disk", "pool.sums.cacheSize": 5})
+        self.assertTrue(isinstance(disk.pools["sums"].value, titus.diskpool.DiskStore))
+
+        for x in range(200) + [1000, 1000 + 37] + range(50):
+            try:
+                self.assertEqual(disk.action(x), memory.action(x))
+            except PFAUserException:
+                self.assertRaises(PFAUserException, lambda: memory.action(x))
+
+        self.assertEqual(len(disk.pools["sums"].value), 37)
+        self.assertEqual(dict(disk.pools["sums"].value.items()), memory.pools["sums"].value)
+        self.assertEqual(disk.snapshot().pools["sums"].init, memory.snapshot().pools["sums"].init)
+
+        buf = StringIO()
+        disk.snapshotAvro(buf)
+        restored, = PFAEngine.fromYaml(pfa, options={"pool.sums.storage": "disk", "pool.sums.cacheSize": 5})
+        restored.restoreAvro(StringIO(buf.getvalue()))
+        self.assertTrue(isinstance(restored.pools["sums"].value, titus.diskpool.DiskStore))
+        self.assertEqual(restored.action(5), memory.action(5))
+
+        self.assertRaises(PFAInitializationException, lambda: PFAEngine.fromYaml(pfa, options={"pool.other.storage": "disk"}))
+        self.assertRaises(PFAInitializationException, lambda: PFAEngine.fromYaml(pfa, options={"pool.sums.storage": "tape"}))
+
+    def testCheckEvery(self):
+        pfa = '''
+input: {type: record, name: R, fields: [{name: x, type: double}]}
+output: double
+action: {+: [input.x, 1]}
+'''
+        engine, = PFAEngine.fromYaml(pfa)
+        self.assertEqual(engine.action({"x": 1}), 2.0)
+        self.assertRaises(TypeError, lambda: engine.action({"y": 1}))
+
+        engine, = PFAEngine.fromYaml(pfa, options={"data.checkEvery": 3})
+        self.assertRaises(TypeError, lambda: engine.action({"y": 1}))
+        self.assertEqual(engine.action({"x": 1.0}), 2.0)
+        self.assertEqual(engine.action({"x": 2.0}), 3.0)
+        self.assertRaises(TypeError, lambda: engine.action({"y": 1}))
+
+        self.assertRaises(PFAInitializationException, lambda: PFAEngine.fromYaml(pfa, options={"data.checkEvery": 0}))
+
+    def testTitusAvroInterpreter(self):
+        engine, = PFAEngine.fromYaml('''
+input: {type: record, name: R, fields: [{name: x, type: double}, {name: tag, type: ["null", string, {type: array, items: int}]}]}
+output: {type: record, name: Out, fields: [{name: x, type: double}, {name: tag, type: ["null", string]}]}
+action:
+  - let:
+      tag:
+        cast: input.tag
+        cases:
+          - {as: string, named: s, do: s}
+          - {as: "null", named: n, do: null}
+          - {as: {type: array, items: int}, named: a, do: null}
+  - new: {x: {"*": [input.x, 2]}, tag: tag}
+    type: Out
+''')
+        inputs = [{"x": 1.0, "tag": None}, {"x": 2.5, "tag": u"cafe"}, {"x": -3.0, "tag": [1, 2, 3]}]
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            inputFileName = os.path.join(tmpdir, "input.avro")
+            outputFileName = os.path.join(tmpdir, "output.avro")
+
+            writer = DataFileWriter(open(inputFileName, "wb"), DatumWriter(), engine.config.input.schema)
+            for x in inputs:
+                writer.append(x)
+            writer.close()
+
+            expected = [engine.action(x) for x in engine.avroInputIterator(open(inputFileName, "rb"))]
+            decoded = list(engine.avroInputIterator(open(inputFileName, "rb"), "titus"))
+            self.assertEqual(decoded, [checkData(x, engine.config.input) for x in inputs])
+            self.assertEqual([engine.action(x, check=False) for x in decoded], expected)
+
+            writer = engine.avroOutputDataFileWriter(outputFileName, "titus")
+            for x in decoded:
+                writer.append(engine.action(x, check=False))
+            writer.close()
+            self.assertEqual(list(DataFileReader(open(outputFileName, "rb"), DatumReader())), expected)
+
+            self.assertRaises(ValueError, lambda: engine.avroInputIterator(open(inputFileName, "rb"), "tape"))
+
+            otherFileName = os.path.join(tmpdir, "other.avro")
+            other = PFAEngine.fromYaml('''
+input: {type: record, name: R, fields: [{name: x, type: double}, {name: tag, type: ["null", string, {type: array, items: long}]}]}
+output: double
+action: input.x
+''')[0].config.input
+            writer = DataFileWriter(open(otherFileName, "wb"), DatumWriter(), other.schema)
+            writer.append({"x": 1.0, "tag": [1, 2, 3]})
+            writer.close()
+            self.assertRaises(AvroException, lambda: engine.avroInputIterator(open(otherFileName, "rb"), "titus"))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testInputProjection(self):
+        inputType = '''
+input:
+  type: record
+  name: R
+  fields:
+    - {name: x, type: double}
+    - {name: s, type: string}
+    - {name: xs, type: {type: array, items: {type: record, name: P, fields: [{name: a, type: string}, {name: b, type: bytes}]}}}
+    - {name: m, type: {type: map, values: ["null", int, string]}}
+    - {name: f, type: {type: fixed, name: F, size: 3}}
+    - {name: e, type: {type: enum, name: E, symbols: [A, B]}}
+    - {name: u, type: ["null", P]}
+    - {name: y, type: {type: record, name: Y, fields: [{name: z, type: float}, {name: w, type: boolean}]}}
+'''
+        engine, = PFAEngine.fromYaml(inputType + '''
+output: double
+action: {+: [input.x, input.y.z]}
+''')
+        self.assertEqual(accessedInputFields(engine.config), set(["x", "y"]))
+
+        whole, = PFAEngine.fromYaml(inputType + '''
+output: double
+fcns:
+  f: {params: [{r: R}], ret: double, do: r.x}
+action: {u.f: [input]}
+''')
+        self.assertTrue(accessedInputFields(whole.config) is None)
+        self.assertTrue(accessedInputFields(PFAEngine.fromYaml("input: double\noutput: double\naction: input")[0].config) is None)
+
+        inputs = [{"x": float(i), "s": u"string" * i, "xs": [{"a": u"a", "b": "b"}] * i, "m": {u"one": 1, u"two": u"zwei", u"three": None},
+                   "f": "abc", "e": "B", "u": None if i % 2 else {"a": u"", "b": ""}, "y": {"z": 0.5, "w": True}} for i in range(10)]
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            inputFileName = os.path.join(tmpdir, "input.avro")
+            writer = DataFileWriter(open(inputFileName, "wb"), DatumWriter(), engine.config.input.schema)
+            for x in inputs:
+                writer.append(x)
+            writer.close()
+
+            full = list(engine.avroInputIterator(open(inputFileName, "rb"), "titus"))
+            self.assertEqual(full, [checkData(x, engine.config.input) for x in inputs])
+            self.assertEqual([engine.action(x) for x in full], [x["x"] + 0.5 for x in inputs])
+
+            projected = list(engine.avroInputIterator(open(inputFileName, "rb"), "titus", project=True))
+            self.assertEqual(projected, [{"x": x["x"], "y": x["y"]} for x in inputs])
+            self.assertEqual([engine.action(x, check=False) for x in projected], [x["x"] + 0.5 for x in inputs])
+            self.assertRaises(TypeError, lambda: engine.action(projected[0]))
+            self.assertEqual(list(whole.avroInputIterator(open(inputFileName, "rb"), "titus", project=True)), [checkData(x, whole.config.input) for x in inputs])
+            self.assertRaises(ValueError, lambda: engine.avroInputIterator(open(inputFileName, "rb"), "avro", project=True))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testFastAvroCorrector(self):
+        engine, = PFAEngine.fromYaml('''
+input:
+  type: record
+  name: R
+  fields:
+    - {name: x, type: double}
+    - {name: xs, type: {type: array, items: int}}
+    - {name: s, type: string}
+    - {name: b, type: bytes}
+    - {name: m, type: {type: map, values: {type: array, items: string}}}
+    - {name: u, type: ["null", int, string, {type: record, name: A, fields: [{name: a, type: string}]}, {type: record, name: B, fields: [{name: b, type: int}]}, {type: map, values: string}]}
+output: double
+action: input.x
+''')
+        correct = compileFastAvroCorrector(engine.config.input)
+        datum = lambda u: {"x": 1.5, "xs": [1, 2], "s": "caf\xc3\xa9", "b": u"raw", "m": {"k": ["v"]}, "u": u}
+
+        out = correct(datum(None))
+        self.assertEqual(out, {"x": 1.5, "xs": [1, 2], "s": u"caf\u00e9", "b": "raw", "m": {u"k": [u"v"]}, "u": None})
+        self.assertTrue(isinstance(out["s"], unicode) and isinstance(out["b"], str) and isinstance(out["m"].keys()[0], unicode))
+
+        self.assertEqual(correct(datum(3))["u"], 3)
+        self.assertTrue(isinstance(correct(datum("str"))["u"], unicode))
+        self.assertTrue(isinstance(correct(datum({"a": "one"}))["u"]["a"], unicode))
+        self.assertEqual(correct(datum({"b": 2}))["u"], {"b": 2})
+        self.assertTrue(isinstance(correct(datum({"c": "d"}))["u"].values()[0], unicode))
+        self.assertEqual(engine.action(correct(datum("str"))), 1.5)
+
+        numeric = titus.datatype.AvroRecord([titus.datatype.AvroField("x", titus.datatype.AvroDouble()), titus.datatype.AvroField("xs", titus.datatype.AvroArray(titus.datatype.AvroInt()))], "N")
+        self.assertTrue(titus.genpy._fastAvroCorrection(numeric, {}) is None)
+
+class TestGeneratePythonFast(TestGeneratePython):
+    def setUp(self):
+        self.fromYaml = PFAEngine.fromYaml
+        self.fromJson = PFAEngine.fromJson
+        PFAEngine.fromYaml = staticmethod(lambda src, options=None, sharedState=None, multiplicity=1, style="fast", debug=False, optimize=True, cache=None, profile=False, metrics=False: self.fromYaml(src, options, sharedState, multiplicity, style, debug, optimize, cache, profile, metrics))
+        PFAEngine.fromJson = staticmethod(lambda src, options=None, sharedState=None, multiplicity=1, style="fast", debug=False, optimize=True, cache=None, profile=False, metrics=False: self.fromJson(src, options, sharedState, multiplicity, style, debug, optimize, cache, profile, metrics))
+
+    def tearDown(self):
+        PFAEngine.fromYaml = staticmethod(self.fromYaml)
+        PFAEngine.fromJson = staticmethod(self.fromJson)
+
+    def testStatementsInsideExpressions(self):
+        engine, = PFAEngine.fromYaml('''
+input: int
+output: int
+cells:
+  counter: {type: int, init: 0}
+action:
+  - {"+": [{cell: counter, to: {params: [{x: int}], ret: int, do: {"+": [x, 1]}}},
+           {if: {">": [input, 0]}, then: {cell: counter}, else: {cell: counter, to: 100}}]}
+''')
+        self.assertEqual(engine.action(1), 2)
+        self.assertEqual(engine.action(-1), 102)
+
+    def testShortCircuitWithStatements(self):
+        engine, = PFAEngine.fromYaml('''
+input: int
+output: boolean
+action:
+  - {"&&": [{">": [input, 0]}, {if: {">": [input, 5]}, then: {error: "too big"}, else: true}]}
+''')
+        self.assertEqual(engine.action(3), True)
+        self.assertEqual(engine.action(-10), False)
+        self.assertRaises(PFAUserException, lambda: engine.action(10))
+
+    def testUserFunctionsArePositional(self):
+        engine, = PFAEngine.fromYaml('''
+input: int
+output: {type: array, items: int}
+cells:
+  total: {type: int, init: 0}
+action:
+  - {cell: total, to: {fcn: u.add, fill: {y: input}}}
+  - {a.map: [{new: [1, 2, 3, 4], type: {type: array, items: int}}, {fcn: u.fact}]}
+  - {a.map: [{new: [{cell: total}], type: {type: array, items: int}}, {fcn: u.add, fill: {y: 10}}]}
+fcns:
+  fact:
+    params: [{n: int}]
+    ret: int
+    do:
+      if: {"<=": [n, 1]}
+      then: 1
+      else: {"*": [n, {u.fact: [{"-": [n, 1]}]}]}
+  add:
+    params: [{x: int}, {y: int}]
+    ret: int
+    do: {"+": [x, y]}
+''')
+        self.assertEqual(engine.action(5), [15])
+        self.assertEqual(engine.action(2), [17])
+        self.assertEqual(engine.f["u.fact"](None, None, None, 5), 120)
+        self.assertFalse(hasattr(engine.f["u.fact"], "paramNames"))
+
 if __name__ == "__main__":
     unittest.main()
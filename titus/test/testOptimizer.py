@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+# 
+# This file is part of Hadrian.
+# 
+# Licensed under the Hadrian Personal Use and Evaluation License (PUEL);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://raw.githubusercontent.com/opendatagroup/hadrian/master/LICENSE
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from titus.reader import yamlToAst
+from titus.genpy import PFAEngine
+from titus.optimizer import optimize, Optimizer
+from titus.pfaast import Ref
+from titus.options import EngineOptions
+from titus.errors import *
+import titus.optimizer
+
+class TestOptimizer(unittest.TestCase):
+    def testFoldPureCalls(self):
+        engineConfig = optimize(yamlToAst('''
+input: double
+output: double
+action:
+  - let: {k: {"*": [{m.sqrt: 16}, {"+": [1.5, 0.5]}]}}
+  - let: {n: {s.len: [{string: hello}]}}
+  - {"+": [input, k]}
+'''))
+        self.assertEqual(engineConfig.action[0].jsonNode(False, set()), {"let": {"k": 8.0}})
+        self.assertEqual(engineConfig.action[1].jsonNode(False, set()), {"let": {"n": 5}})
+
+    def testDoNotFoldRuntimeErrors(self):
+        engineConfig = optimize(yamlToAst('''
+input: int
+output: int
+action: {"+": [2147483647, 1]}
+'''))
+        self.assertEqual(engineConfig.action[0].jsonNode(False, set()), {"+": [2147483647, 1]})
+
+        engine, = PFAEngine.fromYaml('''
+input: int
+output: int
+action: {"+": [2147483647, 1]}
+''')
+        self.assertRaises(PFARuntimeException, lambda: engine.action(0))
+
+    def testDropDeadBranches(self):
+        engineConfig = optimize(yamlToAst('''
+input: int
+output: int
+action:
+  - {doc: "ignored"}
+  - if: {"<": [1, 2]}
+    then: input
+    else: {"u-": [input]}
+  - cond:
+      - {if: false, then: 1}
+      - {if: {"==": [input, 3]}, then: 2}
+      - {if: true, then: 3}
+      - {if: {"==": [input, 4]}, then: 4}
+    else: 5
+'''))
+        self.assertEqual([x.jsonNode(False, set()) for x in engineConfig.action], ["input", {"cond": [{"if": {"==": ["input", 3]}, "then": [2]}], "else": [3]}])
+
+    def testOptimizedEngineBehavesLikeOriginal(self):
+        pfa = '''
+input: int
+output: [int, string]
+action:
+  - let: {x: {do: [{doc: "x"}, {"*": [input, {"+": [1, 1]}]}]}}
+  - if: {"&&": [true, {"!": [false]}]}
+    then: {"+": [x, {m.abs: -3}]}
+    else: {string: "never"}
+'''
+        optimized, = PFAEngine.fromYaml(pfa)
+        original, = PFAEngine.fromYaml(pfa, optimize=False)
+        for x in range(-3, 4):
+            self.assertEqual(optimized.action(x), original.action(x))
+        self.assertEqual(optimized.callGraph, original.callGraph)
+
+    def testFoldedNegativeOperands(self):
+        pfa = '''
+input: double
+output: {type: array, items: double}
+action:
+  type: {type: array, items: double}
+  new:
+    - {"**": [{"u-": 2.0}, input]}
+    - {m.hypot: [{"u-": 3.0}, input]}
+    - {"-": [input, {"u-": 1.0}]}
+    - {"*": [{"u-": {"+": [1.0, 1.0]}}, input]}
+'''
+        self.assertEqual(optimize(yamlToAst(pfa)).action[0].jsonNode(False, set())["new"][0], {"**": [-2.0, "input"]})
+        for style in "pure", "fast":
+            optimized, = PFAEngine.fromYaml(pfa, style=style)
+            original, = PFAEngine.fromYaml(pfa, style=style, optimize=False)
+            for x in 2.0, 3.0, 4.0:
+                self.assertEqual(optimized.action(x), original.action(x))
+            self.assertEqual(optimized.action(2.0), [4.0, 3.605551275463989, 3.0, -4.0])
+
+        intPfa = '''
+input: int
+output: int
+action: {"**": [{"u-": 2}, input]}
+'''
+        self.assertEqual(PFAEngine.fromYaml(intPfa)[0].action(2), 4)
+        self.assertEqual(PFAEngine.fromYaml(intPfa, optimize=False)[0].action(2), 4)
+
+    def testNarrowedTypesFallBackToOriginal(self):
+        pfa = '''
+input: int
+output: int
+action:
+  - let: {x: {if: true, then: input, else: null}}
+  - ifnotnull: {y: x}
+    then: y
+    else: 0
+'''
+        optimizer = Optimizer()
+        optimize(yamlToAst(pfa), optimizer)
+        self.assertTrue(optimizer.narrowed)
+        engine, = PFAEngine.fromYaml(pfa)
+        self.assertEqual(engine.action(3), 3)
+
+        optimizer = Optimizer()
+        optimize(yamlToAst('''
+input: int
+output: "null"
+action: {if: true, then: input}
+'''), optimizer)
+        self.assertFalse(optimizer.narrowed)
+
+    def testOptimizerFailuresAreReported(self):
+        def broken(engineConfig, optimizer):
+            out = optimize(engineConfig, optimizer)
+            out.action[0] = Ref("missing")
+            return out
+        original = titus.optimizer.optimize
+        titus.optimizer.optimize = broken
+        try:
+            engineConfig = yamlToAst('''
+input: int
+output: int
+action: {"+": [input, 1]}
+''')
+            self.assertRaises(PFASemanticException, lambda: PFAEngine.compileAst(engineConfig, EngineOptions(engineConfig.options, None), "pure", True))
+        finally:
+            titus.optimizer.optimize = original
+
+    def testSemanticErrorsInDeadBranchesAreReported(self):
+        self.assertRaises(PFASemanticException, lambda: PFAEngine.fromYaml('''
+input: int
+output: int
+action:
+  if: false
+  then: {"+": [input, {string: "oops"}]}
+  else: input
+'''))
+
+    def testEvaluateRepeatedPathsOnce(self):
+        pfa = '''
+input: {type: record, name: In, fields: [{name: a, type: {type: record, name: A, fields: [{name: b, type: double}]}}, {name: m, type: {type: map, values: double}}]}
+output: double
+cells:
+  one: {type: A, init: {b: 2.0}}
+  two: {type: A, init: {b: 3.0}}
+fcns:
+  bump: {params: [], ret: "null", do: [{cell: two, to: {params: [{old: A}], ret: A, do: {new: {b: {"+": [old.b, 1.0]}}, type: A}}}, null]}
+action:
+  - let: {x: {"*": [input.a.b, input.a.b]}}
+  - let: {y: {"+": [{cell: one, path: [[b]]}, {cell: one, path: [[b]]}]}}
+  - let: {z: {cell: two, path: [[b]]}}
+  - u.bump: []
+  - set: {z: {"+": [z, {cell: two, path: [[b]]}]}}
+  - {"+": [{"+": [x, y]}, {"+": [z, {"+": [input.m.k, input.m.k]}]}]}
+'''
+        engineConfig = optimize(yamlToAst(pfa))
+        self.assertEqual(engineConfig.action[0].jsonNode(False, set()), {"let": {"_path0": {"attr": "input", "path": [{"string": "a"}, {"string": "b"}]}, "_path1": {"cell": "one", "path": [{"string": "b"}]}}})
+        self.assertEqual(engineConfig.action[1].jsonNode(False, set()), {"let": {"x": {"*": ["_path0", "_path0"]}}})
+        self.assertEqual(engineConfig.action[5].jsonNode(False, set()), {"set": {"z": {"+": ["z", {"cell": "two", "path": [{"string": "b"}]}]}}})
+
+        optimized, = PFAEngine.fromYaml(pfa)
+        original, = PFAEngine.fromYaml(pfa, optimize=False)
+        datum = {"a": {"b": 1.5}, "m": {"k": 0.5}}
+        self.assertEqual(optimized.action(datum), original.action(datum))
+        self.assertEqual(optimized.action(datum), 2.25 + 4.0 + 4.0 + 5.0 + 1.0)
+
+    def testDoNotCacheReassignedSymbols(self):
+        engineConfig = optimize(yamlToAst('''
+input: {type: record, name: In, fields: [{name: a, type: int}]}
+output: int
+fcns:
+  f:
+    params: [{r: In}]
+    ret: int
+    do:
+      - let: {x: r.a}
+      - set: {r: {new: {a: 2}, type: In}}
+      - {"+": [x, r.a]}
+action: {u.f: [input]}
+'''))
+        self.assertEqual(engineConfig.fcns["f"].body[0].jsonNode(False, set()), {"let": {"x": {"attr": "r", "path": [{"string": "a"}]}}})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+# 
+# This file is part of Hadrian.
+# 
+# Licensed under the Hadrian Personal Use and Evaluation License (PUEL);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://raw.githubusercontent.com/opendatagroup/hadrian/master/LICENSE
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import cPickle as pickle
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from titus.checkpoint import Checkpointer
+from titus.genpy import PFAEngine
+from titus.processpool import ProcessPool
+from titus.processpool import ProcessPoolScorer
+from titus.processpool import ParallelFold
+from titus.errors import *
+
+class TestProcessPool(unittest.TestCase):
+    def testResultsInOrder(self):
+        scorer = ProcessPoolScorer.fromYaml('''
+input: int
+output: int
+action: {"*": [input, 2]}
+''', processes=3)
+        try:
+            self.assertEqual(scorer.map(range(1000), chunksize=7), [2 * x for x in range(1000)])
+            self.assertEqual(list(scorer.imap(xrange(10))), [2 * x for x in range(10)])
+        finally:
+            scorer.close()
+
+    def testEmitCollectsPerRecord(self):
+        scorer = ProcessPoolScorer.fromYaml('''
+input: int
+output: int
+method: emit
+action:
+  - for: {i: 0}
+    while: {"<": [i, input]}
+    step: {i: {"+": [i, 1]}}
+    do: {emit: [i]}
+''', processes=2)
+        try:
+            self.assertEqual(scorer.map([0, 1, 3]), [[], [0], [0, 1, 2]])
+        finally:
+            scorer.close()
+
+    def testSharedCellsAndPools(self):
+        scorer = ProcessPoolScorer.fromYaml('''
+input: string
+output: int
+cells:
+  total: {type: int, init: 0, shared: true}
+pools:
+  counts: {type: int, init: {a: 100}, shared: true}
+action:
+  - cell: total
+    to: {params: [{x: int}], ret: int, do: {"+": [x, 1]}}
+  - pool: counts
+    path: [input]
+    to: {params: [{x: int}], ret: int, do: {"+": [x, 1]}}
+    init: 0
+''', processes=3)
+        try:
+            outputs = scorer.map(["a", "b", "c"] * 100, chunksize=5)
+            self.assertEqual(sorted(outputs), sorted(range(101, 201) + range(1, 101) + range(1, 101)))
+            self.assertEqual(scorer.sharedState.cells["total"].value, 300)
+            self.assertEqual(dict(scorer.sharedState.pools["counts"].value.items()), {"a": 200, "b": 100, "c": 100})
+        finally:
+            scorer.close()
+
+    def testErrorsAreRaisedInOrder(self):
+        scorer = ProcessPoolScorer.fromYaml('''
+input: int
+output: int
+action:
+  if: {"==": [input, 5]}
+  then: {error: "five"}
+  else: input
+''', processes=2)
+        try:
+            outputs = []
+            def consume():
+                for x in scorer.imap(range(10), chunksize=2):
+                    outputs.append(x)
+            self.assertRaises(PFAUserException, consume)
+            self.assertEqual(outputs, [0, 1, 2, 3])
+            self.assertEqual(scorer.map(range(3)), [0, 1, 2])
+        finally:
+            scorer.close()
+
+    foldDocument = '''
+input: int
+output: {type: array, items: int}
+method: fold
+zero: []
+action: {a.append: [tally, input]}
+merge: {a.concat: [tallyOne, tallyTwo]}
+'''
+
+    def testParallelFoldPartitions(self):
+        folder = ParallelFold.fromYaml(self.foldDocument, processes=2)
+        try:
+            self.assertEqual(folder.fold([range(0, 3), range(3, 5), [], range(5, 10), range(10, 11)]), range(11))
+            self.assertEqual(folder.tally, range(11))
+            self.assertEqual([x["records"] for x in folder.partitionStats], [3, 2, 0, 5, 1])
+
+            self.assertEqual(folder.foldStream(xrange(1000), partitionSize=64), range(1000))
+            self.assertEqual(len(folder.partitionStats), 16)
+
+            self.assertEqual(folder.fold([]), [])
+        finally:
+            folder.close()
+
+    def testParallelFoldFileSet(self):
+        directory = tempfile.mkdtemp()
+        try:
+            fileNames = []
+            for i in xrange(5):
+                fileNames.append(os.path.join(directory, "part{0}.json".format(i)))
+                with open(fileNames[-1], "w") as f:
+                    for x in xrange(i * 10, (i + 1) * 10):
+                        f.write(json.dumps(x) + "\n")
+
+            folder = ParallelFold.fromYaml(self.foldDocument, processes=3, reader=lambda engine, fileName: (json.loads(line) for line in open(fileName)))
+            try:
+                self.assertEqual(folder.fold(fileNames), range(50))
+                engine, = PFAEngine.fromYaml(self.foldDocument)
+                for x in range(50):
+                    engine.action(x)
+                self.assertEqual(folder.tally, engine.tally)
+            finally:
+                folder.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def testParallelFoldRequiresFold(self):
+        self.assertRaises(PFAInitializationException, lambda: ParallelFold.fromYaml('''
+input: int
+output: int
+action: input
+'''))
+
+    def testEndErrorsAreRaisedByClose(self):
+        scorer = ProcessPoolScorer.fromYaml('''
+input: int
+output: int
+action: input
+end: {error: "ending"}
+''', processes=2)
+        self.assertEqual(scorer.map(range(3)), [0, 1, 2])
+        self.assertRaises(PFAUserException, scorer.close)
+
+    def testDeadWorkersAreReported(self):
+        def handler(engine, payload):
+            if payload == 3:
+                os._exit(7)
+            return engine.action(payload)
+        pool = ProcessPool(PFAEngine.fromYaml("input: int\noutput: int\naction: input")[0].config, 2, None, "pure", True, handler)
+        pool.pollSeconds = 0.1
+        try:
+            outputs = []
+            def consume():
+                for x in pool.run(range(10)):
+                    outputs.append(x)
+            self.assertRaises(RuntimeError, consume)
+            self.assertEqual(outputs, range(len(outputs)))
+            self.assertTrue(len(outputs) <= 3)
+            self.assertRaises(RuntimeError, lambda: list(pool.run(range(3))))
+        finally:
+            pool.close()
+        self.assertTrue(all(not x.is_alive() for x in pool.processes))
+
+    def testUnpicklableResultsAreReported(self):
+        def handler(engine, payload):
+            if payload == "value":
+                return lambda: None
+            elif payload == "error":
+                raise ValueError(lambda: None)
+            return engine.action(payload)
+        pool = ProcessPool(PFAEngine.fromYaml("input: int\noutput: int\naction: input")[0].config, 2, None, "pure", True, handler)
+        try:
+            for bad in "value", "error":
+                outputs = []
+                def consume():
+                    for x in pool.run([1, 2, bad, 3]):
+                        outputs.append(x)
+                self.assertRaises(pickle.PicklingError, consume)
+                self.assertEqual(outputs, [1, 2])
+            self.assertEqual(list(pool.run([1, 2, 3])), [1, 2, 3])
+        finally:
+            pool.close()
+
+    def testSharedStateCannotBeTracked(self):
+        scorer = ProcessPoolScorer.fromYaml('''
+input: int
+output: int
+cells:
+  total: {type: int, init: 0, shared: true}
+action: input
+''', processes=2)
+        try:
+            self.assertRaises(PFAInitializationException, lambda: Checkpointer(scorer.engines[0], "checkpoints"))
+            self.assertRaises(PFAInitializationException, lambda: scorer.sharedState.cells["total"].track())
+            self.assertRaises(PFAInitializationException, lambda: PFAEngine.fromYaml('''
+input: int
+output: int
+cells:
+  total: {type: int, init: 0, shared: true}
+action: input
+''', sharedState=scorer.sharedState, metrics=True))
+        finally:
+            scorer.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,589 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Hadrian.
+#
+# Licensed under the Hadrian Personal Use and Evaluation License (PUEL);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://raw.githubusercontent.com/opendatagroup/hadrian/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import struct
+import zlib
+from cStringIO import StringIO
+
+import avro.schema
+
+import titus.datatype
+from titus.errors import AvroException
+
+########################### primitives
+
+smallLongs = [chr(i << 1) for i in xrange(64)]
+floatStruct = struct.Struct("<f")
+doubleStruct = struct.Struct("<d")
+
+def writeLong(x, out):
+    if 0 <= x < 64:
+        out.append(smallLongs[x])
+        return
+    x = (x << 1) ^ (x >> 63)
+    while x > 0x7F:
+        out.append(chr((x & 0x7F) | 0x80))
+        x >>= 7
+    out.append(chr(x))
+
+def writeBytes(x, out):
+    writeLong(len(x), out)
+    out.append(x)
+
+def writeString(x, out):
+    if isinstance(x, unicode):
+        x = x.encode("utf-8")
+    writeLong(len(x), out)
+    out.append(x)
+
+def readLong(read):
+    b = ord(read(1))
+    n = b & 0x7F
+    shift = 7
+    while b & 0x80:
+        b = ord(read(1))
+        n |= (b & 0x7F) << shift
+        shift += 7
+    return (n >> 1) ^ -(n & 1)
+
+def readBytes(read):
+    return read(readLong(read))
+
+def readString(read):
+    return read(readLong(read)).decode("utf-8")
+
+########################### compiled encoders and decoders
+
+encoders = {}
+decoders = {}
+
+def encoder(avroType):
+    """Return a function ``encode(datum, out)`` that appends the Avro binary encoding of ``datum`` to the list ``out``.
+
+    Functions are compiled once per type and cached. Unions accept both tagged (``{"int": 3}``) and untagged values.
+    """
+    key = repr(avroType)
+    if key not in encoders:
+        encoders[key] = compileEncoder(avroType, {})
+    return encoders[key]
+
+def decoder(avroType, tagged=False, fields=None):
+    """Return a function ``decode(read)`` that reads one datum of ``avroType`` using the file-like ``read`` method.
+
+    Strings decode to unicode, bytes and fixed to str, and unions to their untagged values. With ``tagged=True``, non-null union
+    values are wrapped as ``{typeName: value}``, which is the form ``checkData`` produces, so the result can go straight to
+    ``engine.action(datum, check=False)``.
+
+    If ``avroType`` is a record and ``fields`` is a collection of field names, only those fields are decoded; the others are
+    skipped over in the byte stream and left out of the result.
+    """
+    if fields is not None and not isinstance(avroType, titus.datatype.AvroRecord):
+        fields = None
+    key = repr(avroType), tagged, None if fields is None else tuple(sorted(fields))
+    if key not in decoders:
+        if fields is None:
+            decoders[key] = compileDecoder(avroType, {}, tagged)
+        else:
+            decoders[key] = compileProjection(avroType, set(fields), tagged)
+    return decoders[key]
+
+def unionTags(avroType):
+    if isinstance(avroType, titus.datatype.AvroCompiled):
+        return set([avroType.name, avroType.fullName])
+    else:
+        return set([avroType.name])
+
+def unionPredicate(avroType):
+    if isinstance(avroType, titus.datatype.AvroNull):
+        return 0, lambda x: x is None
+    elif isinstance(avroType, titus.datatype.AvroBoolean):
+        return 1, lambda x: x is True or x is False
+    elif isinstance(avroType, titus.datatype.AvroInt):
+        return 2, lambda x: isinstance(x, (int, long)) and not isinstance(x, bool) and -2147483648 <= x <= 2147483647
+    elif isinstance(avroType, titus.datatype.AvroLong):
+        return 3, lambda x: isinstance(x, (int, long)) and not isinstance(x, bool)
+    elif isinstance(avroType, (titus.datatype.AvroFloat, titus.datatype.AvroDouble)):
+        return 4, lambda x: isinstance(x, (int, long, float)) and not isinstance(x, bool)
+    elif isinstance(avroType, titus.datatype.AvroEnum):
+        symbols = set(avroType.symbols)
+        return 5, lambda x: isinstance(x, basestring) and x in symbols
+    elif isinstance(avroType, titus.datatype.AvroFixed):
+        size = avroType.size
+        return 6, lambda x: isinstance(x, str) and len(x) == size
+    elif isinstance(avroType, titus.datatype.AvroBytes):
+        return 7, lambda x: isinstance(x, str)
+    elif isinstance(avroType, titus.datatype.AvroString):
+        return 8, lambda x: isinstance(x, basestring)
+    elif isinstance(avroType, titus.datatype.AvroRecord):
+        names = [f.name for f in avroType.fields]
+        return 9, lambda x: isinstance(x, dict) and all(n in x for n in names)
+    elif isinstance(avroType, titus.datatype.AvroMap):
+        return 10, lambda x: isinstance(x, dict)
+    elif isinstance(avroType, titus.datatype.AvroArray):
+        return 11, lambda x: isinstance(x, (list, tuple))
+    else:
+        raise AvroException("cannot encode {0}".format(avroType))
+
+def compileEncoder(avroType, memo):
+    if isinstance(avroType, titus.datatype.AvroNull):
+        def encode(x, out):
+            pass
+        return encode
+
+    elif isinstance(avroType, titus.datatype.AvroBoolean):
+        def encode(x, out):
+            out.append("\x01" if x else "\x00")
+        return encode
+
+    elif isinstance(avroType, (titus.datatype.AvroInt, titus.datatype.AvroLong)):
+        return writeLong
+
+    elif isinstance(avroType, titus.datatype.AvroFloat):
+        pack = floatStruct.pack
+        def encode(x, out):
+            out.append(pack(x))
+        return encode
+
+    elif isinstance(avroType, titus.datatype.AvroDouble):
+        pack = doubleStruct.pack
+        def encode(x, out):
+            out.append(pack(x))
+        return encode
+
+    elif isinstance(avroType, titus.datatype.AvroBytes):
+        return writeBytes
+
+    elif isinstance(avroType, titus.datatype.AvroFixed):
+        def encode(x, out):
+            out.append(x)
+        return encode
+
+    elif isinstance(avroType, titus.datatype.AvroString):
+        return writeString
+
+    elif isinstance(avroType, titus.datatype.AvroEnum):
+        index = dict((s, i) for i, s in enumerate(avroType.symbols))
+        def encode(x, out):
+            writeLong(index[x], out)
+        return encode
+
+    elif isinstance(avroType, titus.datatype.AvroArray):
+        items = compileEncoder(avroType.items, memo)
+        def encode(x, out):
+            if len(x) > 0:
+                writeLong(len(x), out)
+                for item in x:
+                    items(item, out)
+            out.append("\x00")
+        return encode
+
+    elif isinstance(avroType, titus.datatype.AvroMap):
+        values = compileEncoder(avroType.values, memo)
+        def encode(x, out):
+            if len(x) > 0:
+                writeLong(len(x), out)
+                for k, v in x.iteritems():
+                    writeString(k, out)
+                    values(v, out)
+            out.append("\x00")
+        return encode
+
+    elif isinstance(avroType, titus.datatype.AvroRecord):
+        if avroType.fullName in memo:
+            return memo[avroType.fullName]
+        fields = []
+        def encode(x, out):
+            for name, enc in fields:
+                enc(x[name], out)
+        memo[avroType.fullName] = encode
+        fields.extend((f.name, compileEncoder(f.avroType, memo)) for f in avroType.fields)
+        return encode
+
+    elif isinstance(avroType, titus.datatype.AvroUnion):
+        branches = []
+        tags = {}
+        for i, t in enumerate(avroType.types):
+            rank, predicate = unionPredicate(t)
+            enc = compileEncoder(t, memo)
+            branches.append((rank, smallLongs[i], predicate, enc))
+            for tag in unionTags(t):
+                tags[tag] = (smallLongs[i], predicate, enc)
+        branches = [x[1:] for x in sorted(branches, key=lambda x: x[0])]
+        def encode(x, out):
+            if isinstance(x, dict) and len(x) == 1:
+                tag, = x.keys()
+                if tag in tags:
+                    index, predicate, enc = tags[tag]
+                    if predicate(x[tag]):
+                        out.append(index)
+                        enc(x[tag], out)
+                        return
+            for index, predicate, enc in branches:
+                if predicate(x):
+                    out.append(index)
+                    enc(x, out)
+                    return
+            raise AvroException("{0} does not match schema {1}".format(repr(x), avroType))
+        return encode
+
+    else:
+        raise AvroException("cannot encode {0}".format(avroType))
+
+def compileDecoder(avroType, memo, tagged=False):
+    if isinstance(avroType, titus.datatype.AvroNull):
+        return lambda read: None
+
+    elif isinstance(avroType, titus.datatype.AvroBoolean):
+        return lambda read: read(1) != "\x00"
+
+    elif isinstance(avroType, (titus.datatype.AvroInt, titus.datatype.AvroLong)):
+        return readLong
+
+    elif isinstance(avroType, titus.datatype.AvroFloat):
+        unpack = floatStruct.unpack
+        return lambda read: unpack(read(4))[0]
+
+    elif isinstance(avroType, titus.datatype.AvroDouble):
+        unpack = doubleStruct.unpack
+        return lambda read: unpack(read(8))[0]
+
+    elif isinstance(avroType, titus.datatype.AvroBytes):
+        return readBytes
+
+    elif isinstance(avroType, titus.datatype.AvroFixed):
+        size = avroType.size
+        return lambda read: read(size)
+
+    elif isinstance(avroType, titus.datatype.AvroString):
+        return readString
+
+    elif isinstance(avroType, titus.datatype.AvroEnum):
+        symbols = avroType.symbols
+        return lambda read: symbols[readLong(read)]
+
+    elif isinstance(avroType, titus.datatype.AvroArray):
+        items = compileDecoder(avroType.items, memo, tagged)
+        def decode(read):
+            out = []
+            count = readLong(read)
+            while count != 0:
+                if count < 0:
+                    count = -count
+                    readLong(read)
+                for i in xrange(count):
+                    out.append(items(read))
+                count = readLong(read)
+            return out
+        return decode
+
+    elif isinstance(avroType, titus.datatype.AvroMap):
+        values = compileDecoder(avroType.values, memo, tagged)
+        def decode(read):
+            out = {}
+            count = readLong(read)
+            while count != 0:
+                if count < 0:
+                    count = -count
+                    readLong(read)
+                for i in xrange(count):
+                    k = readString(read)
+                    out[k] = values(read)
+                count = readLong(read)
+            return out
+        return decode
+
+    elif isinstance(avroType, titus.datatype.AvroRecord):
+        if avroType.fullName in memo:
+            return memo[avroType.fullName]
+        fields = []
+        def decode(read):
+            out = {}
+            for name, dec in fields:
+                out[name] = dec(read)
+            return out
+        memo[avroType.fullName] = decode
+        fields.extend((f.name, compileDecoder(f.avroType, memo, tagged)) for f in avroType.fields)
+        return decode
+
+    elif isinstance(avroType, titus.datatype.AvroUnion):
+        branches = [compileDecoder(t, memo, tagged) for t in avroType.types]
+        if not tagged:
+            return lambda read: branches[readLong(read)](read)
+        names = [None if t.name == "null" else t.name for t in avroType.types]
+        def decode(read):
+            index = readLong(read)
+            if names[index] is None:
+                return None
+            else:
+                return {names[index]: branches[index](read)}
+        return decode
+
+    else:
+        raise AvroException("cannot decode {0}".format(avroType))
+
+def fixedWidth(avroType):
+    if isinstance(avroType, titus.datatype.AvroNull):
+        return 0
+    elif isinstance(avroType, titus.datatype.AvroBoolean):
+        return 1
+    elif isinstance(avroType, titus.datatype.AvroFloat):
+        return 4
+    elif isinstance(avroType, titus.datatype.AvroDouble):
+        return 8
+    elif isinstance(avroType, titus.datatype.AvroFixed):
+        return avroType.size
+    else:
+        return None
+
+def compileProjection(avroType, fields, tagged=False):
+    """Generate a decoder for the listed fields of a record, with the skipping of all other fields unrolled into straight-line code."""
+
+    memo = {}
+    skipMemo = {}
+    steps = []
+    lines = ["def decode(read):", "    out = {}"]
+    width = 0
+    for f in avroType.fields:
+        if f.name not in fields and fixedWidth(f.avroType) is not None:
+            width += fixedWidth(f.avroType)
+            continue
+        if width > 0:
+            lines.append("    read({0})".format(width))
+            width = 0
+        if f.name in fields:
+            steps.append(compileDecoder(f.avroType, memo, tagged))
+            lines.append("    out[{0}] = steps[{1}](read)".format(repr(f.name), len(steps) - 1))
+        elif isinstance(f.avroType, (titus.datatype.AvroInt, titus.datatype.AvroLong, titus.datatype.AvroEnum)):
+            lines.append("    while ord(read(1)) & 0x80: pass")
+        elif isinstance(f.avroType, (titus.datatype.AvroString, titus.datatype.AvroBytes)):
+            lines.append("    read(readLong(read))")
+        else:
+            steps.append(compileSkipper(f.avroType, skipMemo))
+            lines.append("    steps[{0}](read)".format(len(steps) - 1))
+    if width > 0:
+        lines.append("    read({0})".format(width))
+    lines.append("    return out")
+
+    namespace = {"steps": steps, "readLong": readLong}
+    exec("\n".join(lines) + "\n", namespace)
+    return namespace["decode"]
+
+def skipBytes(read):
+    size = readLong(read)
+    if size > 0:
+        read(size)
+
+def compileSkipper(avroType, memo):
+    """Return a function ``skip(read)`` that reads past one datum of ``avroType`` without building its value."""
+
+    if isinstance(avroType, titus.datatype.AvroNull):
+        return lambda read: None
+
+    elif isinstance(avroType, titus.datatype.AvroBoolean):
+        return lambda read: read(1)
+
+    elif isinstance(avroType, (titus.datatype.AvroInt, titus.datatype.AvroLong, titus.datatype.AvroEnum)):
+        return readLong
+
+    elif isinstance(avroType, titus.datatype.AvroFloat):
+        return lambda read: read(4)
+
+    elif isinstance(avroType, titus.datatype.AvroDouble):
+        return lambda read: read(8)
+
+    elif isinstance(avroType, (titus.datatype.AvroBytes, titus.datatype.AvroString)):
+        return skipBytes
+
+    elif isinstance(avroType, titus.datatype.AvroFixed):
+        size = avroType.size
+        return lambda read: read(size)
+
+    elif isinstance(avroType, (titus.datatype.AvroArray, titus.datatype.AvroMap)):
+        if isinstance(avroType, titus.datatype.AvroArray):
+            items = compileSkipper(avroType.items, memo)
+        else:
+            values = compileSkipper(avroType.values, memo)
+            def items(read):
+                skipBytes(read)
+                values(read)
+        def skip(read):
+            count = readLong(read)
+            while count != 0:
+                if count < 0:
+                    read(readLong(read))
+                else:
+                    for i in xrange(count):
+                        items(read)
+                count = readLong(read)
+        return skip
+
+    elif isinstance(avroType, titus.datatype.AvroRecord):
+        if avroType.fullName in memo:
+            return memo[avroType.fullName]
+        fields = []
+        def skip(read):
+            for step in fields:
+                step(read)
+        memo[avroType.fullName] = skip
+        fields.extend(compileSkipper(f.avroType, memo) for f in avroType.fields)
+        return skip
+
+    elif isinstance(avroType, titus.datatype.AvroUnion):
+        branches = [compileSkipper(t, memo) for t in avroType.types]
+        return lambda read: branches[readLong(read)](read)
+
+    else:
+        raise AvroException("cannot decode {0}".format(avroType))
+
+########################### object container files
+
+magic = "Obj\x01"
+metaType = titus.datatype.AvroMap(titus.datatype.AvroBytes())
+
+class ContainerWriter(object):
+    """Write an Avro object container file, readable by ``avro.datafile.DataFileReader``, using compiled encoders.
+
+    Datums are buffered into blocks of roughly ``blockSize`` bytes, so arbitrarily many can be appended without holding them in memory.
+    To append to an existing file, open ``stream`` at its end and pass the file's ``sync`` marker; no header is written in that case.
+    """
+
+    def __init__(self, stream, avroType, meta=None, codec="null", blockSize=65536, sync=None):
+        if codec not in ("null", "deflate"):
+            raise AvroException("unknown codec: {0}".format(codec))
+        self.stream = stream
+        self.encode = encoder(avroType)
+        self.codec = codec
+        self.blockSize = blockSize
+        self.sync = sync
+        self.block = []
+        self.blockBytes = 0
+        self.count = 0
+        if sync is not None:
+            return
+
+        self.sync = os.urandom(16)
+        header = {"avro.schema": json.dumps(avroType.schema.to_json()), "avro.codec": codec}
+        if meta is not None:
+            header.update(meta)
+        out = [magic]
+        encoder(metaType)(header, out)
+        out.append(self.sync)
+        self.stream.write("".join(out))
+
+    def append(self, datum):
+        out = []
+        self.encode(datum, out)
+        self.appendEncoded("".join(out))
+
+    def appendEncoded(self, data):
+        self.block.append(data)
+        self.blockBytes += len(data)
+        self.count += 1
+        if self.blockBytes >= self.blockSize:
+            self.writeBlock()
+
+    def writeBlock(self):
+        if self.count > 0:
+            data = "".join(self.block)
+            if self.codec == "deflate":
+                compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+                data = compressor.compress(data) + compressor.flush()
+            out = []
+            writeLong(self.count, out)
+            writeLong(len(data), out)
+            self.stream.write("".join(out))
+            self.stream.write(data)
+            self.stream.write(self.sync)
+        self.block = []
+        self.blockBytes = 0
+        self.count = 0
+
+    def flush(self):
+        self.writeBlock()
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+        self.stream.close()
+
+class ContainerReader(object):
+    """Iterate over the datums of an Avro object container file one block at a time.
+
+    The file's own schema is used unless ``avroType`` is given, in which case it must be the type the file was written with (an AvroException is raised if it is not).
+    If ``fields`` is given, records are projected onto those fields (see ``decoder``).
+    Each block is decoded completely before any of its datums are yielded, and ``position`` is the stream offset just past the last complete block
+    (None if the stream cannot report its position).
+    """
+
+    def __init__(self, stream, avroType=None, tagged=False, fields=None):
+        self.stream = stream
+        if stream.read(4) != magic:
+            raise AvroException("not an Avro object container file")
+        self.meta = decoder(metaType)(stream.read)
+        self.sync = stream.read(16)
+        self.codec = self.meta.get("avro.codec", "null")
+        if self.codec not in ("null", "deflate"):
+            raise AvroException("unknown codec: {0}".format(self.codec))
+        written = titus.datatype.schemaToAvroType(avro.schema.parse(self.meta["avro.schema"]))
+        if avroType is None:
+            avroType = written
+        elif written.jsonNode(set()) != avroType.jsonNode(set()):
+            raise AvroException("file was written with schema {0}, not the expected {1}".format(written.toJson(), avroType.toJson()))
+        self.avroType = avroType
+        self.decode = decoder(avroType, tagged, fields)
+        self.position = self.tell()
+
+    def tell(self):
+        try:
+            return self.stream.tell()
+        except (AttributeError, IOError):
+            return None
+
+    def __iter__(self):
+        for block in self.blocks():
+            for datum in block:
+                yield datum
+
+    def blocks(self):
+        read = self.stream.read
+        decode = self.decode
+        while True:
+            first = read(1)
+            if first == "":
+                return
+            try:
+                pending = [first]
+                count = readLong(lambda n: pending.pop() if pending else read(n))
+                size = readLong(read)
+            except TypeError:
+                raise AvroException("truncated block header")
+            data = read(size)
+            if len(data) != size:
+                raise AvroException("truncated block")
+            if self.codec == "deflate":
+                data = zlib.decompress(data, -15)
+            blockRead = StringIO(data).read
+            block = [decode(blockRead) for i in xrange(count)]
+            if read(16) != self.sync:
+                raise AvroException("sync marker does not match; the file is corrupted")
+            self.position = self.tell()
+            yield block
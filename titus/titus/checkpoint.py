@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Hadrian.
+#
+# Licensed under the Hadrian Personal Use and Evaluation License (PUEL);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://raw.githubusercontent.com/opendatagroup/hadrian/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from cStringIO import StringIO
+
+import titus.avrocodec
+import titus.datatype
+from titus.errors import AvroException
+from titus.errors import PFAInitializationException
+
+logEntry = titus.datatype.AvroRecord([titus.datatype.AvroField("name", titus.datatype.AvroString()),
+                                      titus.datatype.AvroField("pool", titus.datatype.AvroBoolean()),
+                                      titus.datatype.AvroField("key", titus.datatype.AvroString()),
+                                      titus.datatype.AvroField("value", titus.datatype.AvroUnion([titus.datatype.AvroNull(), titus.datatype.AvroBytes()]))], "LogEntry")
+
+class Checkpointer(object):
+    """Checkpoint a scoring engine's cells and pools into a directory, writing only what changed since the previous checkpoint.
+
+    The directory holds a full snapshot (``PFAEngine.snapshotAvro`` format) and an append-only log of the cells and pool keys that changed after it, one Avro block per checkpoint.
+    When the log grows beyond ``compactRatio`` times the size of the snapshot, the next checkpoint writes a new snapshot and starts an empty log.
+    Snapshot and log carry a generation number, so a log left over from an interrupted compaction is never replayed onto a newer snapshot.
+
+    Creating a Checkpointer turns on change tracking for all of the engine's cells and pools.
+    Call ``recover()`` on a freshly built engine to load the last checkpoint, then ``checkpoint()`` as often as needed.
+    """
+
+    snapshotFileName = "snapshot.avro"
+    logFileName = "log.avro"
+
+    def __init__(self, engine, directory, compactRatio=1.0, codec="null"):
+        self.engine = engine
+        self.directory = directory
+        self.compactRatio = compactRatio
+        self.codec = codec
+        self.generation = 0
+        self.log = None
+        self.logStream = None
+        self.snapshotSize = 0
+
+        if engine.processPool is not None:
+            raise PFAInitializationException("engine belongs to a ProcessPool, whose cells and pools live in its worker processes, and cannot be checkpointed")
+
+        for item in engine.cells.values() + engine.pools.values():
+            item.track()
+
+    @property
+    def snapshotPath(self):
+        return os.path.join(self.directory, self.snapshotFileName)
+
+    @property
+    def logPath(self):
+        return os.path.join(self.directory, self.logFileName)
+
+    def recover(self):
+        """Restore the engine from the directory's snapshot and log; return False if there was no checkpoint to recover."""
+
+        if not os.path.exists(self.snapshotPath):
+            return False
+
+        with open(self.snapshotPath, "rb") as stream:
+            meta = self.engine.restoreAvro(stream)
+        self.generation = int(meta.get("pfa.generation", "0"))
+        self.snapshotSize = os.path.getsize(self.snapshotPath)
+
+        self.close()
+        if os.path.exists(self.logPath):
+            stream = open(self.logPath, "r+b")
+            try:
+                reader = titus.avrocodec.ContainerReader(stream, logEntry)
+            except (AvroException, TypeError):
+                reader = None
+            if reader is None or int(reader.meta.get("pfa.generation", "-1")) != self.generation:
+                stream.close()
+            else:
+                try:
+                    for block in reader.blocks():
+                        self.replay(block)
+                except AvroException:
+                    pass   # a checkpoint was interrupted while writing; its partial block is discarded
+                stream.seek(reader.position)
+                stream.truncate()
+                self.logStream = stream
+                self.log = titus.avrocodec.ContainerWriter(stream, logEntry, codec=reader.codec, blockSize=float("inf"), sync=reader.sync)
+
+        for item in self.engine.cells.values() + self.engine.pools.values():
+            item.takeDirty()
+        if self.log is None:
+            self.startLog()
+        return True
+
+    def replay(self, block):
+        decoders = {}
+        for entry in block:
+            name, pool = entry["name"], entry["pool"]
+            if (pool, name) not in decoders:
+                config = self.engine.config.pools[name] if pool else self.engine.config.cells[name]
+                decoders[pool, name] = titus.avrocodec.decoder(config.avroType)
+            if pool:
+                values = self.engine.pools[name].value
+                if entry["value"] is None:
+                    values.pop(entry["key"], None)
+                else:
+                    values[entry["key"]] = decoders[pool, name](StringIO(entry["value"]).read)
+            else:
+                self.engine.cells[name].value = decoders[pool, name](StringIO(entry["value"]).read)
+
+    def checkpoint(self):
+        """Persist every change since the last checkpoint; return the number of cells and pool keys written."""
+
+        if self.log is None or (self.logStream.tell() > self.compactRatio * self.snapshotSize):
+            return self.compact()
+
+        count = 0
+        for name, cell in self.engine.cells.items():
+            if cell.takeDirty():
+                out = []
+                titus.avrocodec.encoder(self.engine.config.cells[name].avroType)(cell.value, out)
+                self.log.append({"name": name, "pool": False, "key": "", "value": "".join(out)})
+                count += 1
+
+        for name, pool in self.engine.pools.items():
+            dirty = pool.takeDirty()
+            if len(dirty) > 0:
+                encode = titus.avrocodec.encoder(self.engine.config.pools[name].avroType)
+                values = pool.value
+                for key in dirty:
+                    value = values.get(key, pool.missing)
+                    if value is pool.missing:
+                        data = None
+                    else:
+                        out = []
+                        encode(value, out)
+                        data = "".join(out)
+                    self.log.append({"name": name, "pool": True, "key": key, "value": data})
+                    count += 1
+
+        self.log.flush()
+        os.fsync(self.logStream.fileno())
+        return count
+
+    def compact(self):
+        """Write a full snapshot and start a new, empty log; return the number of cells and pool keys written."""
+
+        for item in self.engine.cells.values() + self.engine.pools.values():
+            item.takeDirty()
+
+        self.generation += 1
+        tmp = self.snapshotPath + ".tmp"
+        with open(tmp, "wb") as stream:
+            self.engine.snapshotAvro(stream, self.codec, {"pfa.generation": str(self.generation)})
+            os.fsync(stream.fileno())
+        os.rename(tmp, self.snapshotPath)
+        self.snapshotSize = os.path.getsize(self.snapshotPath)
+
+        self.close()
+        self.startLog()
+        return len(self.engine.cells) + sum(len(x.value) for x in self.engine.pools.values())
+
+    def startLog(self):
+        tmp = self.logPath + ".tmp"
+        stream = open(tmp, "wb")
+        log = titus.avrocodec.ContainerWriter(stream, logEntry, {"pfa.generation": str(self.generation)}, self.codec, blockSize=float("inf"))
+        log.flush()
+        os.fsync(stream.fileno())
+        os.rename(tmp, self.logPath)
+        self.logStream = stream
+        self.log = log
+
+    def close(self):
+        if self.logStream is not None:
+            self.logStream.close()
+        self.logStream = None
+        self.log = None
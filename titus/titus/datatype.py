@@ -744,6 +744,128 @@ def jsonDecoder(avroType, value):
         raise Exception
     raise titus.errors.AvroException("{0} does not match schema {1}".format(json.dumps(value), avroType))
 
+compiledJsonDecoders = {}
+
+def compileJsonDecoder(avroType):
+    """Return a function equivalent to ``lambda value: jsonDecoder(avroType, value)`` that dispatches on the type only once, when it is built.
+
+    Decoders are cached by type, so repeated calls for the same type (cell and pool inits, casts) reuse the same function.
+    """
+    key = repr(avroType)
+    if key not in compiledJsonDecoders:
+        compiledJsonDecoders[key] = _jsonDecoderFunction(avroType, {})
+    return compiledJsonDecoders[key]
+
+def _jsonDecoderMismatch(avroType, value):
+    raise titus.errors.AvroException("{0} does not match schema {1}".format(json.dumps(value), avroType))
+
+def _jsonDecoderFunction(avroType, memo):
+    if isinstance(avroType, AvroNull):
+        def decode(value):
+            if value is None:
+                return value
+            _jsonDecoderMismatch(avroType, value)
+
+    elif isinstance(avroType, AvroBoolean):
+        def decode(value):
+            if value is True or value is False:
+                return value
+            _jsonDecoderMismatch(avroType, value)
+
+    elif isinstance(avroType, (AvroInt, AvroLong, AvroFloat, AvroDouble)):
+        if isinstance(avroType, AvroInt):
+            convert = int
+        elif isinstance(avroType, AvroLong):
+            convert = long
+        else:
+            convert = float
+        def decode(value):
+            try:
+                return convert(value)
+            except ValueError:
+                _jsonDecoderMismatch(avroType, value)
+
+    elif isinstance(avroType, AvroBytes):
+        def decode(value):
+            if isinstance(value, basestring):
+                return bytes(value)
+            _jsonDecoderMismatch(avroType, value)
+
+    elif isinstance(avroType, AvroFixed):
+        size = avroType.size
+        def decode(value):
+            if isinstance(value, basestring):
+                out = bytes(value)
+                if len(out) == size:
+                    return out
+            _jsonDecoderMismatch(avroType, value)
+
+    elif isinstance(avroType, AvroString):
+        def decode(value):
+            if isinstance(value, basestring):
+                return value
+            _jsonDecoderMismatch(avroType, value)
+
+    elif isinstance(avroType, AvroEnum):
+        symbols = set(avroType.symbols)
+        def decode(value):
+            if isinstance(value, basestring) and value in symbols:
+                return value
+            _jsonDecoderMismatch(avroType, value)
+
+    elif isinstance(avroType, AvroArray):
+        items = _jsonDecoderFunction(avroType.items, memo)
+        def decode(value):
+            if isinstance(value, (list, tuple)):
+                return [items(x) for x in value]
+            _jsonDecoderMismatch(avroType, value)
+
+    elif isinstance(avroType, AvroMap):
+        values = _jsonDecoderFunction(avroType.values, memo)
+        def decode(value):
+            if isinstance(value, dict):
+                return dict((k, values(v)) for k, v in value.items())
+            _jsonDecoderMismatch(avroType, value)
+
+    elif isinstance(avroType, AvroRecord):
+        if avroType.fullName in memo:
+            return memo[avroType.fullName]
+        fields = []
+        def decode(value):
+            if isinstance(value, dict):
+                out = {}
+                for name, fieldDecoder, default, nullable in fields:
+                    if name in value:
+                        out[name] = fieldDecoder(value[name])
+                    elif default is not None:
+                        out[name] = fieldDecoder(default)
+                    elif nullable:
+                        out[name] = None
+                    else:
+                        _jsonDecoderMismatch(avroType, value)
+                return out
+            _jsonDecoderMismatch(avroType, value)
+        memo[avroType.fullName] = decode
+        fields.extend((f.name, _jsonDecoderFunction(f.avroType, memo), f.default, isinstance(f.avroType, AvroNull)) for f in avroType.fields)
+
+    elif isinstance(avroType, AvroUnion):
+        types = dict((x.name, _jsonDecoderFunction(x, memo)) for x in avroType.types)
+        nullable = "null" in types
+        def decode(value):
+            if isinstance(value, dict) and len(value) == 1:
+                tag, = value.keys()
+                if tag in types:
+                    val, = value.values()
+                    return {tag: types[tag](val)}
+            elif value is None and nullable:
+                return None
+            _jsonDecoderMismatch(avroType, value)
+
+    else:
+        raise Exception
+
+    return decode
+
 ########################### check data value against type
 
 try:
@@ -921,3 +1043,115 @@ def checkData(data, avroType):
         raise TypeError("expecting {0}, found {1}".format(avroType, data))
 
     return data
+
+compiledCheckers = {}
+
+def compileCheckData(avroType):
+    """Return a function equivalent to ``lambda data: checkData(data, avroType)``, generated once per type.
+
+    The generated code unrolls record fields and inlines exact-type tests for primitives, deferring to ``checkData`` for anything
+    that needs conversion, so results (including errors and union tagging) are the same.
+    """
+    key = repr(avroType)
+    if key not in compiledCheckers:
+        lines = []
+        names = {}
+        types = []
+        entry = _checkerExpr(avroType, "data", lines, names, types)
+        namespace = {"checkData": checkData, "types": types}
+        exec("\n".join(lines) + "\ndef checker(data):\n    return " + entry + "\n", namespace)
+        compiledCheckers[key] = namespace["checker"]
+    return compiledCheckers[key]
+
+def _checkerType(avroType, types):
+    types.append(avroType)
+    return "types[{0}]".format(len(types) - 1)
+
+def _checkerError(avroType, found, types):
+    return "raise TypeError(\"expecting {{0}}, found {{1}}\".format({0}, {1}))".format(_checkerType(avroType, types), found)
+
+def _checkerExpr(avroType, var, lines, names, types):
+    if isinstance(avroType, AvroNull):
+        return "(None if {0} is None else checkData({0}, {1}))".format(var, _checkerType(avroType, types))
+    elif isinstance(avroType, AvroBoolean):
+        return "({0} if {0} is True or {0} is False else checkData({0}, {1}))".format(var, _checkerType(avroType, types))
+    elif isinstance(avroType, (AvroInt, AvroLong)):
+        return "({0} if type({0}) is int else checkData({0}, {1}))".format(var, _checkerType(avroType, types))
+    elif isinstance(avroType, (AvroFloat, AvroDouble)):
+        return "({0} if type({0}) is float else checkData({0}, {1}))".format(var, _checkerType(avroType, types))
+    elif isinstance(avroType, (AvroBytes, AvroFixed)):
+        return "({0} if type({0}) is str else checkData({0}, {1}))".format(var, _checkerType(avroType, types))
+    elif isinstance(avroType, (AvroString, AvroEnum)):
+        return "({0} if type({0}) is unicode else checkData({0}, {1}))".format(var, _checkerType(avroType, types))
+    else:
+        return "{0}({1})".format(_checkerFunction(avroType, lines, names, types), var)
+
+def _checkerFunction(avroType, lines, names, types):
+    key = avroType.fullName if isinstance(avroType, AvroRecord) else repr(avroType)
+    if key in names:
+        return names[key]
+    name = "check{0}".format(len(names))
+    names[key] = name
+
+    body = []
+    if isinstance(avroType, AvroArray):
+        body.append("    if type(data) is list or hasattr(data, \"__iter__\"):")
+        body.append("        return [{0} for x in data]".format(_checkerExpr(avroType.items, "x", lines, names, types)))
+        body.append("    " + _checkerError(avroType, "data", types))
+
+    elif isinstance(avroType, AvroMap):
+        body.append("    if not (hasattr(data, \"__iter__\") and hasattr(data, \"__getitem__\")):")
+        body.append("        " + _checkerError(avroType, "data", types))
+        body.append("    newData = {}")
+        body.append("    for key in data:")
+        body.append("        value = data[key]")
+        body.append("        value = {0}".format(_checkerExpr(avroType.values, "value", lines, names, types)))
+        body.append("        if type(key) is unicode:")
+        body.append("            newData[key] = value")
+        body.append("        elif isinstance(key, str):")
+        body.append("            newData[key.decode(\"utf-8\", \"replace\")] = value")
+        body.append("        elif isinstance(key, unicode):")
+        body.append("            newData[key] = value")
+        body.append("        else:")
+        body.append("            raise TypeError(\"expecting {{0}}, found key {{1}}\".format({0}, key))".format(_checkerType(avroType, types)))
+        body.append("    return newData")
+
+    elif isinstance(avroType, AvroRecord):
+        fields = avroType.fields
+        body.append("    if not (hasattr(data, \"__iter__\") and hasattr(data, \"__getitem__\")):")
+        body.append("        " + _checkerError(avroType, "data", types))
+        body.append("    try:")
+        for i, field in enumerate(fields):
+            body.append("        key = {0}".format(repr(field.name)))
+            body.append("        f{0} = data[key]".format(i))
+        body.append("    except KeyError:")
+        body.append("        raise TypeError(\"expecting {{0}}, couldn't find key {{1}}\".format({0}, key))".format(_checkerType(avroType, types)))
+        body.append("    return {" + ", ".join("{0}: {1}".format(repr(field.name), _checkerExpr(field.avroType, "f{0}".format(i), lines, names, types)) for i, field in enumerate(fields)) + "}")
+
+    elif isinstance(avroType, AvroUnion):
+        body.append("    if isinstance(data, dict) and len(data) == 1:")
+        body.append("        tag, = data.keys()")
+        body.append("        value, = data.values()")
+        for tpe in avroType.types:
+            body.append("        if tag == {0}:".format(repr(tpe.name)))
+            if tpe.name == "null":
+                body.append("            return {0}".format(_checkerExpr(tpe, "value", lines, names, types)))
+            else:
+                body.append("            return {{{0}: {1}}}".format(repr(tpe.name), _checkerExpr(tpe, "value", lines, names, types)))
+        body.append("        " + _checkerError(avroType, "data", types))
+        for tpe in avroType.types:
+            body.append("    try:")
+            if tpe.name == "null":
+                body.append("        return {0}".format(_checkerExpr(tpe, "data", lines, names, types)))
+            else:
+                body.append("        return {{{0}: {1}}}".format(repr(tpe.name), _checkerExpr(tpe, "data", lines, names, types)))
+            body.append("    except TypeError:")
+            body.append("        pass")
+        body.append("    " + _checkerError(avroType, "data", types))
+
+    else:
+        body.append("    return checkData(data, {0})".format(_checkerType(avroType, types)))
+
+    lines.append("def {0}(data):".format(name))
+    lines.extend(body)
+    return name
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+#
+# This file is part of Hadrian.
+#
+# Licensed under the Hadrian Personal Use and Evaluation License (PUEL);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://raw.githubusercontent.com/opendatagroup/hadrian/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import os
+import sqlite3
+import tempfile
+import threading
+from cStringIO import StringIO
+
+import titus.avrocodec
+
+class DiskStore(collections.MutableMapping):
+    """Dictionary-like pool storage that keeps the most recently used entries in memory and spills the rest to a local SQLite file.
+
+    Values are stored in the Avro binary encoding of the pool's type. Entries in the in-memory cache are live objects, so in-place updates
+    of cached containers are seen by later reads; modified entries are written back when they are evicted or when the store is iterated.
+    The SQLite file is a private scratch area (it is deleted when the store is closed); use snapshots or checkpoints for durability.
+    """
+
+    missing = object()
+
+    def __init__(self, avroType, items=None, cacheSize=10000, directory=None):
+        self.avroType = avroType
+        self.cacheSize = cacheSize
+        self.directory = directory
+        self.encode = titus.avrocodec.encoder(avroType)
+        self.decode = titus.avrocodec.decoder(avroType)
+
+        fd, self.fileName = tempfile.mkstemp(suffix=".pool", dir=directory)
+        os.close(fd)
+        self.db = sqlite3.connect(self.fileName, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode = OFF")
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.execute("CREATE TABLE entries (key TEXT PRIMARY KEY, value BLOB)")
+
+        self.lock = threading.RLock()
+        self.cache = collections.OrderedDict()
+        self.dirty = set()
+        self.size = 0
+
+        if items is not None:
+            for k, v in items.iteritems():
+                self[k] = v
+
+    def empty(self):
+        return DiskStore(self.avroType, None, self.cacheSize, self.directory)
+
+    def encoded(self, value):
+        out = []
+        self.encode(value, out)
+        return buffer("".join(out))
+
+    def stored(self, key):
+        return self.db.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    def load(self, key):
+        row = self.db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return self.missing
+        else:
+            return self.decode(StringIO(str(row[0])).read)
+
+    def evict(self):
+        if len(self.cache) > self.cacheSize:
+            batch = []
+            while len(self.cache) > self.cacheSize - self.cacheSize // 10:
+                k, v = self.cache.popitem(last=False)
+                if k in self.dirty:
+                    self.dirty.discard(k)
+                    batch.append((k, self.encoded(v)))
+            self.db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?)", batch)
+
+    def get(self, key, default=None):
+        with self.lock:
+            value = self.cache.pop(key, self.missing)
+            if value is self.missing:
+                value = self.load(key)
+                if value is self.missing:
+                    return default
+            self.cache[key] = value
+            self.evict()
+            return value
+
+    def __getitem__(self, key):
+        value = self.get(key, self.missing)
+        if value is self.missing:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.cache or self.stored(key)
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            if self.cache.pop(key, self.missing) is self.missing and not self.stored(key):
+                self.size += 1
+            self.cache[key] = value
+            self.dirty.add(key)
+            self.evict()
+
+    def __delitem__(self, key):
+        with self.lock:
+            cached = self.cache.pop(key, self.missing) is not self.missing
+            self.dirty.discard(key)
+            if self.db.execute("DELETE FROM entries WHERE key = ?", (key,)).rowcount == 0 and not cached:
+                raise KeyError(key)
+            self.size -= 1
+
+    def __len__(self):
+        return self.size
+
+    def flush(self):
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?)", [(k, self.encoded(self.cache[k])) for k in self.dirty])
+            self.dirty.clear()
+
+    def iteritems(self):
+        self.flush()
+        for key, value in self.db.execute("SELECT key, value FROM entries"):
+            yield key, self.decode(StringIO(str(value)).read)
+
+    def iterkeys(self):
+        self.flush()
+        for key, in self.db.execute("SELECT key FROM entries"):
+            yield key
+
+    def itervalues(self):
+        for key, value in self.iteritems():
+            yield value
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def __repr__(self):
+        return "DiskStore({0} entries, {1} cached)".format(self.size, len(self.cache))
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+            os.remove(self.fileName)
+
+    def __del__(self):
+        if getattr(self, "db", None) is not None:
+            self.close()
@@ -27,35 +27,57 @@ class PrettyPfaException(PFAException): pass
 
 class PFASyntaxException(PFAException):
     def __init__(self, message, pos):
+        self.message = message
         self.pos = pos
         if pos is None or pos == "":
             super(PFASyntaxException, self).__init__("PFA syntax error: " + message)
         else:
             super(PFASyntaxException, self).__init__("PFA syntax error at " + pos + ": " + message)
 
+    def __reduce__(self):
+        return (PFASyntaxException, (self.message, self.pos))
+
 class PFASemanticException(PFAException):
     def __init__(self, message, pos):
+        self.message = message
         self.pos = pos
         if pos is None or pos == "":
             super(PFASemanticException, self).__init__("PFA semantic error: " + message)
         else:
             super(PFASemanticException, self).__init__("PFA semantic error at " + pos + ": " + message)
 
+    def __reduce__(self):
+        return (PFASemanticException, (self.message, self.pos))
+
 class PFAInitializationException(PFAException):
     def __init__(self, message):
+        self.message = message
         super(PFAInitializationException, self).__init__("PFA initialization error: " + message)
 
+    def __reduce__(self):
+        return (PFAInitializationException, (self.message,))
+
 class PFARuntimeException(PFAException):
     def __init__(self, message):
         self.message = message
         super(PFARuntimeException, self).__init__("PFA runtime error: " + message)
 
+    def __reduce__(self):
+        return (PFARuntimeException, (self.message,))
+
 class PFAUserException(PFAException):
     def __init__(self, message, code):
         self.message = message
         self.code = code
         super(PFAUserException, self).__init__("PFA user-defined error: " + message + ("" if code is None else "(code {0})".format(code)))
 
+    def __reduce__(self):
+        return (PFAUserException, (self.message, self.code))
+
 class PFATimeoutException(PFAException):
     def __init__(self, message):
+        self.message = message
         super(PFATimeoutException, self).__init__("PFA timeout error: " + message)
+
+    def __reduce__(self):
+        return (PFATimeoutException, (self.message,))
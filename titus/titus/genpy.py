@@ -19,24 +19,40 @@
 # limitations under the License.
 
 import base64
+import cPickle as pickle
+import hashlib
+import itertools
 import json
+import marshal
 import math
+import os
+import sys
+import tempfile
 import threading
 import time
 import random
+from cStringIO import StringIO
 
 from avro.datafile import DataFileReader, DataFileWriter
 from avro.io import DatumReader, DatumWriter
+import avro.schema
 
 from titus.errors import *
 import titus.pfaast
+import titus.avrocodec
 import titus.datatype
+import titus.diskpool
 import titus.fcn
+import titus.lib1.core
+import titus.metrics
+import titus.optimizer
 import titus.options
 import titus.P as P
+import titus.profiler
 import titus.reader
 import titus.signature
 import titus.util
+import titus.version
 from titus.util import DynamicScope
 
 from titus.pfaast import EngineConfig
@@ -90,36 +106,131 @@ from titus.pfaast import MapIndex
 from titus.pfaast import RecordIndex
 
 class GeneratePython(titus.pfaast.Task):
+    profile = None
+
     @staticmethod
-    def makeTask(style):
+    def makeTask(style, profile=None):
         if style == "pure":
-            return GeneratePythonPure()
+            out = GeneratePythonPure()
+        elif style == "fast":
+            out = GeneratePythonFast()
         else:
             raise NotImplementedError("unrecognized style " + style)
+        out.profile = profile
+        return out
+
+    def profileKey(self, name, pos):
+        return repr((name, pos))
+
+    def profileFcns(self, fcns):
+        return "".join("        self.f[{0}] = self.profiler.wrap({1}, self.f[{0}])\n".format(repr(ufname), self.profileKey(ufname, self.profile.fcns[ufname[2:]].pos)) for ufname, fcnContext in fcns)
+
+    def profileCall(self, context, expr):
+        if self.profile is None or isinstance(context.fcn, titus.pfaast.UserFcn):
+            return expr
+        else:
+            return "self.profiler.call({0}, lambda: {1})".format(self.profileKey(context.fcn.name, context.pos), expr)
+
+    @staticmethod
+    def callGraph(context):
+        out = {"(begin)": context.begin[2], "(action)": context.action[2], "(end)": context.end[2]}
+        if context.merge is not None:
+            out["(merge)"] = context.merge[2]
+        for fname, fctx in context.fcns:
+            out[fname] = fctx.calls
+        return out
+
+    class Expression(str):
+        # an expression that has a cheaper form to run when its value is not used, or a function that may safely run more than once
+        def __new__(cls, expr, discarded=None, retrySafe=False):
+            out = str.__new__(cls, expr)
+            out.discarded = discarded
+            out.retrySafe = retrySafe
+            return out
+
+    def discard(self, code):
+        if getattr(code, "discarded", None) is not None:
+            return code.discarded
+        else:
+            return code
+
+    retryUnsafe = set([CellTo.desc, PoolTo.desc, Log.desc, "emit", "a.shuffle", "model.cluster.randomSeeds"])
+
+    def retrySafe(self, calls):
+        return not any(x in self.retryUnsafe or x.startswith("rand.") or x.startswith("u.") for x in calls)
 
-    def commandsMap(self, codes, indent):
+    def updateCall(self, call, context):
+        if context.shared and getattr(context.to, "retrySafe", False):
+            return call + ", optimistic=True)", call + ", False, optimistic=True)"
+        else:
+            return call + ")", call + ", False)"
+
+    def actionBatch(self, method, prologue, commands):
+        if method == Method.EMIT:
+            out = """
+    def actionBatch(self, inputs, check=True):
+        state = ExecutionState(self.options, self.rand, 'action', self.parser)
+        scope = DynamicScope(None)
+""" + prologue + """        emit = self.emit
+        out = []
+        for input in inputs:
+            if check:
+                input = self.checkInput(input)
+            state.restart()
+            self.actionsStarted += 1
+            self.emit = out.append
+            try:
+""" + commands + """            except Exception:
+                state.rollback()
+                raise
+            finally:
+                self.emit = emit
+            for x in out:
+                yield x
+            del out[:]
+"""
+        else:
+            out = """
+    def actionBatch(self, inputs, check=True):
+        state = ExecutionState(self.options, self.rand, 'action', self.parser)
+        scope = DynamicScope(None)
+""" + prologue + """        out = []
+        for input in inputs:
+            if check:
+                input = self.checkInput(input)
+            state.restart()
+            self.actionsStarted += 1
+            try:
+""" + commands + """            except Exception:
+                state.rollback()
+                raise
+        return out
+"""
+        return out
+
+    def commandsMap(self, codes, indent, batch=False):
         suffix = indent + "self.actionsFinished += 1\n" + \
-                 indent + "return last\n"
-        return "".join(indent + x + "\n" for x in codes[:-1]) + indent + "last = " + codes[-1] + "\n" + suffix
+                 indent + ("out.append(last)\n" if batch else "return last\n")
+        return "".join(indent + self.discard(x) + "\n" for x in codes[:-1]) + indent + "last = " + codes[-1] + "\n" + suffix
 
     def commandsEmit(self, codes, indent):
         suffix = indent + "self.actionsFinished += 1\n"
-        return "".join(indent + x + "\n" for x in codes) + suffix
+        return "".join(indent + self.discard(x) + "\n" for x in codes) + suffix
 
-    def commandsFold(self, codes, indent):
+    def commandsFold(self, codes, indent, batch=False):
         prefix = indent + "scope.let({'tally': self.tally})\n"
         suffix = indent + "self.tally = last\n" + \
                  indent + "self.actionsFinished += 1\n" + \
-                 indent + "return self.tally\n"
-        return prefix + "".join(indent + x + "\n" for x in codes[:-1]) + indent + "last = " + codes[-1] + "\n" + suffix
+                 indent + ("out.append(self.tally)\n" if batch else "return self.tally\n")
+        return prefix + "".join(indent + self.discard(x) + "\n" for x in codes[:-1]) + indent + "last = " + codes[-1] + "\n" + suffix
 
     def commandsFoldMerge(self, codes, indent):
         suffix = indent + "self.tally = last\n" + \
                  indent + "return self.tally\n"
-        return "".join(indent + x + "\n" for x in codes[:-1]) + indent + "last = " + codes[-1] + "\n" + suffix
+        return "".join(indent + self.discard(x) + "\n" for x in codes[:-1]) + indent + "last = " + codes[-1] + "\n" + suffix
 
     def commandsBeginEnd(self, codes, indent):
-        return "".join(indent + x + "\n" for x in codes)
+        return "".join(indent + self.discard(x) + "\n" for x in codes)
 
     def reprPath(self, path):
         out = []
@@ -145,12 +256,16 @@ class GeneratePython(titus.pfaast.Task):
             action, actionSymbols, actionCalls = context.action
             end, endSymbols, endCalls = context.end
 
-            callGraph = {"(begin)": beginCalls, "(action)": actionCalls, "(end)": endCalls}
+            callGraph = self.callGraph(context)
             if context.merge is not None:
                 mergeTasks, mergeSymbols, mergeCalls = context.merge
-                callGraph["(merge)"] = mergeCalls
-            for fname, fctx in context.fcns:
-                callGraph[fname] = fctx.calls
+
+            if self.profile is not None:
+                begin = self.profileRoutine("begin", begin)
+                action = self.profileRoutine("action", action)
+                end = self.profileRoutine("end", end)
+                if context.merge is not None:
+                    mergeTasks = self.profileRoutine("merge", mergeTasks)
 
             out = ["class PFA_" + name + """(PFAEngine):
     def __init__(self, cells, pools, config, options, log, emit, zero, instance, rand):
@@ -160,6 +275,7 @@ class GeneratePython(titus.pfaast.Task):
         self.pools = pools
         self.config = config
         self.inputType = config.input
+        self.checkInput = compileCheckData(config.input)
         self.outputType = config.output
         self.options = options
         self.log = log
@@ -177,11 +293,13 @@ class GeneratePython(titus.pfaast.Task):
 
             for ufname, fcnContext in context.fcns:
                 out.append("        self.f[" + repr(ufname) + "] = " + self(fcnContext, engineOptions) + "\n")
+            if self.profile is not None:
+                out.append(self.profileFcns(context.fcns))
 
             if len(begin) > 0:
                 out.append("""
     def begin(self):
-        state = ExecutionState(self.options, self.rand, 'action', self.parser)
+        state = ExecutionState(self.options, self.rand, 'begin', self.parser)
         scope = DynamicScope(None)
         scope.let({'name': self.config.name, 'instance': self.instance, 'metadata': self.config.metadata})
         if self.config.version is not None:
@@ -198,13 +316,9 @@ class GeneratePython(titus.pfaast.Task):
             out.append("""
     def action(self, input, check=True):
         if check:
-            input = checkData(input, self.inputType)
+            input = self.checkInput(input)
         state = ExecutionState(self.options, self.rand, 'action', self.parser)
         scope = DynamicScope(None)
-        for cell in self.cells.values():
-            cell.maybeSaveBackup()
-        for pool in self.pools.values():
-            pool.maybeSaveBackup()
         self.actionsStarted += 1
         try:
             scope.let({'input': input, 'name': self.config.name, 'instance': self.instance, 'metadata': self.config.metadata, 'actionsStarted': self.actionsStarted, 'actionsFinished': self.actionsFinished})
@@ -213,22 +327,28 @@ class GeneratePython(titus.pfaast.Task):
 """ + commands)
 
             out.append("""        except Exception:
-            for cell in self.cells.values():
-                cell.maybeRestoreBackup()
-            for pool in self.pools.values():
-                pool.maybeRestoreBackup()
+            state.rollback()
             raise
 """)
 
+            if context.method == Method.MAP:
+                commands = self.commandsMap(action, "                ", True)
+            elif context.method == Method.EMIT:
+                commands = self.commandsEmit(action, "                ")
+            elif context.method == Method.FOLD:
+                commands = self.commandsFold(action, "                ", True)
+
+            out.append(self.actionBatch(context.method, """        scope.let({'name': self.config.name, 'instance': self.instance, 'metadata': self.config.metadata})
+        if self.config.version is not None:
+            scope.let({'version': self.config.version})
+""", """                scope.let({'input': input, 'actionsStarted': self.actionsStarted, 'actionsFinished': self.actionsFinished})
+""" + commands))
+
             if context.merge is not None:
                 out.append("""
     def merge(self, tallyOne, tallyTwo):
         state = ExecutionState(self.options, self.rand, 'merge', self.parser)
         scope = DynamicScope(None)
-        for cell in self.cells.values():
-            cell.maybeSaveBackup()
-        for pool in self.pools.values():
-            pool.maybeSaveBackup()
         try:
             scope.let({'tallyOne': tallyOne, 'tallyTwo': tallyTwo, 'name': self.config.name, 'instance': self.instance, 'metadata': self.config.metadata})
             if self.config.version is not None:
@@ -236,10 +356,7 @@ class GeneratePython(titus.pfaast.Task):
 """ + self.commandsFoldMerge(mergeTasks, "            "))
 
                 out.append("""        except Exception:
-            for cell in self.cells.values():
-                cell.maybeRestoreBackup()
-            for pool in self.pools.values():
-                pool.maybeRestoreBackup()
+            state.rollback()
             raise
 """)
 
@@ -250,7 +367,7 @@ class GeneratePython(titus.pfaast.Task):
                 
                 out.append("""
     def end(self):
-        state = ExecutionState(self.options, self.rand, 'action', self.parser)
+        state = ExecutionState(self.options, self.rand, 'end', self.parser)
         scope = DynamicScope(None)
         scope.let({'name': self.config.name, 'instance': self.instance, 'metadata': self.config.metadata, 'actionsStarted': self.actionsStarted, 'actionsFinished': self.actionsFinished})
         if self.config.version is not None:
@@ -260,7 +377,7 @@ class GeneratePython(titus.pfaast.Task):
             return "".join(out)
 
         elif isinstance(context, FcnDef.Context):
-            return "labeledFcn(lambda state, scope: do(" + ", ".join(context.exprs) + "), [" + ", ".join(map(repr, context.paramNames)) + "])"
+            return self.Expression("labeledFcn(lambda state, scope: do(" + ", ".join(context.exprs) + "), [" + ", ".join(map(repr, context.paramNames)) + "])", retrySafe=self.retrySafe(context.calls))
 
         elif isinstance(context, FcnRef.Context):
             return "self.f[" + repr(context.fcn.name) + "]"
@@ -282,7 +399,7 @@ class GeneratePython(titus.pfaast.Task):
             return "call(state, DynamicScope(None), self.f['u.' + " + context.name + "], [" + ", ".join(context.args) + "])"
 
         elif isinstance(context, Call.Context):
-            return context.fcn.genpy(context.paramTypes + [context.retType], context.args)
+            return self.profileCall(context, context.fcn.genpy(context.paramTypes + [context.retType], context.args))
 
         elif isinstance(context, Ref.Context):
             return "scope.get({0})".format(repr(context.name))
@@ -300,10 +417,10 @@ class GeneratePython(titus.pfaast.Task):
             return str(context.value)
 
         elif isinstance(context, LiteralFloat.Context):
-            return str(float(context.value))
+            return repr(float(context.value))
 
         elif isinstance(context, LiteralDouble.Context):
-            return str(float(context.value))
+            return repr(float(context.value))
 
         elif isinstance(context, LiteralString.Context):
             return repr(context.value)
@@ -336,16 +453,18 @@ class GeneratePython(titus.pfaast.Task):
             return "update(state, scope, {0}, [{1}], {2})".format(context.expr, self.reprPath(context.path), context.to)
 
         elif isinstance(context, CellGet.Context):
-            return "get(self.cells[{0}].value, [{1}])".format(repr(context.cell), self.reprPath(context.path))
+            return "self.cells[{0}].get([{1}])".format(repr(context.cell), self.reprPath(context.path))
 
         elif isinstance(context, CellTo.Context):
-            return "self.cells[{0}].update(state, scope, [{1}], {2})".format(repr(context.cell), self.reprPath(context.path), context.to)
+            call = "self.cells[{0}].update(state, scope, [{1}], {2}".format(repr(context.cell), self.reprPath(context.path), context.to)
+            return self.Expression(*self.updateCall(call, context))
 
         elif isinstance(context, PoolGet.Context):
-            return "get(self.pools[{0}].value, [{1}])".format(repr(context.pool), self.reprPath(context.path))
+            return "self.pools[{0}].get([{1}])".format(repr(context.pool), self.reprPath(context.path))
 
         elif isinstance(context, PoolTo.Context):
-            return "self.pools[{0}].update(state, scope, [{1}], {2}, {3})".format(repr(context.pool), self.reprPath(context.path), context.to, context.init)
+            call = "self.pools[{0}].update(state, scope, [{1}], {2}, {3}".format(repr(context.pool), self.reprPath(context.path), context.to, context.init)
+            return self.Expression(*self.updateCall(call, context))
 
         elif isinstance(context, If.Context):
             if context.elseClause is None:
@@ -405,11 +524,565 @@ class GeneratePython(titus.pfaast.Task):
             raise PFASemanticException("unrecognized context class: " + str(type(context)), "")
 
 class GeneratePythonPure(GeneratePython):
-    pass
+    def profileRoutine(self, routine, codes):
+        out = []
+        for index, code in enumerate(codes):
+            wrap = "self.profiler.call(" + self.profileKey(routine, getattr(self.profile, routine)[index].pos) + ", lambda: {0})"
+            discarded = self.discard(code)
+            out.append(self.Expression(wrap.format(code), None if discarded is code else wrap.format(discarded)))
+        return out
+
+class GeneratePythonFast(GeneratePython):
+    # Each result is a list of statements that must run first and an expression for the value; PFA symbols are Python locals.
+    class Code(object):
+        def __init__(self, stmts, expr, trivial=False, defsOnly=None, discarded=None):
+            self.stmts = stmts
+            self.expr = expr
+            self.trivial = trivial
+            self.discarded = discarded
+            self.retrySafe = False
+            if defsOnly is None:
+                defsOnly = (len(stmts) == 0)
+            self.defsOnly = defsOnly
+
+    def __init__(self):
+        self.counter = 0
+
+    def newName(self, prefix):
+        self.counter += 1
+        return "{0}{1}".format(prefix, self.counter)
+
+    def sym(self, name):
+        return "v_" + name
+
+    def indent(self, lines):
+        return ["    " + x for x in lines]
+
+    def discard(self, code):
+        if code.trivial:
+            return list(code.stmts)
+        elif code.discarded is not None:
+            return code.stmts + [code.discarded]
+        else:
+            return code.stmts + [code.expr]
+
+    def block(self, codes, target=None, ret=False):
+        out = []
+        for code in codes[:-1]:
+            out.extend(self.discard(code))
+        last = codes[-1]
+        if ret:
+            out.extend(last.stmts)
+            out.append("return " + last.expr)
+        elif target is None:
+            out.extend(self.discard(last))
+        else:
+            out.extend(last.stmts)
+            out.append(target + " = " + last.expr)
+        if len(out) == 0:
+            out.append("pass")
+        return out
+
+    def sequence(self, codes, lazy=False):
+        # arguments that need statements after a non-trivial argument (or in a short-circuiting operator) become thunks, preserving evaluation order
+        stmts = []
+        exprs = []
+        defsOnly = True
+        for i, code in enumerate(codes):
+            if i == 0 or code.defsOnly or (not lazy and all(x.trivial for x in codes[:i])):
+                stmts.extend(code.stmts)
+                exprs.append(code.expr)
+                defsOnly = defsOnly and code.defsOnly
+            else:
+                thunk = self.newName("_g")
+                stmts.append("def " + thunk + "():")
+                stmts.extend(self.indent(code.stmts + ["return " + code.expr]))
+                exprs.append(thunk + "()")
+        return stmts, exprs, defsOnly
+
+    def hoist(self, codes):
+        # "to" and "init" may assign enclosing symbols, so they can't be thunks; spill earlier arguments instead
+        stmts = []
+        exprs = []
+        for i, code in enumerate(codes):
+            stmts.extend(code.stmts)
+            if code.trivial or all(x.defsOnly for x in codes[i + 1:]):
+                exprs.append(code.expr)
+            else:
+                tmp = self.newName("tmp")
+                stmts.append(tmp + " = " + code.expr)
+                exprs.append(tmp)
+        return stmts, exprs, all(x.defsOnly for x in codes)
+
+    def assign(self, nameTypeExpr):
+        if len(nameTypeExpr) == 1:
+            n, t, e = nameTypeExpr[0]
+            return e.stmts + [self.sym(n) + " = " + e.expr]
+        else:
+            stmts = []
+            temps = []
+            for n, t, e in nameTypeExpr:
+                tmp = self.newName("tmp")
+                stmts.extend(e.stmts)
+                stmts.append(tmp + " = " + e.expr)
+                temps.append((n, tmp))
+            return stmts + [self.sym(n) + " = " + tmp for n, tmp in temps]
+
+    def pathCodes(self, path):
+        out = []
+        for p in path:
+            if isinstance(p, ArrayIndex):
+                out.append(p.i)
+            elif isinstance(p, MapIndex):
+                out.append(p.k)
+            elif isinstance(p, RecordIndex):
+                out.append(self.Code([], repr(p.f), trivial=True))
+            else:
+                raise Exception
+        return out
+
+    def checkTime(self, engineOptions):
+        if max(engineOptions.timeout, engineOptions.timeout_begin, engineOptions.timeout_action, engineOptions.timeout_end) > 0:
+            return ["state.checkTime()"]
+        else:
+            return []
+
+    def fcnDef(self, paramNames, exprs):
+        name = self.newName("_f")
+        return self.Code(["def " + name + "(" + ", ".join(["state", "scope", "paramTypes"] + map(self.sym, paramNames)) + "):"] + self.indent(self.block(exprs, ret=True)), name, trivial=True, defsOnly=True)
+
+    def condChain(self, walkBlocks, target):
+        first, rest = walkBlocks[0], walkBlocks[1:]
+        out = first.pred.stmts + ["if " + first.pred.expr + ":"] + self.indent(self.block(first.exprs, target))
+        if len(rest) > 0:
+            if rest[0].pred is None:
+                out += ["else:"] + self.indent(self.block(rest[0].exprs, target))
+            else:
+                sub = self.condChain(rest, target)
+                if len(rest[0].pred.stmts) == 0:
+                    out += ["el" + sub[0]] + sub[1:]
+                else:
+                    out += ["else:"] + self.indent(sub)
+        elif target is not None:
+            out += ["else:"] + self.indent([target + " = None"])
+        return out
+
+    def castChain(self, value, fromType, cases, target):
+        name, toType, clause = cases[0]
+        ok = self.newName("tmp")
+        castValue = self.newName("tmp")
+        out = [ok + ", " + castValue + " = castValue(" + value + ", " + repr(fromType) + ", " + repr(toType) + ", self.parser)",
+               "if " + ok + ":"] + \
+              self.indent([self.sym(name) + " = " + castValue] + self.block(clause, target))
+        if len(cases) > 1:
+            out += ["else:"] + self.indent(self.castChain(value, fromType, cases[1:], target))
+        elif target is not None:
+            out += ["else:"] + self.indent([target + " = None"])
+        return out
+
+    def profileRoutine(self, routine, codes, keepLast):
+        out = []
+        for index, code in enumerate(codes):
+            stmts = ["self.profiler.enter(" + self.profileKey(routine, getattr(self.profile, routine)[index].pos) + ")", "try:"]
+            if keepLast and index == len(codes) - 1:
+                tmp = self.newName("tmp")
+                stmts += self.indent(code.stmts + [tmp + " = " + code.expr])
+                expr = tmp
+            else:
+                stmts += self.indent(self.discard(code) or ["pass"])
+                expr = "None"
+            out.append(self.Code(stmts + ["finally:", "    self.profiler.exit()"], expr, trivial=True))
+        return out
+
+    def routine(self, symbols, codes, indent):
+        out = [self.sym(n) + " = " + e for n, e in symbols]
+        for code in codes[:-1]:
+            out.extend(self.discard(code))
+        return "".join(indent + x + "\n" for x in out + codes[-1].stmts), codes[-1]
+
+    def routineSymbols(self, context, *extra):
+        out = [("name", "self.config.name"), ("instance", "self.instance"), ("metadata", "self.config.metadata")]
+        if context.version is not None:
+            out.append(("version", "self.config.version"))
+        return out + list(extra)
+
+    def engineClass(self, context, engineOptions):
+        if context.name is None:
+            name = titus.util.uniqueEngineName()
+        else:
+            name = context.name
+
+        begin, beginSymbols, beginCalls = context.begin
+        action, actionSymbols, actionCalls = context.action
+        end, endSymbols, endCalls = context.end
+
+        callGraph = self.callGraph(context)
+        if context.merge is not None:
+            mergeTasks, mergeSymbols, mergeCalls = context.merge
+
+        if self.profile is not None:
+            begin = self.profileRoutine("begin", begin, False)
+            action = self.profileRoutine("action", action, context.method != Method.EMIT)
+            end = self.profileRoutine("end", end, False)
+            if context.merge is not None:
+                mergeTasks = self.profileRoutine("merge", mergeTasks, True)
+
+        out = ["class PFA_" + name + """(PFAEngine):
+    def __init__(self, cells, pools, config, options, log, emit, zero, instance, rand):
+        self.actionsStarted = 0
+        self.actionsFinished = 0
+        self.cells = cells
+        self.pools = pools
+        self.config = config
+        self.inputType = config.input
+        self.checkInput = compileCheckData(config.input)
+        self.outputType = config.output
+        self.options = options
+        self.log = log
+        self.emit = emit
+        self.instance = instance
+        self.rand = rand
+        self.callGraph = """ + repr(callGraph) + "\n"]
+
+        if context.method == Method.FOLD:
+            out.append("        self.tally = zero\n")
+
+        out.append("""    def initialize(self):
+        self
+""")
+
+        for ufname, fcnContext in context.fcns:
+            code = self(fcnContext, engineOptions)
+            out.append("".join("        " + x + "\n" for x in code.stmts))
+            out.append("        self.f[" + repr(ufname) + "] = " + code.expr + "\n")
+        if self.profile is not None:
+            out.append(self.profileFcns(context.fcns))
+
+        if len(begin) > 0:
+            body, last = self.routine(self.routineSymbols(context), begin, "        ")
+            out.append("""
+    def begin(self):
+        state = ExecutionState(self.options, self.rand, 'begin', self.parser)
+        scope = DynamicScope(None)
+""" + body + "".join("        " + x + "\n" for x in self.discard(self.Code([], last.expr, last.trivial, discarded=last.discarded))))
+
+        if context.method == Method.FOLD:
+            symbols = self.routineSymbols(context, ("input", "input"), ("actionsStarted", "self.actionsStarted"), ("actionsFinished", "self.actionsFinished"), ("tally", "self.tally"))
+        else:
+            symbols = self.routineSymbols(context, ("input", "input"), ("actionsStarted", "self.actionsStarted"), ("actionsFinished", "self.actionsFinished"))
+        body, last = self.routine(symbols, action, "            ")
+
+        if context.method == Method.MAP:
+            commands = body + "            last = " + last.expr + "\n" + \
+                       "            self.actionsFinished += 1\n" + \
+                       "            return last\n"
+        elif context.method == Method.EMIT:
+            commands = body + "".join("            " + x + "\n" for x in self.discard(self.Code([], last.expr, last.trivial, discarded=last.discarded))) + \
+                       "            self.actionsFinished += 1\n"
+        elif context.method == Method.FOLD:
+            commands = body + "            self.tally = " + last.expr + "\n" + \
+                       "            self.actionsFinished += 1\n" + \
+                       "            return self.tally\n"
+
+        out.append("""
+    def action(self, input, check=True):
+        if check:
+            input = self.checkInput(input)
+        state = ExecutionState(self.options, self.rand, 'action', self.parser)
+        scope = DynamicScope(None)
+        self.actionsStarted += 1
+        try:
+""" + commands)
+
+        out.append("""        except Exception:
+            state.rollback()
+            raise
+""")
+
+        prologue = "".join("        " + self.sym(n) + " = " + e + "\n" for n, e in self.routineSymbols(context))
+        if context.method == Method.FOLD:
+            body, last = self.routine([("input", "input"), ("actionsStarted", "self.actionsStarted"), ("actionsFinished", "self.actionsFinished"), ("tally", "self.tally")], action, "                ")
+            commands = body + "                self.tally = " + last.expr + "\n" + \
+                       "                self.actionsFinished += 1\n" + \
+                       "                out.append(self.tally)\n"
+        else:
+            body, last = self.routine([("input", "input"), ("actionsStarted", "self.actionsStarted"), ("actionsFinished", "self.actionsFinished")], action, "                ")
+            if context.method == Method.MAP:
+                commands = body + "                out.append(" + last.expr + ")\n" + \
+                           "                self.actionsFinished += 1\n"
+            else:
+                commands = body + "".join("                " + x + "\n" for x in self.discard(self.Code([], last.expr, last.trivial, discarded=last.discarded))) + \
+                           "                self.actionsFinished += 1\n"
+        out.append(self.actionBatch(context.method, prologue, commands))
+
+        if context.merge is not None:
+            body, last = self.routine(self.routineSymbols(context, ("tallyOne", "tallyOne"), ("tallyTwo", "tallyTwo")), mergeTasks, "            ")
+            out.append("""
+    def merge(self, tallyOne, tallyTwo):
+        state = ExecutionState(self.options, self.rand, 'merge', self.parser)
+        scope = DynamicScope(None)
+        try:
+""" + body + "            self.tally = " + last.expr + "\n" + \
+             "            return self.tally\n")
+
+            out.append("""        except Exception:
+            state.rollback()
+            raise
+""")
+
+        if len(end) > 0:
+            if context.method == Method.FOLD:
+                symbols = self.routineSymbols(context, ("actionsStarted", "self.actionsStarted"), ("actionsFinished", "self.actionsFinished"), ("tally", "self.tally"))
+            else:
+                symbols = self.routineSymbols(context, ("actionsStarted", "self.actionsStarted"), ("actionsFinished", "self.actionsFinished"))
+            body, last = self.routine(symbols, end, "        ")
+            out.append("""
+    def end(self):
+        state = ExecutionState(self.options, self.rand, 'end', self.parser)
+        scope = DynamicScope(None)
+""" + body + "".join("        " + x + "\n" for x in self.discard(self.Code([], last.expr, last.trivial, discarded=last.discarded))))
+
+        return "".join(out)
+
+    def __call__(self, context, engineOptions):
+        if isinstance(context, EngineConfig.Context):
+            return self.engineClass(context, engineOptions)
+
+        elif isinstance(context, FcnDef.Context):
+            code = self.fcnDef(context.paramNames, context.exprs)
+            code.retrySafe = self.retrySafe(context.calls)
+            return code
+
+        elif isinstance(context, FcnRef.Context):
+            return self.Code([], "self.f[" + repr(context.fcn.name) + "]", trivial=True)
+
+        elif isinstance(context, FcnRefFill.Context):
+            reducedArgs = []
+            args = []
+            for name in context.originalParamNames:
+                if name in context.argTypeResult:
+                    args.append(context.argTypeResult[name][1])
+                else:
+                    reducedArgs.append(self.newName("arg"))
+                    args.append(self.Code([], reducedArgs[-1], trivial=True))
+            stmts, exprs, defsOnly = self.sequence(args)
+            name = self.newName("_f")
+            body = stmts + ["return self.f[" + repr(context.fcn.name) + "](" + ", ".join(["state", "scope", "None"] + exprs) + ")"]
+            return self.Code(["def " + name + "(" + ", ".join(["state", "scope", "paramTypes"] + reducedArgs) + "):"] + self.indent(body), name, trivial=True, defsOnly=True)
+
+        elif isinstance(context, CallUserFcn.Context):
+            stmts, exprs, defsOnly = self.sequence([context.name] + context.args)
+            return self.Code(stmts, "self.f['u.' + " + exprs[0] + "](" + ", ".join(["state", "scope", "None"] + exprs[1:]) + ")", defsOnly=defsOnly)
+
+        elif isinstance(context, Call.Context):
+            stmts, exprs, defsOnly = self.sequence(context.args, isinstance(context.fcn, (titus.lib1.core.LogicalAnd, titus.lib1.core.LogicalOr)))
+            if isinstance(context.fcn, titus.pfaast.UserFcn):
+                return self.Code(stmts, "self.f[" + repr(context.fcn.name) + "](" + ", ".join(["state", "scope", "None"] + exprs) + ")", defsOnly=defsOnly)
+            return self.Code(stmts, self.profileCall(context, context.fcn.genpy(context.paramTypes + [context.retType], exprs)), defsOnly=defsOnly)
+
+        elif isinstance(context, Ref.Context):
+            return self.Code([], self.sym(context.name), trivial=True)
+
+        elif isinstance(context, LiteralNull.Context):
+            return self.Code([], "None", trivial=True)
+
+        elif isinstance(context, LiteralBoolean.Context):
+            return self.Code([], str(context.value), trivial=True)
+
+        elif isinstance(context, LiteralInt.Context):
+            return self.Code([], str(context.value), trivial=True)
+
+        elif isinstance(context, LiteralLong.Context):
+            return self.Code([], str(context.value), trivial=True)
+
+        elif isinstance(context, LiteralFloat.Context):
+            return self.Code([], repr(float(context.value)), trivial=True)
+
+        elif isinstance(context, LiteralDouble.Context):
+            return self.Code([], repr(float(context.value)), trivial=True)
+
+        elif isinstance(context, LiteralString.Context):
+            return self.Code([], repr(context.value), trivial=True)
+
+        elif isinstance(context, LiteralBase64.Context):
+            return self.Code([], repr(context.value), trivial=True)
+
+        elif isinstance(context, Literal.Context):
+            return self.Code([], repr(titus.datatype.jsonDecoder(context.retType, json.loads(context.value))), trivial=True)
+
+        elif isinstance(context, NewObject.Context):
+            names = list(context.fields.keys())
+            stmts, exprs, defsOnly = self.sequence([context.fields[x] for x in names])
+            return self.Code(stmts, "{" + ", ".join(repr(k) + ": " + v for k, v in zip(names, exprs)) + "}", defsOnly=defsOnly)
+
+        elif isinstance(context, NewArray.Context):
+            stmts, exprs, defsOnly = self.sequence(context.items)
+            return self.Code(stmts, "[" + ", ".join(exprs) + "]", defsOnly=defsOnly)
+
+        elif isinstance(context, Do.Context):
+            stmts = []
+            for code in context.exprs[:-1]:
+                stmts.extend(self.discard(code))
+            last = context.exprs[-1]
+            return self.Code(stmts + last.stmts, last.expr, trivial=last.trivial, discarded=last.discarded)
+
+        elif isinstance(context, Let.Context):
+            stmts = []
+            for n, t, e in context.nameTypeExpr:
+                stmts.extend(e.stmts)
+                stmts.append(self.sym(n) + " = " + e.expr)
+            return self.Code(stmts, "None", trivial=True)
+
+        elif isinstance(context, SetVar.Context):
+            return self.Code(self.assign(context.nameTypeExpr), "None", trivial=True)
+
+        elif isinstance(context, AttrGet.Context):
+            stmts, exprs, defsOnly = self.sequence([context.expr] + self.pathCodes(context.path))
+            return self.Code(stmts, "get(" + exprs[0] + ", [" + ", ".join(exprs[1:]) + "])", defsOnly=defsOnly)
+
+        elif isinstance(context, AttrTo.Context):
+            stmts, exprs, defsOnly = self.hoist([context.expr] + self.pathCodes(context.path) + [context.to])
+            return self.Code(stmts, "update(state, scope, {0}, [{1}], {2})".format(exprs[0], ", ".join(exprs[1:-1]), exprs[-1]), defsOnly=defsOnly)
+
+        elif isinstance(context, CellGet.Context):
+            stmts, exprs, defsOnly = self.sequence(self.pathCodes(context.path))
+            if len(exprs) == 0:
+                return self.Code(stmts, "self.cells[{0}].value".format(repr(context.cell)), defsOnly=defsOnly)
+            else:
+                return self.Code(stmts, "self.cells[{0}].get([{1}])".format(repr(context.cell), ", ".join(exprs)), defsOnly=defsOnly)
+
+        elif isinstance(context, CellTo.Context):
+            stmts, exprs, defsOnly = self.hoist(self.pathCodes(context.path) + [context.to])
+            call = "self.cells[{0}].update(state, scope, [{1}], {2}".format(repr(context.cell), ", ".join(exprs[:-1]), exprs[-1])
+            expr, discarded = self.updateCall(call, context)
+            return self.Code(stmts, expr, defsOnly=defsOnly, discarded=discarded)
+
+        elif isinstance(context, PoolGet.Context):
+            stmts, exprs, defsOnly = self.sequence(self.pathCodes(context.path))
+            return self.Code(stmts, "self.pools[{0}].get([{1}])".format(repr(context.pool), ", ".join(exprs)), defsOnly=defsOnly)
+
+        elif isinstance(context, PoolTo.Context):
+            stmts, exprs, defsOnly = self.hoist(self.pathCodes(context.path) + [context.to, context.init])
+            call = "self.pools[{0}].update(state, scope, [{1}], {2}, {3}".format(repr(context.pool), ", ".join(exprs[:-2]), exprs[-2], exprs[-1])
+            expr, discarded = self.updateCall(call, context)
+            return self.Code(stmts, expr, defsOnly=defsOnly, discarded=discarded)
+
+        elif isinstance(context, If.Context):
+            pred = context.predicate
+            if context.elseClause is None:
+                stmts = pred.stmts + ["if " + pred.expr + ":"] + self.indent(self.block(context.thenClause))
+                return self.Code(stmts, "None", trivial=True)
+            else:
+                tmp = self.newName("tmp")
+                stmts = pred.stmts + ["if " + pred.expr + ":"] + self.indent(self.block(context.thenClause, tmp)) + \
+                        ["else:"] + self.indent(self.block(context.elseClause, tmp))
+                return self.Code(stmts, tmp, trivial=True)
+
+        elif isinstance(context, Cond.Context):
+            if not context.complete:
+                return self.Code(self.condChain(context.walkBlocks, None), "None", trivial=True)
+            else:
+                tmp = self.newName("tmp")
+                return self.Code(self.condChain(context.walkBlocks, tmp), tmp, trivial=True)
+
+        elif isinstance(context, While.Context):
+            pred = context.predicate
+            if len(pred.stmts) == 0:
+                stmts = ["while " + pred.expr + ":"] + self.indent(self.checkTime(engineOptions) + self.block(context.loopBody))
+            else:
+                stmts = ["while True:"] + self.indent(pred.stmts + ["if not (" + pred.expr + "):", "    break"] + self.checkTime(engineOptions) + self.block(context.loopBody))
+            return self.Code(stmts, "None", trivial=True)
+
+        elif isinstance(context, DoUntil.Context):
+            pred = context.predicate
+            stmts = ["while True:"] + self.indent(self.checkTime(engineOptions) + self.block(context.loopBody) + pred.stmts + ["if " + pred.expr + ":", "    break"])
+            return self.Code(stmts, "None", trivial=True)
+
+        elif isinstance(context, For.Context):
+            pred = context.predicate
+            stmts = []
+            for n, t, e in context.initNameTypeExpr:
+                stmts.extend(e.stmts)
+                stmts.append(self.sym(n) + " = " + e.expr)
+            loop = self.checkTime(engineOptions) + self.block(context.loopBody) + self.assign(context.stepNameTypeExpr)
+            if len(pred.stmts) == 0:
+                stmts += ["while " + pred.expr + ":"] + self.indent(loop)
+            else:
+                stmts += ["while True:"] + self.indent(pred.stmts + ["if not (" + pred.expr + "):", "    break"] + loop)
+            return self.Code(stmts, "None", trivial=True)
+
+        elif isinstance(context, Foreach.Context):
+            obj = context.objExpr
+            stmts = obj.stmts + ["for " + self.sym(context.name) + " in " + obj.expr + ":"] + self.indent(self.checkTime(engineOptions) + self.block(context.loopBody))
+            return self.Code(stmts, "None", trivial=True)
+
+        elif isinstance(context, Forkeyval.Context):
+            obj = context.objExpr
+            stmts = obj.stmts + ["for " + self.sym(context.forkey) + ", " + self.sym(context.forval) + " in " + obj.expr + ".items():"] + self.indent(self.checkTime(engineOptions) + self.block(context.loopBody))
+            return self.Code(stmts, "None", trivial=True)
+
+        elif isinstance(context, CastCase.Context):
+            return (context.name, context.toType, context.clause)
+
+        elif isinstance(context, CastBlock.Context):
+            value = self.newName("tmp")
+            stmts = context.expr.stmts + [value + " = " + context.expr.expr]
+            cases = [caseRes for castCtx, caseRes in context.cases]
+            if context.partial:
+                return self.Code(stmts + self.castChain(value, context.exprType, cases, None), "None", trivial=True)
+            else:
+                tmp = self.newName("tmp")
+                return self.Code(stmts + self.castChain(value, context.exprType, cases, tmp), tmp, trivial=True)
+
+        elif isinstance(context, Upcast.Context):
+            return context.expr
+
+        elif isinstance(context, IfNotNull.Context):
+            stmts, exprs, defsOnly = self.sequence([e for n, t, e in context.symbolTypeResult])
+            temps = []
+            for expr in exprs:
+                tmp = self.newName("tmp")
+                stmts.append(tmp + " = " + expr)
+                temps.append(tmp)
+            assignments = [self.sym(n) + " = untagUnion(" + tmp + ", " + repr(repr(t)) + ")" for (n, t, e), tmp in zip(context.symbolTypeResult, temps)]
+            stmts.append("if " + " and ".join(tmp + " is not None" for tmp in temps) + ":")
+            if context.elseClause is None:
+                stmts.extend(self.indent(assignments + self.block(context.thenClause)))
+                return self.Code(stmts, "None", trivial=True)
+            else:
+                result = self.newName("tmp")
+                stmts.extend(self.indent(assignments + self.block(context.thenClause, result)))
+                stmts.extend(["else:"] + self.indent(self.block(context.elseClause, result)))
+                return self.Code(stmts, result, trivial=True)
+
+        elif isinstance(context, Doc.Context):
+            return self.Code([], "None", trivial=True)
+
+        elif isinstance(context, Error.Context):
+            return self.Code([], "error(" + repr(context.message) + ", " + repr(context.code) + ")")
+
+        elif isinstance(context, Try.Context):
+            tmp = self.newName("tmp")
+            stmts = ["try:"] + self.indent(self.block(context.exprs, tmp))
+            if context.filter is None:
+                stmts += ["except Exception:"] + self.indent([tmp + " = None"])
+            else:
+                err = self.newName("err")
+                stmts += ["except Exception as " + err + ":"] + self.indent(["if " + err + ".message not in " + repr(context.filter) + ":", "    raise", tmp + " = None"])
+            return self.Code(stmts, tmp, trivial=True)
+
+        elif isinstance(context, Log.Context):
+            stmts, exprs, defsOnly = self.sequence([x[1] for x in context.exprTypes])
+            return self.Code(stmts, "self.log([{0}], {1})".format(", ".join(exprs), repr(context.namespace)), defsOnly=defsOnly)
+
+        else:
+            raise PFASemanticException("unrecognized context class: " + str(type(context)), "")
 
 ###########################################################################
 
 class ExecutionState(object):
+    checkInterval = 100
+
     def __init__(self, options, rand, routine, parser):
         self.rand = rand
         self.parser = parser
@@ -420,12 +1093,29 @@ class ExecutionState(object):
             self.timeout = options.timeout_action
         elif routine == "end":
             self.timeout = options.timeout_end
+        else:
+            self.timeout = options.timeout
+
+        self.startTime = time.time()
+        self.countdown = 1
+        self.journal = []
 
+    def restart(self):
         self.startTime = time.time()
+        self.countdown = 1
+        self.journal = []
+
+    def rollback(self):
+        while len(self.journal) > 0:
+            storageItem, key, existed, oldValue = self.journal.pop()
+            storageItem.restore(key, existed, oldValue)
 
     def checkTime(self):
-        if self.timeout > 0 and (time.time() - self.startTime) * 1000 > self.timeout:
-            raise PFATimeoutException("exceeded timeout of {0} milliseconds".format(self.timeout))
+        self.countdown -= 1
+        if self.countdown == 0:
+            self.countdown = self.checkInterval
+            if self.timeout > 0 and (time.time() - self.startTime) * 1000 > self.timeout:
+                raise PFATimeoutException("exceeded timeout of {0} milliseconds".format(self.timeout))
 
 class SharedState(object):
     def __init__(self):
@@ -436,92 +1126,200 @@ class SharedState(object):
         return "SharedState({0} cells, {1} pools)".format(len(self.cells), len(self.pools))
 
 class PersistentStorageItem(object):
+    tracked = False
+
     def __init__(self, value, shared, rollback):
+        self.updates = 0
+        self.owned = {}
         self.value = value
         self.shared = shared
         self.rollback = rollback
 
+    @property
+    def value(self):
+        if self.owned:
+            self.owned.clear()
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self.owned.clear()
+        if self.tracked:
+            self.replaced(value)
+        self._value = value
+
+    def get(self, path):
+        out = get(self._value, path)
+        if self.owned and isinstance(out, (dict, list)):
+            self.owned.clear()
+        return out
+
 class Cell(PersistentStorageItem):
     def __init__(self, value, shared, rollback):
         if shared:
             self.lock = threading.Lock()
         super(Cell, self).__init__(value, shared, rollback)
 
+    def track(self):
+        self.dirty = False
+        self.tracked = True
+
+    def replaced(self, value):
+        self.dirty = True
+
+    def takeDirty(self):
+        if self.shared:
+            with self.lock:
+                dirty, self.dirty = self.dirty, False
+        else:
+            dirty, self.dirty = self.dirty, False
+        return dirty
+
     def __repr__(self):
         contents = repr(self.value)
         if len(contents) > 30:
             contents = contents[:27] + "..."
         return "Cell(" + ("shared, " if self.shared else "") + ("rollback, " if self.rollback else "") + contents + ")"
             
-    def update(self, state, scope, path, to):
+    def update(self, state, scope, path, to, expose=True, optimistic=False):
         result = None
-        if self.shared:
-            self.lock.acquire()
-            self.value = update(state, scope, self.value, path, to)
-            result = self.value
-            self.lock.release()
+        if self.shared and optimistic:
+            while True:
+                old = self._value
+                result = update(state, scope, old, path, to)
+                with self.lock:
+                    if self._value is old:
+                        self._value = result
+                        self.updates += 1
+                        if self.tracked:
+                            self.dirty = True
+                        break
+        elif self.shared:
+            with self.lock:
+                self._value = update(state, scope, self._value, path, to)
+                result = self._value
+                self.updates += 1
+                if self.tracked:
+                    self.dirty = True
         else:
-            self.value = update(state, scope, self.value, path, to)
-            result = self.value
+            self.updates += 1
+            if self.tracked:
+                self.dirty = True
+            if self.rollback:
+                state.journal.append((self, None, True, self._value))
+                self.owned.clear()
+            self._value = updateOwned(state, scope, self._value, path, to, self.owned)
+            if expose:
+                self.owned.clear()
+                result = self._value
         return result
 
-    def maybeSaveBackup(self):
-        if self.rollback:
-            self.oldvalue = self.value
-
-    def maybeRestoreBackup(self):
-        if self.rollback:
-            self.value = self.oldvalue
+    def restore(self, key, existed, oldValue):
+        self.value = oldValue
 
 class Pool(PersistentStorageItem):
-    def __init__(self, value, shared, rollback):
+    lockStripes = 64
+    missing = object()
+
+    def __init__(self, value, shared, rollback, copyOnWrite=False):
         if shared:
-            self.locklock = threading.Lock()
-            self.locks = {}
+            self.locks = [threading.Lock() for i in xrange(self.lockStripes)]
+        self.copyOnWrite = copyOnWrite
         super(Pool, self).__init__(value, shared, rollback)
 
+    def track(self):
+        self.dirty = set()
+        self.tracked = True
+
+    def replaced(self, value):
+        self.dirty.update(self._value)
+        self.dirty.update(value)
+
+    def takeDirty(self):
+        if self.shared:
+            for lock in self.locks:
+                lock.acquire()
+            try:
+                dirty, self.dirty = self.dirty, set()
+            finally:
+                for lock in self.locks:
+                    lock.release()
+        else:
+            dirty, self.dirty = self.dirty, set()
+        return dirty
+
     def __repr__(self):
         contents = repr(self.value)
         if len(contents) > 30:
             contents = contents[:27] + "..."
         return "Pool(" + ("shared, " if self.shared else "") + ("rollback, " if self.rollback else "") + contents + ")"
 
-    def update(self, state, scope, path, to, init):
+    def update(self, state, scope, path, to, init, expose=True, optimistic=False):
         result = None
 
         head, tail = path[0], path[1:]
 
-        if self.shared:
-            self.locklock.acquire()
-            if head in self.locks:
-                self.locks[head].acquire()
-            else:
-                self.locks[head] = threading.Lock()
-                self.locks[head].acquire()
-            self.locklock.release()
-
-            if head not in self.value:
-                self.value[head] = init
-            self.value[head] = update(state, scope, self.value[head], tail, to)
-
-            result = self.value[head]
-            self.locks[head].release()
+        if self.shared and optimistic:
+            lock = self.locks[hash(head) % self.lockStripes]
+            while True:
+                old = self._value.get(head, self.missing)
+                result = update(state, scope, init if old is self.missing else old, tail, to)
+                with lock:
+                    if self._value.get(head, self.missing) is old:
+                        self._value[head] = result
+                        self.updates += 1
+                        if self.tracked:
+                            self.dirty.add(head)
+                        break
+
+        elif self.shared:
+            with self.locks[hash(head) % self.lockStripes]:
+                result = update(state, scope, self._value.get(head, init), tail, to)
+                self._value[head] = result
+                self.updates += 1
+                if self.tracked:
+                    self.dirty.add(head)
 
         else:
-            if head not in self.value:
-                self.value[head] = init
-            self.value[head] = update(state, scope, self.value[head], tail, to)
-            result = self.value[head]
+            self.updates += 1
+            if self.tracked:
+                self.dirty.add(head)
+            if self.copyOnWrite:
+                self._value = dict(self._value)
+                self.copyOnWrite = False
+            if self.rollback:
+                state.journal.append((self, head, head in self._value, self._value.get(head)))
+                self.owned.clear()
+            if head not in self._value:
+                self._value[head] = init
+            self._value[head] = updateOwned(state, scope, self._value[head], tail, to, self.owned)
+            if expose:
+                result = self._value[head]
+                if self.owned and isinstance(result, (dict, list)):
+                    self.owned.clear()
 
         return result
 
-    def maybeSaveBackup(self):
-        if self.rollback:
-            self.oldvalue = dict(self.value)
+    def emptyValue(self):
+        if isinstance(self._value, dict):
+            return {}
+        else:
+            return self._value.empty()
 
-    def maybeRestoreBackup(self):
-        if self.rollback:
-            self.value = self.oldvalue
+    def restore(self, key, existed, oldValue):
+        if existed:
+            self.value[key] = oldValue
+        else:
+            del self.value[key]
+
+def sampledCheck(check, every):
+    counter = itertools.count()
+    def sampled(data):
+        if counter.next() % every == 0:
+            return check(data)
+        else:
+            return data
+    return sampled
 
 def labeledFcn(fcn, paramNames):
     fcn.paramNames = paramNames
@@ -546,34 +1344,64 @@ def update(state, scope, obj, path, to):
         head, tail = path[0], path[1:]
 
         if isinstance(obj, dict):
-            out = {}
-            for k, v in obj.items():
-                if k == head:
-                    out[k] = update(state, scope, v, tail, to)
-                else:
-                    out[k] = v
+            out = dict(obj)
+            if head in out:
+                out[head] = update(state, scope, out[head], tail, to)
             return out
 
         elif isinstance(obj, (list, tuple)):
-            out = []
-            for i, x in enumerate(obj):
-                if i == head:
-                    out.append(update(state, scope, x, tail, to))
-                else:
-                    out.append(x)
+            out = list(obj)
+            if 0 <= head < len(out):
+                out[head] = update(state, scope, out[head], tail, to)
             return out
 
         else:
             raise Exception
 
     elif callable(to):
-        callScope = DynamicScope(scope)
-        callScope.let({to.paramNames[0]: obj})
-        return to(state, callScope)
+        return titus.util.callfcn(state, scope, to, [obj])
 
     else:
         return to
-        
+
+def updateOwned(state, scope, obj, path, to, owned):
+    x = obj
+    for head in path:
+        if isinstance(x, dict):
+            if head not in x:
+                return obj
+        elif isinstance(x, (list, tuple)):
+            if not 0 <= head < len(x):
+                return obj
+        else:
+            raise Exception
+        x = x[head]
+
+    if callable(to):
+        if isinstance(x, (dict, list)):
+            owned.clear()
+        to = titus.util.callfcn(state, scope, to, [x])
+    elif id(x) in owned:
+        owned.clear()
+
+    if len(path) == 0:
+        owned.clear()
+        return to
+
+    if id(obj) not in owned:
+        obj = dict(obj) if isinstance(obj, dict) else list(obj)
+        owned[id(obj)] = obj
+    parent = obj
+    for head in path[:-1]:
+        child = parent[head]
+        if id(child) not in owned:
+            child = dict(child) if isinstance(child, dict) else list(child)
+            owned[id(child)] = child
+            parent[head] = child
+        parent = child
+    parent[path[-1]] = to
+    return obj
+
 def do(*exprs):
     # You've already done them; just return the right value.
     if len(exprs) > 0:
@@ -652,32 +1480,40 @@ def doForkeyval(state, scope, forkey, forval, mapping, loopBody):
         loopBody(state, bodyScope)
     return None
         
-def cast(state, scope, expr, fromType, cases, partial, parser):
-    fromType = parser.getAvroType(fromType)
+castTypes = {}
+
+def castValue(expr, fromType, toType, parser):
+    # generated code passes types as JSON-like literals; lists and dicts are keyed by their JSON form
+    key = tuple(x if isinstance(x, basestring) else json.dumps(x, sort_keys=True) for x in (fromType, toType))
+    if key not in castTypes:
+        toAvroType = parser.getAvroType(toType)
+        castTypes[key] = isinstance(parser.getAvroType(fromType), titus.datatype.AvroUnion), toAvroType.name, titus.datatype.compileJsonDecoder(toAvroType)
+    fromUnion, toName, decode = castTypes[key]
+
+    if fromUnion and isinstance(expr, dict) and len(expr) == 1:
+        tag, = expr.keys()
+        value, = expr.values()
+
+        if not ((tag == toName) or \
+                (tag == "int" and toName in ("long", "float", "double")) or \
+                (tag == "long" and toName in ("float", "double")) or \
+                (tag == "float" and toName == "double")):
+            return False, None
 
-    for name, toType, clause in cases:
-        toType = parser.getAvroType(toType)
-
-        if isinstance(fromType, titus.datatype.AvroUnion) and isinstance(expr, dict) and len(expr) == 1:
-            tag, = expr.keys()
-            value, = expr.values()
-
-            if not ((tag == toType.name) or \
-                    (tag == "int" and toType.name in ("long", "float", "double")) or \
-                    (tag == "long" and toType.name in ("float", "double")) or \
-                    (tag == "float" and toType.name == "double")):
-                continue
+    else:
+        value = expr
 
-        else:
-            value = expr
+    try:
+        return True, decode(value)
+    except (AvroException, TypeError):
+        return False, None
 
-        try:
-            castValue = titus.datatype.jsonDecoder(toType, value)
-        except (AvroException, TypeError):
-            pass
-        else:
+def cast(state, scope, expr, fromType, cases, partial, parser):
+    for name, toType, clause in cases:
+        ok, value = castValue(expr, fromType, toType, parser)
+        if ok:
             clauseScope = DynamicScope(scope)
-            clauseScope.let({name: castValue})
+            clauseScope.let({name: value})
             out = clause(state, clauseScope)
 
             if partial:
@@ -686,31 +1522,30 @@ def cast(state, scope, expr, fromType, cases, partial, parser):
                 return out
     return None
 
-def untagUnions(nameExpr, nameType):
-    out = {}
-    for name, expr in nameExpr.items():
-        if isinstance(expr, dict) and len(expr) == 1:
-            tag, = expr.keys()
-            value, = expr.values()
-
-            expectedTag = json.loads(nameType[name])
-            if isinstance(expectedTag, dict):
-                if expectedTag["type"] in ("record", "enum", "fixed"):
-                    if "namespace" in expectedTag and expectedTag["namespace"].strip() != "":
-                        expectedTag = expectedTag["namespace"] + "." + expectedTag["name"]
-                    else:
-                        expectedTag = expectedTag["name"]
-                else:
-                    expectedTag = expectedTag["type"]
+def untagUnion(expr, avroType):
+    if isinstance(expr, dict) and len(expr) == 1:
+        tag, = expr.keys()
+        value, = expr.values()
 
-            if tag == expectedTag:
-                out[name] = value
+        expectedTag = json.loads(avroType)
+        if isinstance(expectedTag, dict):
+            if expectedTag["type"] in ("record", "enum", "fixed"):
+                if "namespace" in expectedTag and expectedTag["namespace"].strip() != "":
+                    expectedTag = expectedTag["namespace"] + "." + expectedTag["name"]
+                else:
+                    expectedTag = expectedTag["name"]
             else:
-                out[name] = expr
+                expectedTag = expectedTag["type"]
+
+        if tag == expectedTag:
+            return value
         else:
-            out[name] = expr
+            return expr
+    else:
+        return expr
 
-    return out
+def untagUnions(nameExpr, nameType):
+    return dict((name, untagUnion(expr, nameType[name])) for name, expr in nameExpr.items())
 
 def ifNotNull(state, scope, nameExpr, nameType, thenClause):
     if all(x is not None for x in nameExpr.values()):
@@ -781,16 +1616,92 @@ def checkForDeadlock(engineConfig, engine):
                 x.collect(SideEffectFunction())
     engineConfig.collect(WithFcnDef())
 
+def accessedInputFields(engineConfig):
+    """Return the names of the input record's fields that the action can read, or None if it may use the whole input.
+
+    Only ``input`` (or ``input.field...``) references in the action are considered, since functions and other methods
+    cannot see the input. Any use of ``input`` other than a field lookup, such as passing it to a function, casting it,
+    emitting it, or replacing one of its fields, counts as using every field.
+    """
+    if not isinstance(engineConfig.input, titus.datatype.AvroRecord):
+        return None
+
+    class InputRef(object):
+        def isDefinedAt(self, ast):
+            return isinstance(ast, Ref) and ast.name == "input"
+        def __call__(self, ref):
+            return ref
+
+    class InputField(object):
+        def isDefinedAt(self, ast):
+            return isinstance(ast, AttrGet) and isinstance(ast.expr, Ref) and ast.expr.name == "input" and isinstance(ast.path[0], LiteralString)
+        def __call__(self, attrGet):
+            return attrGet.path[0].value
+
+    refs = []
+    fields = []
+    for expr in engineConfig.action:
+        refs.extend(expr.collect(InputRef()))
+        fields.extend(expr.collect(InputField()))
+
+    if len(refs) > len(fields):
+        return None
+    return set(fields)
+
 class PFAEngine(object):
+    profiler = None
+    metrics = None
+    processPool = None
+
+    @property
+    def log(self):
+        return self._log
+
+    @log.setter
+    def log(self, log):
+        self._log = log if self.metrics is None else self.metrics.countLog(log)
+
+    @property
+    def emit(self):
+        return self._emit
+
+    @emit.setter
+    def emit(self, emit):
+        self._emit = emit if self.metrics is None else self.metrics.countEmit(emit)
+
+    @staticmethod
+    def fromAst(engineConfig, options=None, sharedState=None, multiplicity=1, style="pure", debug=False, optimize=True, profile=False, metrics=False):
+        engineOptions = titus.options.EngineOptions(engineConfig.options, options)
+        source, code, parser, callGraph = PFAEngine.compileAst(engineConfig, engineOptions, style, optimize, profile)
+        if debug:
+            print source
+        return PFAEngine.instantiate(engineConfig, engineOptions, code, parser, callGraph, None, None, sharedState, multiplicity, profile, metrics)
+
     @staticmethod
-    def fromAst(engineConfig, options=None, sharedState=None, multiplicity=1, style="pure", debug=False):
+    def compileAst(engineConfig, engineOptions, style, optimize, profile=False):
         functionTable = titus.pfaast.FunctionTable.blank()
 
-        engineOptions = titus.options.EngineOptions(engineConfig.options, options)
+        if optimize:
+            callGraph = GeneratePython.callGraph(engineConfig.walk(titus.pfaast.NoTask(), titus.pfaast.SymbolTable.blank(), titus.pfaast.FunctionTable.blank(), engineOptions)[0])
+            optimizer = titus.optimizer.Optimizer()
+            optimized = titus.optimizer.optimize(engineConfig, optimizer)
+            try:
+                context, source = optimized.walk(GeneratePython.makeTask(style, optimized if profile else None), titus.pfaast.SymbolTable.blank(), functionTable, engineOptions)
+            except PFASemanticException:
+                # only a dropped branch can legitimately change the document's types; anything else is a bug in the optimizer
+                if not optimizer.narrowed:
+                    raise
+                functionTable = titus.pfaast.FunctionTable.blank()
+                context, source = engineConfig.walk(GeneratePython.makeTask(style, engineConfig if profile else None), titus.pfaast.SymbolTable.blank(), functionTable, engineOptions)
+        else:
+            callGraph = None
+            context, source = engineConfig.walk(GeneratePython.makeTask(style, engineConfig if profile else None), titus.pfaast.SymbolTable.blank(), functionTable, engineOptions)
 
-        context, code = engineConfig.walk(GeneratePython.makeTask(style), titus.pfaast.SymbolTable.blank(), functionTable, engineOptions)
-        if debug:
-            print code
+        return source, compile(source, "<string>", "exec"), context.parser, callGraph
+
+    @staticmethod
+    def instantiate(engineConfig, engineOptions, code, parser, callGraph, cellValues, poolValues, sharedState, multiplicity, profile=False, metrics=False):
+        functionTable = titus.pfaast.FunctionTable.blank()
 
         sandbox = {# Scoring engine architecture
                    "PFAEngine": PFAEngine,
@@ -812,56 +1723,82 @@ class PFAEngine(object):
                    "doForeach": doForeach,
                    "doForkeyval": doForkeyval,
                    "cast": cast,
+                   "castValue": castValue,
                    "ifNotNull": ifNotNull,
                    "ifNotNullElse": ifNotNullElse,
+                   "untagUnion": untagUnion,
                    "error": error,
                    "tryCatch": tryCatch,
                    # Titus dependencies
                    "checkData": titus.datatype.checkData,
+                   "compileCheckData": titus.datatype.compileCheckData,
+                   "checkIntOverflow": titus.lib1.core.checkIntOverflow,
+                   "checkLongOverflow": titus.lib1.core.checkLongOverflow,
+                   "divide": titus.lib1.core.divide,
                    # Python libraries
                    "math": math,
                    }
 
         exec(code, sandbox)
         cls = [x for x in sandbox.values() if getattr(x, "__bases__", None) == (PFAEngine,)][0]
-        cls.parser = context.parser
+        cls.parser = parser
 
         if sharedState is None:
             sharedState = SharedState()
+        elif metrics and not all(isinstance(x, PersistentStorageItem) for x in sharedState.cells.values() + sharedState.pools.values()):
+            raise PFAInitializationException("metrics=True requires shared cells and pools held in this process, not by a ProcessPool")
 
+        cellInits = {}
         for cellName, cellConfig in engineConfig.cells.items():
-            if cellConfig.shared and cellName not in sharedState.cells:
-                value = titus.datatype.jsonDecoder(cellConfig.avroType, json.loads(cellConfig.init))
-                sharedState.cells[cellName] = Cell(value, cellConfig.shared, cellConfig.rollback)
+            if not cellConfig.shared or cellName not in sharedState.cells:
+                if cellValues is None:
+                    cellInits[cellName] = titus.datatype.compileJsonDecoder(cellConfig.avroType)(json.loads(cellConfig.init))
+                else:
+                    cellInits[cellName] = pickle.loads(cellValues[cellName])
+                if cellConfig.shared:
+                    sharedState.cells[cellName] = Cell(cellInits[cellName], cellConfig.shared, cellConfig.rollback)
+
+        for poolName in engineOptions.poolStorage:
+            if poolName not in engineConfig.pools:
+                raise PFAInitializationException("options refer to pool \"{0}\", which is not defined".format(poolName))
+
+        def poolValue(poolName, init):
+            storage = engineOptions.poolStorage.get(poolName)
+            if storage is None or storage["storage"] == "memory":
+                return init
+            else:
+                return titus.diskpool.DiskStore(engineConfig.pools[poolName].avroType, init, storage["cacheSize"], storage["directory"])
 
+        poolInits = {}
         for poolName, poolConfig in engineConfig.pools.items():
-            if poolConfig.shared and poolName not in sharedState.pools:
-                init = {}
-                for k, v in poolConfig.init.items():
-                    init[k] = json.loads(v)
-                value = titus.datatype.jsonDecoder(titus.datatype.AvroMap(poolConfig.avroType), init)
-                sharedState.pools[poolName] = Pool(value, poolConfig.shared, poolConfig.rollback)
+            if not poolConfig.shared or poolName not in sharedState.pools:
+                if poolValues is None:
+                    init = {}
+                    for k, v in poolConfig.init.items():
+                        init[k] = json.loads(v)
+                    poolInits[poolName] = titus.datatype.compileJsonDecoder(titus.datatype.AvroMap(poolConfig.avroType))(init)
+                else:
+                    poolInits[poolName] = pickle.loads(poolValues[poolName])
+                if poolConfig.shared:
+                    sharedState.pools[poolName] = Pool(poolValue(poolName, poolInits[poolName]), poolConfig.shared, poolConfig.rollback)
 
         out = []
         for index in xrange(multiplicity):
             cells = dict(sharedState.cells)
             pools = dict(sharedState.pools)
 
+            # cell values are replaced, never modified, so instances can share them
             for cellName, cellConfig in engineConfig.cells.items():
                 if not cellConfig.shared:
-                    value = titus.datatype.jsonDecoder(cellConfig.avroType, json.loads(cellConfig.init))
-                    cells[cellName] = Cell(value, cellConfig.shared, cellConfig.rollback)
+                    cells[cellName] = Cell(cellInits[cellName], cellConfig.shared, cellConfig.rollback)
 
             for poolName, poolConfig in engineConfig.pools.items():
                 if not poolConfig.shared:
-                    init = {}
-                    for k, v in poolConfig.init.items():
-                        init[k] = json.loads(v)
-                    value = titus.datatype.jsonDecoder(titus.datatype.AvroMap(poolConfig.avroType), init)
-                    pools[poolName] = Pool(value, poolConfig.shared, poolConfig.rollback)
+                    value = poolValue(poolName, poolInits[poolName])
+                    pools[poolName] = Pool(value, poolConfig.shared, poolConfig.rollback, multiplicity > 1 and isinstance(value, dict))
 
             if engineConfig.method == Method.FOLD:
-                zero = titus.datatype.jsonDecoder(engineConfig.output, json.loads(engineConfig.zero))
+                zero = titus.datatype.compileJsonDecoder(engineConfig.output)(json.loads(engineConfig.zero))
             else:
                 zero = None
 
@@ -879,21 +1816,91 @@ class PFAEngine(object):
                 f["emit"] = FakeEmitForExecution(engine)
             engine.f = f
             engine.config = engineConfig
+            if callGraph is not None:
+                engine.callGraph = callGraph
+            if profile:
+                engine.profiler = titus.profiler.Profiler(cls.__name__[4:])
+            if engineOptions.data_checkEvery > 1:
+                engine.checkInput = sampledCheck(engine.checkInput, engineOptions.data_checkEvery)
 
             checkForDeadlock(engineConfig, engine)
             engine.initialize()
+            if metrics:
+                engine.metrics = titus.metrics.EngineMetrics(engine)
+                engine.metrics.install()
 
             out.append(engine)
 
         return out
 
     @staticmethod
-    def fromJson(src, options=None, sharedState=None, multiplicity=1, style="pure", debug=False):
-        return PFAEngine.fromAst(titus.reader.jsonToAst(src), options, sharedState, multiplicity, style, debug)
+    def fromCache(cache, src, read, options, sharedState, multiplicity, style, debug, optimize, profile, metrics):
+        key = hashlib.sha256(json.dumps([src, titus.version.__version__, sys.version, style, optimize, profile, options], sort_keys=True)).hexdigest()
+        fileName = os.path.join(cache, key + ".pfacache")
+
+        try:
+            with open(fileName, "rb") as f:
+                cached = pickle.load(f)
+            engineConfig = cached["engineConfig"]
+            engineOptions = titus.options.EngineOptions(engineConfig.options, options)
+            code = marshal.loads(cached["code"])
+        except (IOError, EOFError, ValueError, TypeError, KeyError, AttributeError, ImportError, pickle.UnpicklingError):
+            engineConfig = read(src)
+            engineOptions = titus.options.EngineOptions(engineConfig.options, options)
+            source, code, parser, callGraph = PFAEngine.compileAst(engineConfig, engineOptions, style, optimize, profile)
+
+            cellValues = dict((k, pickle.dumps(titus.datatype.compileJsonDecoder(v.avroType)(json.loads(v.init)), pickle.HIGHEST_PROTOCOL)) for k, v in engineConfig.cells.items())
+            poolValues = dict((k, pickle.dumps(titus.datatype.compileJsonDecoder(titus.datatype.AvroMap(v.avroType))(dict((kk, json.loads(vv)) for kk, vv in v.init.items())), pickle.HIGHEST_PROTOCOL)) for k, v in engineConfig.pools.items())
+            cached = {"engineConfig": engineConfig, "parser": parser, "source": source, "code": marshal.dumps(code), "callGraph": callGraph, "cells": cellValues, "pools": poolValues}
+
+            tmpName = None
+            try:
+                if not os.path.exists(cache):
+                    os.makedirs(cache)
+                fd, tmpName = tempfile.mkstemp(suffix=".tmp", dir=cache)
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(cached, f, pickle.HIGHEST_PROTOCOL)
+                os.rename(tmpName, fileName)
+            except (IOError, OSError, pickle.PicklingError):
+                if tmpName is not None and os.path.exists(tmpName):
+                    os.remove(tmpName)
+
+        if debug:
+            print cached["source"]
+        return PFAEngine.instantiate(engineConfig, engineOptions, code, cached["parser"], cached["callGraph"], cached["cells"], cached["pools"], sharedState, multiplicity, profile, metrics)
 
     @staticmethod
-    def fromYaml(src, options=None, sharedState=None, multiplicity=1, style="pure", debug=False):
-        return PFAEngine.fromAst(titus.reader.yamlToAst(src), options, sharedState, multiplicity, style, debug)
+    def fromJson(src, options=None, sharedState=None, multiplicity=1, style="pure", debug=False, optimize=True, cache=None, profile=False, metrics=False):
+        if cache is None:
+            return PFAEngine.fromAst(titus.reader.jsonToAst(src), options, sharedState, multiplicity, style, debug, optimize, profile, metrics)
+        if isinstance(src, file):
+            src = src.read()
+        if not isinstance(src, basestring):
+            src = json.dumps(src, sort_keys=True)
+        return PFAEngine.fromCache(cache, src, titus.reader.jsonToAst, options, sharedState, multiplicity, style, debug, optimize, profile, metrics)
+
+    @staticmethod
+    def fromYaml(src, options=None, sharedState=None, multiplicity=1, style="pure", debug=False, optimize=True, cache=None, profile=False, metrics=False):
+        if cache is None:
+            return PFAEngine.fromAst(titus.reader.yamlToAst(src), options, sharedState, multiplicity, style, debug, optimize, profile, metrics)
+        if isinstance(src, file):
+            src = src.read()
+        return PFAEngine.fromCache(cache, src, titus.reader.yamlToAst, options, sharedState, multiplicity, style, debug, optimize, profile, metrics)
+
+    def profileReport(self, sort="cumulativeTime"):
+        if self.profiler is None:
+            raise PFAInitializationException("engine was not compiled with profile=True")
+        return self.profiler.report(sort)
+
+    def profileDump(self, fileName):
+        if self.profiler is None:
+            raise PFAInitializationException("engine was not compiled with profile=True")
+        self.profiler.dump(fileName)
+
+    def metricsSnapshot(self):
+        if self.metrics is None:
+            raise PFAInitializationException("engine was not created with metrics=True")
+        return self.metrics.snapshot()
 
     def snapshot(self):
         newCells = dict((k, AstCell(self.config.cells[k].avroPlaceholder, json.dumps(v.value), v.shared, v.rollback)) for k, v in self.cells.items())
@@ -918,6 +1925,70 @@ class PFAEngine(object):
             self.config.metadata,
             self.config.options)
 
+    def snapshotAvro(self, outputStream, codec="null", meta=None):
+        header = {"pfa.cells": json.dumps(dict((k, v.avroType.toJson()) for k, v in self.config.cells.items())),
+                  "pfa.pools": json.dumps(dict((k, v.avroType.toJson()) for k, v in self.config.pools.items()))}
+        if meta is not None:
+            header.update(meta)
+        writer = titus.avrocodec.ContainerWriter(outputStream, snapshotEntry, header, codec)
+
+        for k, v in self.cells.items():
+            out = []
+            titus.avrocodec.encoder(self.config.cells[k].avroType)(v.value, out)
+            writer.append({"name": k, "pool": False, "key": "", "value": "".join(out)})
+
+        # pool entries share a prefix and are assembled directly in SnapshotEntry's binary form
+        writeString = titus.avrocodec.writeString
+        writeBytes = titus.avrocodec.writeBytes
+        for k, v in self.pools.items():
+            encode = titus.avrocodec.encoder(self.config.pools[k].avroType)
+            prefix = []
+            writeString(k, prefix)
+            prefix.append("\x01")
+            prefix = "".join(prefix)
+            for kk, vv in (v.value.items() if v.shared else v.value.iteritems()):
+                value = []
+                encode(vv, value)
+                out = [prefix]
+                writeString(kk, out)
+                writeBytes("".join(value), out)
+                writer.appendEncoded("".join(out))
+
+        writer.flush()
+
+    def restoreAvro(self, inputStream):
+        reader = titus.avrocodec.ContainerReader(inputStream, snapshotEntry)
+
+        decoders = {}
+        for pool, meta, configs in (False, "pfa.cells", self.config.cells), (True, "pfa.pools", self.config.pools):
+            storage = "pool" if pool else "cell"
+            types = json.loads(reader.meta.get(meta, "{}"))
+            if set(types) != set(configs):
+                raise PFAInitializationException("snapshot {0}s {1} do not match engine {0}s {2}".format(storage, sorted(types), sorted(configs)))
+            for name, config in configs.items():
+                if types[name] != config.avroType.toJson():
+                    raise PFAInitializationException("snapshot {0} \"{1}\" has type {2} but the engine expects {3}".format(storage, name, types[name], config.avroType.toJson()))
+                decoders[pool, name] = titus.avrocodec.decoder(config.avroType)
+
+        cells = {}
+        pools = dict((k, v.emptyValue()) for k, v in self.pools.items())
+        for entry in reader:
+            value = decoders[entry["pool"], entry["name"]](StringIO(entry["value"]).read)
+            if entry["pool"]:
+                pools[entry["name"]][entry["key"]] = value
+            else:
+                cells[entry["name"]] = value
+
+        if set(cells) != set(self.cells):
+            raise PFAInitializationException("snapshot is missing cells {0}".format(sorted(set(self.cells).difference(cells))))
+
+        for k, v in cells.items():
+            self.cells[k].value = v
+        for k, v in pools.items():
+            self.pools[k].value = v
+
+        return reader.meta
+
     def calledBy(self, fcnName, exclude=None):
         if exclude is None:
             exclude = set()
@@ -960,7 +2031,18 @@ class PFAEngine(object):
         reach = self.calledBy(fcnName)
         return CellTo.desc in reach or PoolTo.desc in reach
 
-    def avroInputIterator(self, inputStream, interpreter="avro"):
+    def actionNumpy(self, dataset):
+        if not hasattr(self, "numpyScorer"):
+            from titus.producer.transformation import Transformation
+            self.numpyScorer = Transformation.numpyAction(self.config)
+        out = self.numpyScorer(dataset)
+        self.actionsStarted += len(out)
+        self.actionsFinished += len(out)
+        return out
+
+    def avroInputIterator(self, inputStream, interpreter="avro", project=False):
+        if project and interpreter != "titus":
+            raise ValueError("only the \"titus\" interpreter can project input records onto the fields that the action reads")
         if interpreter == "avro":
             return DataFileReader(inputStream, DatumReader())
         elif interpreter == "fastavro":
@@ -968,68 +2050,144 @@ class PFAEngine(object):
             return fastavro.reader(inputStream)
         elif interpreter == "correct-fastavro":
             return FastAvroCorrector(inputStream, self.config.input)
+        elif interpreter == "titus":
+            return iter(titus.avrocodec.ContainerReader(inputStream, self.config.input, tagged=True, fields=accessedInputFields(self.config) if project else None))
         else:
-            raise ValueError("interpreter must be one of \"avro\", \"fastavro\", and \"correct-fastavro\" (which corrects fastavro's handling of Unicode strings)")
+            raise ValueError("interpreter must be one of \"avro\", \"fastavro\", \"correct-fastavro\" (which corrects fastavro's handling of Unicode strings), and \"titus\" (which decodes straight into checked form)")
 
-    def avroOutputDataFileWriter(self, fileName):
-        return DataFileWriter(open(fileName, "w"), DatumWriter(), self.config.output.schema)
+    def avroOutputDataFileWriter(self, fileName, interpreter="avro"):
+        if interpreter == "avro":
+            return DataFileWriter(open(fileName, "w"), DatumWriter(), self.config.output.schema)
+        elif interpreter == "titus":
+            return titus.avrocodec.ContainerWriter(open(fileName, "wb"), self.config.output)
+        else:
+            raise ValueError("interpreter must be one of \"avro\" and \"titus\"")
 
 class FastAvroCorrector(object):
+    """Iterate over a fastavro reader, turning its strings into unicode and its bytes into str.
+
+    The correction is planned once per type: subtrees without strings, enums, bytes, fixed or maps are passed through untouched,
+    and union branches are chosen by the Python type of the datum (and the field names of records) rather than by trial and error.
+    """
+
     def __init__(self, inputStream, avroType):
         import fastavro
         self.reader = fastavro.reader(inputStream)
         self.avroType = avroType
+        self.correct = compileFastAvroCorrector(avroType)
 
     def __iter__(self):
         return self
 
     def next(self):
-        return self.correctFastAvro(self.reader.next(), self.avroType)
+        return self.correct(self.reader.next())
 
     def correctFastAvro(self, x, avroType):
-        if isinstance(avroType, (titus.datatype.AvroString, titus.datatype.AvroEnum)) and isinstance(x, str):
-            return x.decode("utf-8", "replace")
+        return compileFastAvroCorrector(avroType)(x)
+
+fastAvroCorrectors = {}
+
+def compileFastAvroCorrector(avroType):
+    key = repr(avroType)
+    if key not in fastAvroCorrectors:
+        correct = _fastAvroCorrection(avroType, {})
+        if correct is None:
+            correct = lambda x: x
+        fastAvroCorrectors[key] = correct
+    return fastAvroCorrectors[key]
+
+def _fastAvroNeedsCorrection(avroType, seen):
+    if isinstance(avroType, (titus.datatype.AvroString, titus.datatype.AvroEnum, titus.datatype.AvroBytes, titus.datatype.AvroFixed, titus.datatype.AvroMap)):
+        return True
+    elif isinstance(avroType, titus.datatype.AvroArray):
+        return _fastAvroNeedsCorrection(avroType.items, seen)
+    elif isinstance(avroType, titus.datatype.AvroRecord):
+        if avroType.fullName in seen:
+            return False
+        seen.add(avroType.fullName)
+        return any(_fastAvroNeedsCorrection(f.avroType, seen) for f in avroType.fields)
+    elif isinstance(avroType, titus.datatype.AvroUnion):
+        return any(_fastAvroNeedsCorrection(t, seen) for t in avroType.types)
+    else:
+        return False
 
-        elif isinstance(avroType, (titus.datatype.AvroBytes, titus.datatype.AvroFixed)) and isinstance(x, unicode):
-            return x.encode("utf-8", "replace")
+def _fastAvroCorrection(avroType, memo):
+    """Return a function that corrects a fastavro datum of ``avroType`` in place, or None if it never needs correcting."""
 
-        elif isinstance(avroType, titus.datatype.AvroArray):
-            itemType = avroType.items
-            for i in xrange(len(x)):
-                x[i] = self.correctFastAvro(x[i], itemType)
+    if isinstance(avroType, titus.datatype.AvroRecord) and avroType.fullName in memo:
+        return memo[avroType.fullName]
+    if not _fastAvroNeedsCorrection(avroType, set()):
+        return None
 
-        elif isinstance(avroType, titus.datatype.AvroMap):
-            valueType = avroType.values
-            out = {}
-            for key, value in x.items():
-                out[key.decode("utf-8", "replace")] = self.correctFastAvro(value, valueType)
-            return out
+    if isinstance(avroType, (titus.datatype.AvroString, titus.datatype.AvroEnum)):
+        def correct(x):
+            if isinstance(x, str):
+                return x.decode("utf-8", "replace")
+            return x
 
-        elif isinstance(avroType, titus.datatype.AvroRecord):
-            fields = avroType.fieldsDict
-            if fields.keys() != x.keys():
-                raise KeyError("datum {0} does not match record schema\n{1}".format(x, avroType))
-            for key in fields:
-                x[key] = self.correctFastAvro(x[key], fields[key].avroType)
+    elif isinstance(avroType, (titus.datatype.AvroBytes, titus.datatype.AvroFixed)):
+        def correct(x):
+            if isinstance(x, unicode):
+                return x.encode("utf-8", "replace")
             return x
 
-        elif isinstance(avroType, titus.datatype.AvroUnion):
-            for tpe in avroType.types:
-                if (isinstance(tpe, (titus.datatype.AvroString, titus.datatype.AvroEnum)) and isinstance(x, str)) or \
-                   (isinstance(tpe, (titus.datatype.AvroBytes, titus.datatype.AvroFixed)) and isinstance(x, unicode)) or \
-                   (isinstance(tpe, titus.datatype.AvroArray) and isinstance(x, (list, tuple))) or \
-                   (isinstance(tpe, titus.datatype.AvroMap) and isinstance(x, dict)):
-                    return self.correctFastAvro(x, tpe)
+    elif isinstance(avroType, titus.datatype.AvroArray):
+        items = _fastAvroCorrection(avroType.items, memo)
+        def correct(x):
+            for i in xrange(len(x)):
+                x[i] = items(x[i])
+            return x
 
-                elif (isinstance(tpe, (titus.datatype.AvroString, titus.datatype.AvroEnum)) and isinstance(x, unicode)) or \
-                     (isinstance(tpe, (titus.datatype.AvroBytes, titus.datatype.AvroFixed)) and isinstance(x, str)):
-                    return x
+    elif isinstance(avroType, titus.datatype.AvroMap):
+        values = _fastAvroCorrection(avroType.values, memo)
+        if values is None:
+            values = lambda x: x
+        def correct(x):
+            return dict((k.decode("utf-8", "replace") if isinstance(k, str) else k, values(v)) for k, v in x.iteritems())
+
+    elif isinstance(avroType, titus.datatype.AvroRecord):
+        fields = []
+        def correct(x):
+            for name, fieldCorrect in fields:
+                x[name] = fieldCorrect(x[name])
+            return x
+        memo[avroType.fullName] = correct
+        for f in avroType.fields:
+            fieldCorrect = _fastAvroCorrection(f.avroType, memo)
+            if fieldCorrect is not None:
+                fields.append((f.name, fieldCorrect))
+
+    elif isinstance(avroType, titus.datatype.AvroUnion):
+        byType = {}
+        records = {}
+        for t in avroType.types:
+            branch = _fastAvroCorrection(t, memo)
+            if isinstance(t, (titus.datatype.AvroString, titus.datatype.AvroEnum)):
+                byType.setdefault(str, branch)
+                byType.setdefault(unicode, None)
+            elif isinstance(t, (titus.datatype.AvroBytes, titus.datatype.AvroFixed)):
+                byType.setdefault(str, None)
+                byType.setdefault(unicode, branch)
+            elif isinstance(t, titus.datatype.AvroArray):
+                byType.setdefault(list, branch)
+                byType.setdefault(tuple, branch)
+            elif isinstance(t, titus.datatype.AvroMap):
+                byType.setdefault(dict, branch)
+            elif isinstance(t, titus.datatype.AvroRecord):
+                records.setdefault(frozenset(f.name for f in t.fields), branch)
+        mapCorrect = byType.pop(dict, None)
+        def correct(x):
+            if isinstance(x, dict):
+                branch = records.get(frozenset(x), mapCorrect) if records else mapCorrect
+            else:
+                branch = byType.get(type(x))
+            if branch is None:
+                return x
+            return branch(x)
 
-                elif isinstance(tpe, titus.datatype.AvroRecord) and isinstance(x, dict):
-                    try:
-                        return self.correctFastAvro(x, tpe)
-                    except KeyError:
-                        pass   # this is the wrong record type; one of the later record types applies
+    return correct
 
-        else:
-            return x
+snapshotEntry = titus.datatype.AvroRecord([titus.datatype.AvroField("name", titus.datatype.AvroString()),
+                                           titus.datatype.AvroField("pool", titus.datatype.AvroBoolean()),
+                                           titus.datatype.AvroField("key", titus.datatype.AvroString()),
+                                           titus.datatype.AvroField("value", titus.datatype.AvroBytes())], "SnapshotEntry")
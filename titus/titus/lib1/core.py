@@ -43,25 +43,47 @@ FLOAT_MAX_VALUE = 3.4028235e38
 DOUBLE_MIN_VALUE = 4.9e-324
 DOUBLE_MAX_VALUE = 1.7976931348623157e308
 
+def checkIntOverflow(out):
+    if out < INT_MIN_VALUE or out > INT_MAX_VALUE:
+        raise PFARuntimeException("int overflow")
+    else:
+        return out
+
+def checkLongOverflow(out):
+    if out < LONG_MIN_VALUE or out > LONG_MAX_VALUE:
+        raise PFARuntimeException("long overflow")
+    else:
+        return out
+
 def checkForOverflow(paramTypes, out):
     if paramTypes[0] == "int":
-        if out < INT_MIN_VALUE or out > INT_MAX_VALUE:
-            raise PFARuntimeException("int overflow")
-        else:
-            return out
+        return checkIntOverflow(out)
     elif paramTypes[0] == "long":
-        if out < LONG_MIN_VALUE or out > LONG_MAX_VALUE:
-            raise PFARuntimeException("long overflow")
-        else:
-            return out
+        return checkLongOverflow(out)
     else:
         return out
-    
+
+def genpyCheckForOverflow(paramTypes, expr):
+    if isinstance(paramTypes[0], AvroInt):
+        return "checkIntOverflow({0})".format(expr)
+    elif isinstance(paramTypes[0], AvroLong):
+        return "checkLongOverflow({0})".format(expr)
+    else:
+        return expr
+
+def divide(x, y):
+    try:
+        return x / float(y)
+    except ZeroDivisionError:
+        return float("nan")
+
 #################################################################### basic arithmetic
 
 class Plus(LibFcn):
     name = "+"
     sig = Sig([{"x": P.Wildcard("A", anyNumber)}, {"y" : P.Wildcard("A")}], P.Wildcard("A"))
+    def genpy(self, paramTypes, args):
+        return genpyCheckForOverflow(paramTypes, "(({0}) + ({1}))".format(*args))
     def __call__(self, state, scope, paramTypes, x, y):
         return checkForOverflow(paramTypes, x + y)
 provide(Plus())
@@ -69,6 +91,8 @@ provide(Plus())
 class Minus(LibFcn):
     name = "-"
     sig = Sig([{"x": P.Wildcard("A", anyNumber)}, {"y": P.Wildcard("A")}], P.Wildcard("A"))
+    def genpy(self, paramTypes, args):
+        return genpyCheckForOverflow(paramTypes, "(({0}) - ({1}))".format(*args))
     def __call__(self, state, scope, paramTypes, x, y):
         return checkForOverflow(paramTypes, x - y)
 provide(Minus())
@@ -76,6 +100,8 @@ provide(Minus())
 class Times(LibFcn):
     name = "*"
     sig = Sig([{"x": P.Wildcard("A", anyNumber)}, {"y": P.Wildcard("A")}], P.Wildcard("A"))
+    def genpy(self, paramTypes, args):
+        return genpyCheckForOverflow(paramTypes, "(({0}) * ({1}))".format(*args))
     def __call__(self, state, scope, paramTypes, x, y):
         return checkForOverflow(paramTypes, x * y)
 provide(Times())
@@ -83,18 +109,17 @@ provide(Times())
 class Divide(LibFcn):
     name = "/"
     sig = Sig([{"x": P.Double()}, {"y": P.Double()}], P.Double())
+    def genpy(self, paramTypes, args):
+        return "divide({0}, {1})".format(*args)
     def __call__(self, state, scope, paramTypes, x, y):
-        try:
-            return x / float(y)
-        except ZeroDivisionError:
-            return float("nan")
+        return divide(x, y)
 provide(Divide())
 
 class FloorDivide(LibFcn):
     name = "//"
     sig = Sig([{"x": P.Wildcard("A", set([AvroInt(), AvroLong()]))}, {"y": P.Wildcard("A")}], P.Wildcard("A"))
     def genpy(self, paramTypes, args):
-        return "({0} // {1})".format(*args)
+        return "(({0}) // ({1}))".format(*args)
     def __call__(self, state, scope, paramTypes, x, y):
         return x // y
 provide(FloorDivide())
@@ -102,6 +127,8 @@ provide(FloorDivide())
 class Negative(LibFcn):
     name = "u-"
     sig = Sig([{"x": P.Wildcard("A", anyNumber)}], P.Wildcard("A"))
+    def genpy(self, paramTypes, args):
+        return genpyCheckForOverflow(paramTypes, "(-({0}))".format(*args))
     def __call__(self, state, scope, paramTypes, x):
         return checkForOverflow(paramTypes, -x)
 provide(Negative())
@@ -110,7 +137,7 @@ class Modulo(LibFcn):
     name = "%"
     sig = Sig([{"k": P.Wildcard("A", anyNumber)}, {"n": P.Wildcard("A")}], P.Wildcard("A"))
     def genpy(self, paramTypes, args):
-        return "({0} % {1})".format(*args)
+        return "(({0}) % ({1}))".format(*args)
     def __call__(self, state, scope, paramTypes, x, y):
         return x % y
 provide(Modulo())
@@ -126,6 +153,8 @@ provide(Remainder())
 class Pow(LibFcn):
     name = "**"
     sig = Sig([{"x": P.Wildcard("A", anyNumber)}, {"y": P.Wildcard("A")}], P.Wildcard("A"))
+    def genpy(self, paramTypes, args):
+        return genpyCheckForOverflow(paramTypes, "(({0}) ** ({1}))".format(*args))
     def __call__(self, state, scope, paramTypes, x, y):
         return checkForOverflow(paramTypes, x**y)
 provide(Pow())
@@ -145,7 +174,7 @@ class Equal(LibFcn):
     name = "=="
     sig = Sig([{"x": P.Wildcard("A")}, {"y": P.Wildcard("A")}], P.Boolean())
     def genpy(self, paramTypes, args):
-        return "({0} == {1})".format(*args)
+        return "(({0}) == ({1}))".format(*args)
     def __call__(self, state, scope, paramTypes, x, y):
         return x == y
 provide(Equal())
@@ -154,7 +183,7 @@ class GreaterOrEqual(LibFcn):
     name = ">="
     sig = Sig([{"x": P.Wildcard("A")}, {"y": P.Wildcard("A")}], P.Boolean())
     def genpy(self, paramTypes, args):
-        return "({0} >= {1})".format(*args)
+        return "(({0}) >= ({1}))".format(*args)
     def __call__(self, state, scope, paramTypes, x, y):
         return x >= y
 provide(GreaterOrEqual())
@@ -163,7 +192,7 @@ class GreaterThan(LibFcn):
     name = ">"
     sig = Sig([{"x": P.Wildcard("A")}, {"y": P.Wildcard("A")}], P.Boolean())
     def genpy(self, paramTypes, args):
-        return "({0} > {1})".format(*args)
+        return "(({0}) > ({1}))".format(*args)
     def __call__(self, state, scope, paramTypes, x, y):
         return x > y
 provide(GreaterThan())
@@ -172,7 +201,7 @@ class NotEqual(LibFcn):
     name = "!="
     sig = Sig([{"x": P.Wildcard("A")}, {"y": P.Wildcard("A")}], P.Boolean())
     def genpy(self, paramTypes, args):
-        return "({0} != {1})".format(*args)
+        return "(({0}) != ({1}))".format(*args)
     def __call__(self, state, scope, paramTypes, x, y):
         return x != y
 provide(NotEqual())
@@ -181,7 +210,7 @@ class LessThan(LibFcn):
     name = "<"
     sig = Sig([{"x": P.Wildcard("A")}, {"y": P.Wildcard("A")}], P.Boolean())
     def genpy(self, paramTypes, args):
-        return "({0} < {1})".format(*args)
+        return "(({0}) < ({1}))".format(*args)
     def __call__(self, state, scope, paramTypes, x, y):
         return x < y
 provide(LessThan())
@@ -190,7 +219,7 @@ class LessOrEqual(LibFcn):
     name = "<="
     sig = Sig([{"x": P.Wildcard("A")}, {"y": P.Wildcard("A")}], P.Boolean())
     def genpy(self, paramTypes, args):
-        return "({0} <= {1})".format(*args)
+        return "(({0}) <= ({1}))".format(*args)
     def __call__(self, state, scope, paramTypes, x, y):
         return x <= y
 provide(LessOrEqual())
@@ -221,7 +250,7 @@ class LogicalAnd(LibFcn):
     name = "&&"
     sig = Sig([{"x": P.Boolean()}, {"y": P.Boolean()}], P.Boolean())
     def genpy(self, paramTypes, args):
-        return "({0} and {1})".format(*args)
+        return "(({0}) and ({1}))".format(*args)
     def __call__(self, state, scope, paramTypes, x, y):
         return x and y
 provide(LogicalAnd())
@@ -230,7 +259,7 @@ class LogicalOr(LibFcn):
     name = "||"
     sig = Sig([{"x": P.Boolean()}, {"y": P.Boolean()}], P.Boolean())
     def genpy(self, paramTypes, args):
-        return "({0} or {1})".format(*args)
+        return "(({0}) or ({1}))".format(*args)
     def __call__(self, state, scope, paramTypes, x, y):
         return x or y
 provide(LogicalOr())
@@ -238,6 +267,8 @@ provide(LogicalOr())
 class LogicalXOr(LibFcn):
     name = "^^"
     sig = Sig([{"x": P.Boolean()}, {"y": P.Boolean()}], P.Boolean())
+    def genpy(self, paramTypes, args):
+        return "(({0}) != ({1}))".format(*args)
     def __call__(self, state, scope, paramTypes, x, y):
         return (x or y) and not (x and y)
 provide(LogicalXOr())
@@ -246,7 +277,7 @@ class LogicalNot(LibFcn):
     name = "!"
     sig = Sig([{"x": P.Boolean()}], P.Boolean())
     def genpy(self, paramTypes, args):
-        return "(not {0})".format(*args)
+        return "(not ({0}))".format(*args)
     def __call__(self, state, scope, paramTypes, x):
         return not x
 provide(LogicalNot())
@@ -258,7 +289,7 @@ class BitwiseAnd(LibFcn):
     sig = Sigs([Sig([{"x": P.Int()}, {"y": P.Int()}], P.Int()),
                 Sig([{"x": P.Long()}, {"y": P.Long()}], P.Long())])
     def genpy(self, paramTypes, args):
-        return "({0} & {1})".format(*args)
+        return "(({0}) & ({1}))".format(*args)
     def __call__(self, state, scope, paramTypes, x, y):
         return x & y
 provide(BitwiseAnd())
@@ -269,7 +300,7 @@ class BitwiseOr(LibFcn):
                 Sig([{"x": P.Long()}, {"y": P.Long()}], P.Long())])
 
     def genpy(self, paramTypes, args):
-        return "({0} | {1})".format(*args)
+        return "(({0}) | ({1}))".format(*args)
     def __call__(self, state, scope, paramTypes, x, y):
         return x | y
 provide(BitwiseOr())
@@ -279,7 +310,7 @@ class BitwiseXOr(LibFcn):
     sig = Sigs([Sig([{"x": P.Int()}, {"y": P.Int()}], P.Int()),
                 Sig([{"x": P.Long()}, {"y": P.Long()}], P.Long())])
     def genpy(self, paramTypes, args):
-        return "({0} ^ {1})".format(*args)
+        return "(({0}) ^ ({1}))".format(*args)
     def __call__(self, state, scope, paramTypes, x, y):
         return x ^ y
 provide(BitwiseXOr())
@@ -289,7 +320,7 @@ class BitwiseNot(LibFcn):
     sig = Sigs([Sig([{"x": P.Int()}], P.Int()),
                 Sig([{"x": P.Long()}], P.Long())])
     def genpy(self, paramTypes, args):
-        return "(~{0})".format(*args)
+        return "(~({0}))".format(*args)
     def __call__(self, state, scope, paramTypes, x):
         return ~x
 provide(BitwiseNot())
@@ -27,6 +27,7 @@ from titus.signature import Sigs
 from titus.datatype import *
 from titus.errors import *
 from titus.lib1.core import checkForOverflow
+from titus.lib1.core import genpyCheckForOverflow
 import titus.P as P
 
 provides = {}
@@ -62,6 +63,8 @@ anyNumber = set([AvroInt(), AvroLong(), AvroFloat(), AvroDouble()])
 class Abs(LibFcn):
     name = prefix + "abs"
     sig = Sig([{"x": P.Wildcard("A", anyNumber)}], P.Wildcard("A"))
+    def genpy(self, paramTypes, args):
+        return genpyCheckForOverflow(paramTypes, "abs({0})".format(*args))
     def __call__(self, state, scope, paramTypes, x):
         return checkForOverflow(paramTypes, abs(x))
 provide(Abs())
@@ -116,6 +119,8 @@ provide(Ceil())
 class CopySign(LibFcn):
     name = prefix + "copysign"
     sig = Sig([{"mag": P.Wildcard("A", anyNumber)}, {"sign": P.Wildcard("A")}], P.Wildcard("A"))
+    def genpy(self, paramTypes, args):
+        return "(abs({0}) * (-1 if ({1}) < 0 else 1))".format(*args)
     def __call__(self, state, scope, paramTypes, mag, sign):
         return abs(mag) * (-1 if sign < 0 else 1)
 provide(CopySign())
@@ -168,6 +173,8 @@ provide(Floor())
 class Hypot(LibFcn):
     name = prefix + "hypot"
     sig = Sig([{"x": P.Double()}, {"y": P.Double()}], P.Double())
+    def genpy(self, paramTypes, args):
+        return "math.sqrt(({0})**2 + ({1})**2)".format(*args)
     def __call__(self, state, scope, paramTypes, x, y):
         return math.sqrt(x**2 + y**2)
 provide(Hypot())
@@ -226,6 +233,8 @@ class Round(LibFcn):
     name = prefix + "round"
     sig = Sigs([Sig([{"x": P.Float()}], P.Int()),
                 Sig([{"x": P.Double()}], P.Long())])
+    def genpy(self, paramTypes, args):
+        return "checkLongOverflow(long(math.floor(({0}) + 0.5)))".format(*args)
     def __call__(self, state, scope, paramTypes, x):
         return checkForOverflow(["long"], long(math.floor(x + 0.5)))
 provide(Round())
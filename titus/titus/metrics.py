@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+# 
+# This file is part of Hadrian.
+# 
+# Licensed under the Hadrian Personal Use and Evaluation License (PUEL);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://raw.githubusercontent.com/opendatagroup/hadrian/master/LICENSE
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import timeit
+
+from titus.pfaast import Method
+
+class LatencyHistogram(object):
+    bounds = [1e-6 * 2**i for i in xrange(27)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def snapshot(self):
+        return {"count": self.count,
+                "sum": self.sum,
+                "max": self.max,
+                "buckets": [[bound, count] for bound, count in zip(self.bounds + [float("inf")], self.counts) if count > 0]}
+
+class EngineMetrics(object):
+    routines = ["begin", "action", "actionBatch", "merge", "end"]
+
+    def __init__(self, engine, timer=timeit.default_timer):
+        self.engine = engine
+        self.timer = timer
+        self.latency = {}
+        self.exceptions = {}
+        self.emitted = 0
+        self.logged = 0
+
+    def install(self):
+        for routine in self.routines:
+            if hasattr(self.engine, routine) and not (routine == "actionBatch" and self.engine.config.method == Method.EMIT):
+                self.latency[routine] = LatencyHistogram()
+                setattr(self.engine, routine, self.timed(self.latency[routine], getattr(self.engine, routine)))
+        self.engine.log = self.engine.log
+        self.engine.emit = self.engine.emit
+
+    def timed(self, histogram, method):
+        def metered(*args, **kwds):
+            start = self.timer()
+            try:
+                return method(*args, **kwds)
+            except Exception as err:
+                self.exception(err)
+                raise
+            finally:
+                histogram.record(self.timer() - start)
+        return metered
+
+    def exception(self, err):
+        key = err.__class__.__name__
+        if getattr(err, "code", None) is not None:
+            key = "{0}/{1}".format(key, err.code)
+        self.exceptions[key] = self.exceptions.get(key, 0) + 1
+
+    def countLog(self, log):
+        if getattr(log, "metrics", None) is self:
+            return log
+        def counted(message, namespace):
+            self.logged += 1
+            return log(message, namespace)
+        counted.metrics = self
+        return counted
+
+    def countEmit(self, emit):
+        if getattr(emit, "metrics", None) is self:
+            return emit
+        def counted(x):
+            self.emitted += 1
+            return emit(x)
+        counted.metrics = self
+        return counted
+
+    def snapshot(self):
+        engine = self.engine
+        return {"actionsStarted": engine.actionsStarted,
+                "actionsFinished": engine.actionsFinished,
+                "latency": dict((k, v.snapshot()) for k, v in self.latency.items()),
+                "exceptions": dict(self.exceptions),
+                "cellUpdates": dict((k, getattr(v, "updates", 0)) for k, v in engine.cells.items()),
+                "poolUpdates": dict((k, getattr(v, "updates", 0)) for k, v in engine.pools.items()),
+                "poolSizes": dict((k, len(v.value)) for k, v in engine.pools.items()),
+                "emitted": self.emitted,
+                "logged": self.logged}
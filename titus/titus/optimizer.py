@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+# 
+# This file is part of Hadrian.
+# 
+# Licensed under the Hadrian Personal Use and Evaluation License (PUEL);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://raw.githubusercontent.com/opendatagroup/hadrian/master/LICENSE
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+
+import titus.util
+import titus.lib1.core
+import titus.lib1.pfamath
+import titus.lib1.pfastring
+from titus.datatype import *
+from titus.pfaast import EngineConfig
+from titus.pfaast import FcnDef
+from titus.pfaast import Call
+from titus.pfaast import LiteralValue
+from titus.pfaast import LiteralNull
+from titus.pfaast import LiteralBoolean
+from titus.pfaast import LiteralInt
+from titus.pfaast import LiteralLong
+from titus.pfaast import LiteralFloat
+from titus.pfaast import LiteralDouble
+from titus.pfaast import LiteralString
+from titus.pfaast import Do
+from titus.pfaast import Let
+from titus.pfaast import If
+from titus.pfaast import Cond
+from titus.pfaast import Doc
+from titus.pfaast import Error
+from titus.pfaast import Method
+from titus.pfaast import Ref
+from titus.pfaast import SetVar
+from titus.pfaast import AttrGet
+from titus.pfaast import CellGet
+from titus.pfaast import CellTo
+from titus.pfaast import FcnRef
+from titus.pfaast import FcnRefFill
+from titus.pfaast import CallUserFcn
+from titus.pfaast import For
+from titus.pfaast import Foreach
+from titus.pfaast import Forkeyval
+from titus.pfaast import IfNotNull
+from titus.pfaast import CastCase
+
+class ChildrenOnly(object):
+    def __init__(self, optimizer, parent):
+        self.optimizer = optimizer
+        self.parent = parent
+        self.changed = False
+    def isDefinedAt(self, ast):
+        return ast is not self.parent
+    def __call__(self, ast):
+        out = ast.replace(self.optimizer)
+        if out is not ast:
+            self.changed = True
+        return out
+
+def same(one, two):
+    if one is None or two is None:
+        return one is two
+    else:
+        return len(one) == len(two) and all(x is y for x, y in zip(one, two))
+
+pureFunctions = {}
+pureFunctions.update(titus.lib1.core.provides)
+pureFunctions.update(titus.lib1.pfamath.provides)
+pureFunctions.update(titus.lib1.pfastring.provides)
+
+class Optimizer(object):
+    literalTypes = {LiteralNull: AvroNull(),
+                    LiteralBoolean: AvroBoolean(),
+                    LiteralInt: AvroInt(),
+                    LiteralLong: AvroLong(),
+                    LiteralFloat: AvroFloat(),
+                    LiteralDouble: AvroDouble(),
+                    LiteralString: AvroString()}
+
+    def __init__(self):
+        self.narrowed = False   # set when dropping a branch may give an if or cond a narrower type than it had
+
+    def isDefinedAt(self, ast):
+        return True
+
+    def __call__(self, ast):
+        if isinstance(ast, EngineConfig):
+            begin = self.body(ast.begin)
+            action = self.body(ast.action)
+            end = self.body(ast.end)
+            fcns = dict((k, v.replace(self)) for k, v in ast.fcns.items())
+            merge = self.body(ast.merge) if ast.merge is not None else None
+            if same(begin, ast.begin) and same(action, ast.action) and same(end, ast.end) and same(merge, ast.merge) and all(fcns[k] is v for k, v in ast.fcns.items()):
+                return ast
+            return EngineConfig(ast.name,
+                                ast.method,
+                                ast.inputPlaceholder,
+                                ast.outputPlaceholder,
+                                begin,
+                                action,
+                                end,
+                                fcns,
+                                ast.zero,
+                                merge,
+                                ast.cells,
+                                ast.pools,
+                                ast.randseed,
+                                ast.doc,
+                                ast.version,
+                                ast.metadata,
+                                ast.options,
+                                ast.pos)
+
+        elif isinstance(ast, FcnDef):
+            body = self.body(ast.body)
+            if same(body, ast.body):
+                return ast
+            return FcnDef(ast.paramsPlaceholder, ast.retPlaceholder, body, ast.pos)
+
+        elif isinstance(ast, Do):
+            body = self.body(ast.body)
+            if same(body, ast.body) and not (len(body) == 1 and self.unwrappable(body[0])):
+                return ast
+            return self.block(body, ast.pos)
+
+        elif isinstance(ast, If):
+            predicate = ast.predicate.replace(self)
+            thenClause = self.body(ast.thenClause)
+            elseClause = self.body(ast.elseClause) if ast.elseClause is not None else None
+            if isinstance(predicate, LiteralBoolean) and predicate.value:
+                if elseClause is None:
+                    return Do(thenClause + [LiteralNull(ast.pos)], ast.pos)
+                else:
+                    self.narrowed = True
+                    return self.block(thenClause, ast.pos)
+            elif isinstance(predicate, LiteralBoolean):
+                if elseClause is None:
+                    return LiteralNull(ast.pos)
+                else:
+                    self.narrowed = True
+                    return self.block(elseClause, ast.pos)
+            elif predicate is ast.predicate and same(thenClause, ast.thenClause) and same(elseClause, ast.elseClause):
+                return ast
+            else:
+                return If(predicate, thenClause, elseClause, ast.pos)
+
+        elif isinstance(ast, Cond):
+            ifthens = []
+            elseClause = self.body(ast.elseClause) if ast.elseClause is not None else None
+            for ifthen in ast.ifthens:
+                predicate = ifthen.predicate.replace(self)
+                thenClause = self.body(ifthen.thenClause)
+                if isinstance(predicate, LiteralBoolean) and not predicate.value:
+                    self.narrowed = self.narrowed or elseClause is not None
+                    continue
+                elif isinstance(predicate, LiteralBoolean) and elseClause is not None:
+                    self.narrowed = True
+                    elseClause = thenClause
+                    break
+                elif predicate is ifthen.predicate and same(thenClause, ifthen.thenClause):
+                    ifthens.append(ifthen)
+                else:
+                    ifthens.append(If(predicate, thenClause, None, ifthen.pos))
+                if isinstance(predicate, LiteralBoolean):
+                    break
+            if len(ifthens) == 0 and elseClause is not None:
+                return self.block(elseClause, ast.pos)
+            elif len(ifthens) == 0:
+                return LiteralNull(ast.pos)
+            elif same(ifthens, ast.ifthens) and same(elseClause, ast.elseClause):
+                return ast
+            else:
+                return Cond(ifthens, elseClause, ast.pos)
+
+        else:
+            children = ChildrenOnly(self, ast)
+            out = ast.replace(children)
+            if isinstance(out, Call) and out.name in pureFunctions and all(type(x) in self.literalTypes for x in out.args):
+                out = self.fold(out)
+            if out is not ast and not children.changed and not isinstance(out, LiteralValue):
+                return ast
+            return out
+
+    def body(self, exprs):
+        flattened = []
+        for i, x in enumerate(exprs):
+            x = x.replace(self)
+            if i < len(exprs) - 1 and isinstance(x, Do) and not any(isinstance(y, Let) for y in x.body):
+                flattened.extend(x.body)
+            else:
+                flattened.append(x)
+        return [x for i, x in enumerate(flattened) if i == len(flattened) - 1 or not isinstance(x, Doc)]
+
+    def unwrappable(self, expr):
+        return not isinstance(expr, (Let, Error))
+
+    def block(self, exprs, pos):
+        if len(exprs) == 1 and self.unwrappable(exprs[0]):
+            return exprs[0]
+        else:
+            return Do(exprs, pos)
+
+    def fold(self, call):
+        fcn = pureFunctions[call.name]
+        sigres = fcn.sig.accepts([self.literalTypes[type(x)] for x in call.args])
+        if sigres is None:
+            return call
+        paramTypes, retType = sigres
+
+        try:
+            value = fcn(None, None, [x.jsonNode(set()) for x in paramTypes + [retType]], *[None if isinstance(x, LiteralNull) else x.value for x in call.args])
+        except Exception:
+            return call
+
+        if isinstance(retType, AvroNull) and value is None:
+            return LiteralNull(call.pos)
+        elif isinstance(retType, AvroBoolean) and isinstance(value, bool):
+            return LiteralBoolean(value, call.pos)
+        elif isinstance(retType, AvroInt) and isinstance(value, (int, long)) and not isinstance(value, bool):
+            return LiteralInt(value, call.pos)
+        elif isinstance(retType, AvroLong) and isinstance(value, (int, long)) and not isinstance(value, bool):
+            return LiteralLong(value, call.pos)
+        elif isinstance(retType, AvroFloat) and isinstance(value, float) and not math.isnan(value) and not math.isinf(value):
+            return LiteralFloat(value, call.pos)
+        elif isinstance(retType, AvroDouble) and isinstance(value, float) and not math.isnan(value) and not math.isinf(value):
+            return LiteralDouble(value, call.pos)
+        elif isinstance(retType, AvroString) and isinstance(value, basestring):
+            return LiteralString(value, call.pos)
+        else:
+            return call
+
+class Declared(object):
+    def isDefinedAt(self, ast):
+        return isinstance(ast, (Ref, Let, SetVar, FcnDef, For, Foreach, Forkeyval, IfNotNull, CastCase))
+    def __call__(self, ast):
+        if isinstance(ast, Ref):
+            return [ast.name]
+        elif isinstance(ast, (Let, SetVar)):
+            return ast.values.keys()
+        elif isinstance(ast, FcnDef):
+            return ast.paramNames
+        elif isinstance(ast, For):
+            return ast.init.keys()
+        elif isinstance(ast, Foreach):
+            return [ast.name]
+        elif isinstance(ast, Forkeyval):
+            return [ast.forkey, ast.forval]
+        elif isinstance(ast, IfNotNull):
+            return ast.exprs.keys()
+        else:
+            return [ast.named]
+
+class Assigned(object):
+    def isDefinedAt(self, ast):
+        return isinstance(ast, SetVar)
+    def __call__(self, ast):
+        return ast.values.keys()
+
+class BodyPaths(object):
+    def __init__(self, commonPaths, symbols, names):
+        self.commonPaths = commonPaths
+        self.symbols = symbols
+        self.names = names
+        self.counts = {}
+        self.first = {}
+
+    def isDefinedAt(self, ast):
+        return True
+
+    def __call__(self, ast):
+        if isinstance(ast, FcnDef):
+            if self.names is None:
+                return ast
+            return self.commonPaths(ast)
+
+        key = self.commonPaths.key(ast, self.symbols)
+        if key is not None and self.names is None:
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.first.setdefault(key, ast)
+            return ast
+        elif key is not None and key in self.names:
+            return Ref(self.names[key], ast.pos)
+
+        children = ChildrenOnly(self, ast)
+        out = ast.replace(children)
+        if not children.changed:
+            return ast
+        return out
+
+class CommonPaths(object):
+    def __init__(self, engineConfig):
+        self.engineConfig = engineConfig
+        self.taken = set(titus.util.flatten(engineConfig.collect(Declared()) + titus.util.flatten(x.collect(Declared()) for x in engineConfig.merge or [])))
+        self.number = 0
+
+        direct = dict((k, self.effects(v.body)) for k, v in engineConfig.fcns.items())
+        self.modifies = dict((k, set(cells)) for k, (cells, fcns) in direct.items())
+        changed = True
+        while changed:
+            changed = False
+            for k, (cells, fcns) in direct.items():
+                for f in fcns:
+                    if not self.modifies.get(f, set()).issubset(self.modifies[k]):
+                        self.modifies[k].update(self.modifies[f])
+                        changed = True
+
+    def effects(self, exprs):
+        class Effect(object):
+            def isDefinedAt(self, ast):
+                return isinstance(ast, (CellTo, Call, FcnRef, FcnRefFill, CallUserFcn))
+            def __call__(self, ast):
+                return ast
+        cells, fcns = set(), set()
+        for x in titus.util.flatten(x.collect(Effect()) for x in exprs):
+            if isinstance(x, CellTo):
+                cells.add(x.cell)
+            elif isinstance(x, CallUserFcn):
+                fcns.update(self.engineConfig.fcns.keys())
+            elif x.name.startswith("u."):
+                fcns.add(x.name[2:])
+        return cells, fcns
+
+    def isDefinedAt(self, ast):
+        return isinstance(ast, (EngineConfig, FcnDef))
+
+    def __call__(self, ast):
+        if isinstance(ast, EngineConfig):
+            if ast.method == Method.FOLD:
+                tally = {"tally": ast.output}
+            else:
+                tally = {}
+            begin = self.body(ast.begin, {})
+            action = self.body(ast.action, dict([("input", ast.input)] + tally.items()))
+            end = self.body(ast.end, tally)
+            fcns = dict((k, self(v)) for k, v in ast.fcns.items())
+            merge = self.body(ast.merge, {"tallyOne": ast.output, "tallyTwo": ast.output}) if ast.merge is not None else None
+            if same(begin, ast.begin) and same(action, ast.action) and same(end, ast.end) and same(merge, ast.merge) and all(fcns[k] is v for k, v in ast.fcns.items()):
+                return ast
+            return EngineConfig(ast.name,
+                                ast.method,
+                                ast.inputPlaceholder,
+                                ast.outputPlaceholder,
+                                begin,
+                                action,
+                                end,
+                                fcns,
+                                ast.zero,
+                                merge,
+                                ast.cells,
+                                ast.pools,
+                                ast.randseed,
+                                ast.doc,
+                                ast.version,
+                                ast.metadata,
+                                ast.options,
+                                ast.pos)
+
+        else:
+            body = self.body(ast.body, ast.params)
+            if same(body, ast.body):
+                return ast
+            return FcnDef(ast.paramsPlaceholder, ast.retPlaceholder, body, ast.pos)
+
+    def key(self, ast, symbols):
+        if isinstance(ast, AttrGet) and isinstance(ast.expr, Ref) and ast.expr.name in symbols:
+            kind, name, avroType = "attr", ast.expr.name, symbols[ast.expr.name]
+        elif isinstance(ast, CellGet) and ast.cell in self.engineConfig.cells and not self.engineConfig.cells[ast.cell].shared:
+            kind, name, avroType = "cell", ast.cell, self.engineConfig.cells[ast.cell].avroType
+        else:
+            return None
+
+        fields = []
+        for x in ast.path:
+            if not isinstance(x, LiteralString) or not isinstance(avroType, AvroRecord) or x.value not in avroType.fieldsDict:
+                return None
+            fields.append(x.value)
+            avroType = avroType.field(x.value).avroType
+        return kind, name, tuple(fields)
+
+    def newName(self):
+        while True:
+            name = "_path" + str(self.number)
+            self.number += 1
+            if name not in self.taken:
+                return name
+
+    def body(self, exprs, symbols):
+        counter = BodyPaths(self, symbols, None)
+        for x in exprs:
+            x.replace(counter)
+
+        cells, fcns = self.effects(exprs)
+        for f in fcns:
+            cells = cells.union(self.modifies.get(f, set()))
+        assigned = set(titus.util.flatten(titus.util.flatten(x.collect(Assigned()) for x in exprs)))
+
+        names = {}
+        for key in sorted(counter.counts):
+            kind, name, fields = key
+            if counter.counts[key] > 1 and not (kind == "attr" and name in assigned) and not (kind == "cell" and name in cells):
+                names[key] = self.newName()
+
+        out = [x.replace(BodyPaths(self, symbols, names)) for x in exprs]
+        if len(names) > 0:
+            out.insert(0, Let(dict((v, counter.first[k]) for k, v in names.items()), exprs[0].pos))
+        return out
+
+def optimize(engineConfig, optimizer=None):
+    if optimizer is None:
+        optimizer = Optimizer()
+    out = engineConfig.replace(optimizer)
+    return out.replace(CommonPaths(out))
@@ -18,16 +18,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import re
+
 from titus.errors import PFAInitializationException
 
 class EngineOptions(object):
-    recognizedKeys = set(["@", "timeout", "timeout.begin", "timeout.action", "timeout.end", "data.PFARecord.interface"])
+    recognizedKeys = set(["@", "timeout", "timeout.begin", "timeout.action", "timeout.end", "data.PFARecord.interface", "data.checkEvery"])
+    poolKey = re.compile(r"^pool\.([^.]+)\.(storage|cacheSize|directory)$")
 
     def __init__(self, requestedOptions, hostOptions):
         combinedOptions = {} if requestedOptions is None else dict(requestedOptions)
         if hostOptions is not None:
             combinedOptions.update(hostOptions)
-        unrecognizedKeys = set(combinedOptions.keys()) - self.recognizedKeys
+        unrecognizedKeys = set(x for x in combinedOptions.keys() if self.poolKey.match(x) is None) - self.recognizedKeys
 
         if len(unrecognizedKeys) > 0:
             raise PFAInitializationException("unrecognized options: " + " ".join(sorted(unrecognizedKeys)))
@@ -40,8 +43,22 @@ class EngineOptions(object):
                 raise PFAInitializationException(name + " must be an integral number")
 
         self.timeout = longOpt("timeout", -1)
-        self.timeout_begin = longOpt("timeout", self.timeout)
-        self.timeout_action = longOpt("timeout", self.timeout)
-        self.timeout_end = longOpt("timeout", self.timeout)
+        self.timeout_begin = longOpt("timeout.begin", self.timeout)
+        self.timeout_action = longOpt("timeout.action", self.timeout)
+        self.timeout_end = longOpt("timeout.end", self.timeout)
+
+        self.data_checkEvery = longOpt("data.checkEvery", 1)
+        if self.data_checkEvery < 1:
+            raise PFAInitializationException("data.checkEvery must be at least 1")
+
+        self.poolStorage = {}
+        for poolName in set(self.poolKey.match(x).group(1) for x in combinedOptions if self.poolKey.match(x) is not None):
+            storage = combinedOptions.get("pool." + poolName + ".storage", "memory")
+            if storage not in ("memory", "disk"):
+                raise PFAInitializationException("pool.{0}.storage must be \"memory\" or \"disk\"".format(poolName))
+            cacheSize = longOpt("pool." + poolName + ".cacheSize", 10000)
+            if cacheSize <= 0:
+                raise PFAInitializationException("pool.{0}.cacheSize must be positive".format(poolName))
+            self.poolStorage[poolName] = {"storage": storage, "cacheSize": cacheSize, "directory": combinedOptions.get("pool." + poolName + ".directory")}
 
         # ...
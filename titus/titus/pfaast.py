@@ -203,6 +203,8 @@ class UserFcn(Fcn):
         return UserFcn(n, Sig([{k: P.fromType(fcnDef.params[k])} for k in fcnDef.paramNames], P.fromType(fcnDef.ret)))
 
 class EmitFcn(Fcn):
+    name = "emit"
+
     def __init__(self, outputType):
         self.sig = Sig([{"output": P.fromType(outputType)}], P.Null())
 
@@ -1071,7 +1073,7 @@ class Call(Expression):
             #     if isinstance(a, FcnRef):
             #         argTaskResults[i] = task(argContexts[i], engineOptions, paramTypes[i])
 
-            context = self.Context(retType, calls, fcn, argTaskResults, argContexts, paramTypes)
+            context = self.Context(retType, calls, fcn, argTaskResults, argContexts, paramTypes, self.pos)
 
         else:
             raise PFASemanticException("parameters of function \"{0}\" do not accept [{1}]".format(self.name, ",".join(map(ts, argTypes))), self.pos)
@@ -1085,7 +1087,7 @@ class Call(Expression):
 
     @titus.util.case
     class Context(ExpressionContext):
-        def __init__(self, retType, calls, fcn, args, argContexts, paramTypes): pass
+        def __init__(self, retType, calls, fcn, args, argContexts, paramTypes, pos=None): pass
 
 @titus.util.case
 class Ref(Expression):
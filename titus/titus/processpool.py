@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+# 
+# This file is part of Hadrian.
+# 
+# Licensed under the Hadrian Personal Use and Evaluation License (PUEL);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://raw.githubusercontent.com/opendatagroup/hadrian/master/LICENSE
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import cPickle as pickle
+import json
+import multiprocessing
+import Queue
+import time
+
+import titus.datatype
+import titus.genpy
+import titus.options
+import titus.reader
+from titus.errors import PFAInitializationException
+from titus.genpy import PFAEngine
+from titus.pfaast import Method
+
+class SharedCell(object):
+    def __init__(self, name, store, lock):
+        self.name = name
+        self.store = store
+        self.lock = lock
+        self.version = multiprocessing.RawValue("l", 0)
+        self.shared = True
+        self.rollback = False
+        self.cachedVersion = -1
+        self.cachedValue = None
+
+    def __repr__(self):
+        return "SharedCell(" + repr(self.name) + ")"
+
+    @property
+    def value(self):
+        if self.version.value != self.cachedVersion:
+            with self.lock:
+                self.cachedValue = self.store[self.name]
+                self.cachedVersion = self.version.value
+        return self.cachedValue
+
+    def get(self, path):
+        return titus.genpy.get(self.value, path)
+
+    def track(self):
+        raise PFAInitializationException("shared cell \"{0}\" is held by a ProcessPool and cannot be tracked for checkpoints".format(self.name))
+
+    def update(self, state, scope, path, to, expose=True, optimistic=False):
+        if optimistic:
+            while True:
+                version = self.version.value
+                result = titus.genpy.update(state, scope, self.value, path, to)
+                with self.lock:
+                    if self.version.value == version:
+                        self.commit(result)
+                        break
+        else:
+            with self.lock:
+                result = titus.genpy.update(state, scope, self.store[self.name], path, to)
+                self.commit(result)
+        return result
+
+    def commit(self, result):
+        self.store[self.name] = result
+        self.version.value += 1
+        self.cachedValue = result
+        self.cachedVersion = self.version.value
+
+class SharedPoolValue(object):
+    def __init__(self, pool):
+        self.pool = pool
+        self.cachedVersion = -1
+        self.cache = {}
+
+    def __getitem__(self, key):
+        if self.pool.version.value != self.cachedVersion:
+            self.cache = {}
+            self.cachedVersion = self.pool.version.value
+        if key not in self.cache:
+            self.cache[key] = self.pool.store[key]
+        return self.cache[key]
+
+    def __contains__(self, key):
+        return key in self.pool.store
+
+    def __len__(self):
+        return len(self.pool.store)
+
+    def __iter__(self):
+        return iter(self.pool.store.keys())
+
+    def keys(self):
+        return self.pool.store.keys()
+
+    def items(self):
+        return self.pool.store.items()
+
+class SharedPool(object):
+    def __init__(self, name, store, lock):
+        self.name = name
+        self.store = store
+        self.lock = lock
+        self.version = multiprocessing.RawValue("l", 0)
+        self.shared = True
+        self.rollback = False
+        self.value = SharedPoolValue(self)
+
+    def __repr__(self):
+        return "SharedPool(" + repr(self.name) + ")"
+
+    def get(self, path):
+        return titus.genpy.get(self.value, path)
+
+    def track(self):
+        raise PFAInitializationException("shared pool \"{0}\" is held by a ProcessPool and cannot be tracked for checkpoints".format(self.name))
+
+    def update(self, state, scope, path, to, init, expose=True, optimistic=False):
+        head, tail = path[0], path[1:]
+        if optimistic:
+            while True:
+                version = self.version.value
+                result = titus.genpy.update(state, scope, self.store.get(head, init), tail, to)
+                with self.lock:
+                    if self.version.value == version:
+                        self.store[head] = result
+                        self.version.value += 1
+                        break
+        else:
+            with self.lock:
+                result = titus.genpy.update(state, scope, self.store.get(head, init), tail, to)
+                self.store[head] = result
+                self.version.value += 1
+        return result
+
+def send(results, index, value, err):
+    # multiprocessing pickles in a background thread, where a failure would be lost, so pickle here and send the failure instead
+    try:
+        data = pickle.dumps((value, err), pickle.HIGHEST_PROTOCOL)
+    except Exception as failure:
+        problem = "result" if err is None else "exception " + repr(err)
+        data = pickle.dumps((None, pickle.PicklingError("worker process could not send its {0}: {1}".format(problem, failure))), pickle.HIGHEST_PROTOCOL)
+    results.put((index, data))
+
+def worker(engine, handler, tasks, results):
+    try:
+        if hasattr(engine, "begin"):
+            engine.begin()
+    except Exception as err:
+        send(results, None, None, err)
+        return
+    send(results, None, None, None)
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        index, payload = task
+        try:
+            value = handler(engine, payload)
+        except Exception as err:
+            send(results, index, None, err)
+        else:
+            send(results, index, value, None)
+
+    try:
+        if hasattr(engine, "end"):
+            engine.end()
+    except Exception as err:
+        send(results, None, None, err)
+    else:
+        send(results, None, None, None)
+
+def chunks(inputs, chunksize):
+    chunk = []
+    for input in inputs:
+        chunk.append(input)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+class ProcessPool(object):
+    pollSeconds = 1.0
+
+    def __init__(self, engineConfig, processes, options, style, optimize, handler):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        self.manager = multiprocessing.Manager()
+        sharedState = titus.genpy.SharedState()
+
+        cellStore = self.manager.dict()
+        for cellName, cellConfig in engineConfig.cells.items():
+            if cellConfig.shared:
+                cellStore[cellName] = titus.datatype.compileJsonDecoder(cellConfig.avroType)(json.loads(cellConfig.init))
+                sharedState.cells[cellName] = SharedCell(cellName, cellStore, multiprocessing.Lock())
+
+        for poolName, poolConfig in engineConfig.pools.items():
+            if poolConfig.shared:
+                poolStore = self.manager.dict()
+                decode = titus.datatype.compileJsonDecoder(poolConfig.avroType)
+                for k, v in poolConfig.init.items():
+                    poolStore[k] = decode(json.loads(v))
+                sharedState.pools[poolName] = SharedPool(poolName, poolStore, multiprocessing.Lock())
+
+        self.engines = PFAEngine.fromAst(engineConfig, options, sharedState, processes, style, False, optimize)
+        self.sharedState = sharedState
+
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.processes = [multiprocessing.Process(target=worker, args=(engine, handler, self.tasks, self.results)) for engine in self.engines]
+        for process in self.processes:
+            process.daemon = True
+            process.start()
+
+        for engine in self.engines:
+            engine.processPool = self
+
+        self.broken = None
+        self.started = 0
+        try:
+            errors = [self.receive(False)[2] for process in self.processes]
+        except Exception:
+            self.terminate()
+            raise
+        self.started = len([x for x in errors if x is None])
+        errors = [x for x in errors if x is not None]
+        if len(errors) > 0:
+            try:
+                self.close()
+            except Exception:
+                pass
+            raise errors[0]
+
+    def receive(self, running):
+        while True:
+            try:
+                index, data = self.results.get(True, self.pollSeconds)
+            except Queue.Empty:
+                exited = [x for x in self.processes if not x.is_alive()]
+                if running or len(exited) == len(self.processes):
+                    failed = exited
+                else:
+                    failed = [x for x in exited if x.exitcode != 0]
+                if len(failed) > 0:
+                    self.broken = RuntimeError("worker process {0} (pid {1}) exited with code {2} before returning its results".format(failed[0].name, failed[0].pid, failed[0].exitcode))
+                    raise self.broken
+            else:
+                try:
+                    value, err = pickle.loads(data)
+                except Exception as failure:
+                    value, err = None, failure
+                return index, value, err
+
+    def run(self, payloads):
+        if self.broken is not None:
+            raise self.broken
+        payloads = iter(payloads)
+        maxPending = 2 * len(self.processes)
+        pending = {}
+        sent = 0
+        received = 0
+        exhausted = False
+
+        try:
+            while True:
+                while not exhausted and sent - received < maxPending:
+                    try:
+                        payload = payloads.next()
+                    except StopIteration:
+                        exhausted = True
+                    else:
+                        self.tasks.put((sent, payload))
+                        sent += 1
+
+                if received == sent:
+                    break
+
+                while received not in pending:
+                    index, value, err = self.receive(True)
+                    pending[index] = (value, err)
+                value, err = pending.pop(received)
+                received += 1
+
+                if err is not None:
+                    raise err
+                yield value
+
+        finally:
+            if self.broken is None:
+                for index in xrange(sent - received - len(pending)):
+                    self.receive(True)
+
+    def terminate(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        self.manager.shutdown()
+
+    def close(self):
+        if self.broken is not None:
+            self.terminate()
+            return
+
+        for process in self.processes:
+            self.tasks.put(None)
+
+        errors = []
+        ended = 0
+        try:
+            while ended < self.started:
+                index, value, err = self.receive(False)
+                if index is None:
+                    ended += 1
+                    if err is not None:
+                        errors.append(err)
+        except Exception:
+            self.terminate()
+            raise
+
+        for process in self.processes:
+            process.join()
+        self.manager.shutdown()
+
+        if len(errors) > 0:
+            raise errors[0]
+
+def scoreChunk(engine, inputs):
+    if engine.config.method == Method.EMIT:
+        outputs = []
+        for input in inputs:
+            emitted = []
+            engine.emit = emitted.append
+            engine.action(input)
+            outputs.append(emitted)
+        return outputs
+    else:
+        return engine.actionBatch(inputs)
+
+class ProcessPoolScorer(ProcessPool):
+    def __init__(self, engineConfig, processes=None, options=None, style="pure", optimize=True):
+        super(ProcessPoolScorer, self).__init__(engineConfig, processes, options, style, optimize, scoreChunk)
+
+    @staticmethod
+    def fromJson(src, processes=None, options=None, style="pure", optimize=True):
+        return ProcessPoolScorer(titus.reader.jsonToAst(src), processes, options, style, optimize)
+
+    @staticmethod
+    def fromYaml(src, processes=None, options=None, style="pure", optimize=True):
+        return ProcessPoolScorer(titus.reader.yamlToAst(src), processes, options, style, optimize)
+
+    def imap(self, inputs, chunksize=100):
+        for outputs in self.run(chunks(inputs, chunksize)):
+            for output in outputs:
+                yield output
+
+    def map(self, inputs, chunksize=100):
+        return list(self.imap(inputs, chunksize))
+
+class FoldPartition(object):
+    def __init__(self, zero, reader):
+        self.zero = zero
+        self.reader = reader
+
+    def __call__(self, engine, payload):
+        kind, data = payload
+        if kind == "merge":
+            return engine.merge(*data)
+
+        if self.reader is None:
+            records = data
+        else:
+            records = self.reader(engine, data)
+
+        startTime = time.time()
+        engine.tally = self.zero
+        count = 0
+        for record in records:
+            engine.action(record)
+            count += 1
+        return engine.tally, {"records": count, "seconds": time.time() - startTime, "instance": engine.instance}
+
+class ParallelFold(ProcessPool):
+    def __init__(self, engineConfig, processes=None, options=None, style="pure", optimize=True, reader=None):
+        if engineConfig.method != Method.FOLD:
+            raise PFAInitializationException("parallel fold requires a fold-type engine")
+        self.zero = titus.datatype.compileJsonDecoder(engineConfig.output)(json.loads(engineConfig.zero))
+        self.tally = self.zero
+        self.partitionStats = []
+        super(ParallelFold, self).__init__(engineConfig, processes, options, style, optimize, FoldPartition(self.zero, reader))
+        self.reader = reader
+
+    @staticmethod
+    def fromJson(src, processes=None, options=None, style="pure", optimize=True, reader=None):
+        return ParallelFold(titus.reader.jsonToAst(src), processes, options, style, optimize, reader)
+
+    @staticmethod
+    def fromYaml(src, processes=None, options=None, style="pure", optimize=True, reader=None):
+        return ParallelFold(titus.reader.yamlToAst(src), processes, options, style, optimize, reader)
+
+    def fold(self, partitions):
+        if self.reader is None:
+            partitions = (x if isinstance(x, list) else list(x) for x in partitions)
+
+        tallies = []
+        self.partitionStats = []
+        for tally, stats in self.run(("partition", x) for x in partitions):
+            tallies.append(tally)
+            self.partitionStats.append(stats)
+
+        while len(tallies) > 1:
+            merged = list(self.run(("merge", (tallies[i], tallies[i + 1])) for i in xrange(0, len(tallies) - 1, 2)))
+            if len(tallies) % 2 == 1:
+                merged.append(tallies[-1])
+            tallies = merged
+
+        if len(tallies) == 0:
+            self.tally = self.zero
+        else:
+            self.tally = tallies[0]
+        return self.tally
+
+    def foldStream(self, inputs, partitionSize=10000):
+        if self.reader is not None:
+            raise ValueError("foldStream partitions records itself and cannot be used with a reader")
+        return self.fold(chunks(inputs, partitionSize))
@@ -19,12 +19,19 @@
 # limitations under the License.
 
 import math
+import threading
 
 import numpy
 
 from titus.pfaast import Ast
+from titus.pfaast import Method
 from titus.pfaast import Call
 from titus.pfaast import Ref
+from titus.pfaast import Do
+from titus.pfaast import Let
+from titus.pfaast import AttrGet
+from titus.pfaast import If
+from titus.pfaast import Cond
 from titus.pfaast import LiteralNull
 from titus.pfaast import LiteralBoolean
 from titus.pfaast import LiteralInt
@@ -35,9 +42,100 @@ from titus.pfaast import LiteralString
 from titus.datatype import AvroArray
 from titus.datatype import AvroMap
 from titus.datatype import AvroRecord
+from titus.datatype import AvroBoolean
+from titus.datatype import AvroInt
+from titus.datatype import AvroLong
+from titus.datatype import AvroFloat
+from titus.datatype import AvroDouble
+from titus.errors import PFARuntimeException
+from titus.lib1.core import INT_MIN_VALUE, INT_MAX_VALUE, LONG_MIN_VALUE, LONG_MAX_VALUE
 from titus.prettypfa import ppfa
 from titus.prettypfa import pfa
 
+########################### column-wise versions of the PFA functions whose semantics differ from the plain Numpy ufuncs
+
+integerBounds = {"int": (INT_MIN_VALUE, INT_MAX_VALUE), "long": (LONG_MIN_VALUE, LONG_MAX_VALUE)}
+
+activeRows = threading.local()
+
+def pfaFails(bad):
+    # only rows that reach this expression (see pfaWhere) can raise an error
+    mask = getattr(activeRows, "mask", None)
+    if mask is None:
+        return numpy.any(bad)
+    else:
+        return numpy.any(numpy.logical_and(bad, mask))
+
+def pfaWhere(predicate, thenClause, elseClause):
+    predicate = numpy.asarray(predicate, dtype=bool)
+    outer = getattr(activeRows, "mask", None)
+    try:
+        activeRows.mask = predicate if outer is None else numpy.logical_and(outer, predicate)
+        thenValue = thenClause()
+        activeRows.mask = ~predicate if outer is None else numpy.logical_and(outer, ~predicate)
+        elseValue = elseClause()
+    finally:
+        activeRows.mask = outer
+    return numpy.where(predicate, thenValue, elseValue)
+
+def pfaCheckOverflow(typeName, ufunc, *args):
+    low, high = integerBounds[typeName]
+    approx = ufunc(*[numpy.asarray(x, dtype=numpy.float64) for x in args])
+    if numpy.all(numpy.abs(approx) < 2.0**62):
+        out = ufunc(*[numpy.asarray(x, dtype=numpy.int64) for x in args])
+    else:
+        out = ufunc(*[numpy.asarray(x, dtype=object) for x in args])
+    bad = (out < low) | (out > high)
+    if pfaFails(bad):
+        raise PFARuntimeException(typeName + " overflow")
+    return numpy.asarray(numpy.where(bad, 0, out), dtype=numpy.int64)
+
+def pfaCheckRange(ufunc, *args):
+    out = ufunc(*args)
+    if pfaFails(numpy.isinf(out) & numpy.all([numpy.isfinite(x) for x in numpy.broadcast_arrays(*args)], axis=0)):
+        raise OverflowError("math range error")
+    return out
+
+def pfaPower(x, y):
+    x, y = numpy.broadcast_arrays(numpy.asarray(x, dtype=numpy.float64), numpy.asarray(y, dtype=numpy.float64))
+    if pfaFails((x == 0.0) & (y < 0.0)):
+        raise ZeroDivisionError("0.0 cannot be raised to a negative power")
+    if pfaFails((x < 0.0) & (numpy.floor(y) != y)):
+        raise ValueError("negative number cannot be raised to a fractional power")
+    return pfaCheckRange(numpy.power, x, y)
+
+def pfaHypot(x, y):
+    return numpy.sqrt(pfaCheckRange(numpy.square, x) + pfaCheckRange(numpy.square, y))
+
+def pfaDivide(x, y):
+    y = numpy.asarray(y, dtype=numpy.float64)
+    return numpy.where(y == 0.0, numpy.nan, numpy.true_divide(x, y))
+
+def pfaModulo(x, y):
+    if pfaFails(numpy.asarray(y) == 0):
+        raise ZeroDivisionError("modulo by zero")
+    return numpy.mod(x, y)
+
+def pfaRemainder(integer, x, y):
+    x, y = numpy.asarray(x), numpy.asarray(y)
+    if pfaFails(y == 0):
+        raise ZeroDivisionError("modulo by zero")
+    if integer:
+        q = numpy.floor_divide(x, numpy.where(y == 0, 1, y))   # "%%" on integers uses Python 2 integer division
+    else:
+        q = numpy.trunc(numpy.true_divide(x, y))
+    return numpy.copysign(x - y * q, x)
+
+def pfaRound(x):
+    x = numpy.floor(numpy.asarray(x, dtype=numpy.float64) + 0.5)
+    if pfaFails(numpy.isnan(x)):
+        raise ValueError("cannot convert float NaN to integer")
+    if pfaFails(numpy.isinf(x)):
+        raise OverflowError("cannot convert float infinity to integer")
+    if pfaFails((x < -2.0**63) | (x >= 2.0**63)):
+        raise PFARuntimeException("long overflow")
+    return numpy.where(numpy.isfinite(x) & (x >= -2.0**63) & (x < 2.0**63), x, 0).astype(numpy.int64)
+
 class Transformation(object):
     constants = {
         "m.pi": "math.pi",
@@ -89,8 +187,31 @@ class Transformation(object):
         "m.tanh": "numpy.tanh",
         }
 
+    # used instead of ``functions`` when scoring an engine's action, so that results and errors match the engine's own
+    exactFunctions = {
+        "/": "pfaDivide",
+        "%": "pfaModulo",
+        "m.hypot": "pfaHypot",
+        "m.round": "pfaRound",
+        }
+
+    rangeCheckedFunctions = set(["m.exp", "m.expm1", "m.cosh", "m.sinh"])
+    overflowCheckedFunctions = set(["+", "-", "*", "**", "u-", "m.abs"])
+    numericTypes = ["int", "long", "float", "double"]
+    booleanFunctions = set(["==", "!=", ">", ">=", "<", "<=", "&&", "||", "^^", "!"])
+
     namespace = {"math": math, "numpy": numpy}
 
+    exactNamespace = {"pfaWhere": pfaWhere,
+                      "pfaCheckOverflow": pfaCheckOverflow,
+                      "pfaCheckRange": pfaCheckRange,
+                      "pfaPower": pfaPower,
+                      "pfaHypot": pfaHypot,
+                      "pfaDivide": pfaDivide,
+                      "pfaModulo": pfaModulo,
+                      "pfaRemainder": pfaRemainder,
+                      "pfaRound": pfaRound}
+
     @staticmethod
     def findFields(x):
         if isinstance(x, dict):
@@ -114,16 +235,109 @@ class Transformation(object):
             return x
 
     @staticmethod
-    def toNumpyExpr(ast):
+    def pfaType(ast, types):
+        """Return the PFA type of a numeric expression, given the types of its symbols, or None if it cannot be determined."""
+
+        if isinstance(ast, Ref):
+            return types.get(ast.name)
+        elif isinstance(ast, AttrGet):
+            avroType = Transformation.pfaType(ast.expr, types)
+            for x in ast.path:
+                if not isinstance(avroType, AvroRecord) or not isinstance(x, LiteralString) or x.value not in avroType.fieldsDict:
+                    return None
+                avroType = avroType.field(x.value).avroType
+            return avroType
+        elif isinstance(ast, LiteralBoolean):
+            return AvroBoolean()
+        elif isinstance(ast, LiteralInt):
+            return AvroInt()
+        elif isinstance(ast, LiteralLong):
+            return AvroLong()
+        elif isinstance(ast, LiteralFloat):
+            return AvroFloat()
+        elif isinstance(ast, LiteralDouble):
+            return AvroDouble()
+        elif isinstance(ast, Call):
+            if ast.name in Transformation.overflowCheckedFunctions or ast.name in ("%", "%%"):
+                argTypes = [Transformation.pfaType(x, types) for x in ast.args]
+                if any(x is None or x.name not in Transformation.numericTypes for x in argTypes):
+                    return None
+                return max(argTypes, key=lambda x: Transformation.numericTypes.index(x.name))
+            elif ast.name == "m.round":
+                argType = Transformation.pfaType(ast.args[0], types)
+                return AvroInt() if isinstance(argType, AvroFloat) else AvroLong()
+            elif ast.name in Transformation.booleanFunctions:
+                return AvroBoolean()
+            else:
+                return AvroDouble()
+        elif isinstance(ast, Do) and len(ast.body) > 0:
+            return Transformation.pfaType(ast.body[-1], types)
+        elif isinstance(ast, (If, Cond)):
+            if isinstance(ast, If):
+                branches = [ast.thenClause, ast.elseClause or []]
+            else:
+                branches = [x.thenClause for x in ast.ifthens] + [ast.elseClause or []]
+            branchTypes = [Transformation.pfaType(x[-1], types) if len(x) > 0 else None for x in branches]
+            if all(x is not None and x.name == branchTypes[0].name for x in branchTypes):
+                return branchTypes[0]
+            return None
+        else:
+            return None
+
+    @staticmethod
+    def exactCall(ast, args, types):
+        retType = Transformation.pfaType(ast, types)
+        if ast.name in Transformation.overflowCheckedFunctions and isinstance(retType, (AvroInt, AvroLong)):
+            return "pfaCheckOverflow(" + ", ".join([repr(retType.name), Transformation.functions[ast.name]] + args) + ")"
+        elif ast.name == "**":
+            return "pfaPower(" + ", ".join(args) + ")"
+        elif ast.name == "%%":
+            return "pfaRemainder(" + ", ".join([repr(isinstance(retType, (AvroInt, AvroLong)))] + args) + ")"
+        elif ast.name in Transformation.exactFunctions:
+            return Transformation.exactFunctions[ast.name] + "(" + ", ".join(args) + ")"
+        elif ast.name in Transformation.rangeCheckedFunctions:
+            return "pfaCheckRange(" + ", ".join([Transformation.functions[ast.name]] + args) + ")"
+        else:
+            return Transformation.functions[ast.name] + "(" + ", ".join(args) + ")"
+
+    @staticmethod
+    def where(predicate, thenClause, elseCode, symbols, types):
+        predicateCode = Transformation.toNumpyExpr(predicate, symbols, types)
+        thenCode = Transformation.toNumpyExpr(thenClause, symbols, types)
+        if types is None:
+            return "numpy.where(" + predicateCode + ", " + thenCode + ", " + elseCode + ")"
+        else:
+            return "pfaWhere(" + predicateCode + ", lambda: " + thenCode + ", lambda: " + elseCode + ")"
+
+    @staticmethod
+    def toNumpyExpr(ast, symbols=None, types=None):
         if isinstance(ast, Call):
             if ast.name in Transformation.constants and len(ast.args) == 0:
                 return Transformation.constants[ast.name]
+            elif ast.name in Transformation.functions and types is not None:
+                return Transformation.exactCall(ast, [Transformation.toNumpyExpr(x, symbols, types) for x in ast.args], types)
             elif ast.name in Transformation.functions:
-                return Transformation.functions[ast.name] + "(" + ", ".join(Transformation.toNumpyExpr(x) for x in ast.args) + ")"
+                return Transformation.functions[ast.name] + "(" + ", ".join(Transformation.toNumpyExpr(x, symbols) for x in ast.args) + ")"
             else:
                 raise ValueError("No numpy equivalent defined for function {0}".format(ast.name))
         elif isinstance(ast, Ref):
-            return ast.name
+            if symbols is None:
+                return ast.name
+            elif ast.name in symbols:
+                return symbols[ast.name]
+            else:
+                raise ValueError("No numpy equivalent defined for symbol {0}".format(ast.name))
+        elif isinstance(ast, AttrGet) and all(isinstance(x, LiteralString) for x in ast.path):
+            return Transformation.toNumpyExpr(ast.expr, symbols, types) + "".join("[" + repr(x.value) + "]" for x in ast.path)
+        elif isinstance(ast, Do) and len(ast.body) == 1:
+            return Transformation.toNumpyExpr(ast.body[0], symbols, types)
+        elif isinstance(ast, If) and ast.elseClause is not None and len(ast.thenClause) == 1 and len(ast.elseClause) == 1:
+            return Transformation.where(ast.predicate, ast.thenClause[0], Transformation.toNumpyExpr(ast.elseClause[0], symbols, types), symbols, types)
+        elif isinstance(ast, Cond) and ast.elseClause is not None and len(ast.elseClause) == 1 and all(len(x.thenClause) == 1 for x in ast.ifthens):
+            out = Transformation.toNumpyExpr(ast.elseClause[0], symbols, types)
+            for ifthen in reversed(ast.ifthens):
+                out = Transformation.where(ifthen.predicate, ifthen.thenClause[0], out, symbols, types)
+            return out
         elif isinstance(ast, LiteralNull):
             return float("nan")
         elif isinstance(ast, (LiteralBoolean, LiteralInt, LiteralLong, LiteralFloat, LiteralDouble, LiteralString)):
@@ -131,6 +345,71 @@ class Transformation(object):
         else:
             raise ValueError("No numpy equivalent defined for expression {0}".format(ast.toJson()))
 
+    @staticmethod
+    def numpyAction(engineConfig):
+        """Return a function that scores a Numpy dataset column-wise with the action of a map-type engine.
+
+        Results match ``engine.action`` record by record: PFA's rounding, division, modulo and overflow rules are applied,
+        and if ``action`` would raise an exception for any record, the whole dataset raises that exception.
+        """
+
+        if engineConfig.method != Method.MAP:
+            raise ValueError("only map-type engines can be scored with Numpy")
+
+        symbols = {"input": "input"}
+        types = {"input": engineConfig.input}
+        lines = ["def action(input):"]
+        for expr in engineConfig.action[:-1]:
+            if not isinstance(expr, Let):
+                raise ValueError("No numpy equivalent defined for expression {0}".format(expr.toJson()))
+            newSymbols = {}
+            newTypes = {}
+            for name, value in expr.values.items():
+                newSymbols[name] = "v_" + name
+                newTypes[name] = Transformation.pfaType(value, types)
+                lines.append("    v_" + name + " = " + Transformation.toNumpyExpr(value, symbols, types))
+            symbols.update(newSymbols)
+            types.update(newTypes)
+        lines.append("    return " + Transformation.toNumpyExpr(engineConfig.action[-1], symbols, types))
+
+        namespace = dict(Transformation.namespace)
+        namespace.update(Transformation.exactNamespace)
+        exec("\n".join(lines), namespace)
+        action = namespace["action"]
+
+        class InputFields(object):
+            def isDefinedAt(self, ast):
+                return isinstance(ast, AttrGet) and isinstance(ast.expr, Ref) and ast.expr.name == "input" and isinstance(ast.path[0], LiteralString)
+            def __call__(self, ast):
+                return ast.path[0].value
+        fields = set(sum((x.collect(InputFields()) for x in engineConfig.action), []))
+
+        def score(dataset):
+            if isinstance(engineConfig.input, AvroRecord):
+                if isinstance(dataset, numpy.ndarray) and dataset.dtype.names is not None:
+                    fieldNames = dataset.dtype.names
+                    length = len(dataset)
+                elif isinstance(dataset, dict) and all(isinstance(x, numpy.ndarray) and len(x.shape) == 1 for x in dataset.values()):
+                    fieldNames = dataset.keys()
+                    length = len(dataset.values()[0]) if len(dataset) > 0 else 0
+                else:
+                    raise TypeError("expecting Numpy structured array or dictionary of 1-D arrays")
+                cannotSupply = fields.difference(set(fieldNames))
+                if len(cannotSupply) > 0:
+                    raise TypeError("action needs [{0}], which are not supplied".format(", ".join(sorted(cannotSupply))))
+                input = dataset
+            else:
+                input = numpy.asarray(dataset)
+                length = len(input)
+
+            with numpy.errstate(all="ignore"):
+                out = numpy.asarray(action(input))
+            if len(out.shape) == 0:
+                out = numpy.repeat(out, length)
+            return out
+
+        return score
+
     def __init__(self, *indexed, **named):
         # indexed inputs come first, in order, and are labeled as _0, _1, _2, etc.
         self.exprs = named
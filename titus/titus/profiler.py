@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014  Open Data ("Open Data" refers to
+# one or more of the following companies: Open Data Partners LLC,
+# Open Data Research LLC, or Open Data Capital LLC.)
+# 
+# This file is part of Hadrian.
+# 
+# Licensed under the Hadrian Personal Use and Evaluation License (PUEL);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://raw.githubusercontent.com/opendatagroup/hadrian/master/LICENSE
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import marshal
+import re
+import timeit
+
+class Profiler(object):
+    fieldPattern = re.compile(r"in field (\S+) of")
+    linePattern = re.compile(r"lines? ([0-9]+)")
+
+    def __init__(self, engineName, timer=timeit.default_timer):
+        self.engineName = engineName
+        self.timer = timer
+        self.stats = {}
+        self.stack = []
+        self.depth = {}
+
+    def enter(self, key):
+        self.depth[key] = self.depth.get(key, 0) + 1
+        self.stack.append([key, self.timer(), 0.0])
+
+    def exit(self):
+        key, start, childTime = self.stack.pop()
+        elapsed = self.timer() - start
+        self.depth[key] -= 1
+        outermost = (self.depth[key] == 0)
+
+        if key not in self.stats:
+            self.stats[key] = [0, 0, 0.0, 0.0, {}]
+        stats = self.stats[key]
+        stats[1] += 1
+        stats[2] += elapsed - childTime
+        if outermost:
+            stats[0] += 1
+            stats[3] += elapsed
+
+        if len(self.stack) > 0:
+            caller = self.stack[-1]
+            caller[2] += elapsed
+            if caller[0] not in stats[4]:
+                stats[4][caller[0]] = [0, 0, 0.0, 0.0]
+            edge = stats[4][caller[0]]
+            edge[0] += 1
+            edge[2] += elapsed - childTime
+            if outermost:
+                edge[1] += 1
+                edge[3] += elapsed
+
+    def call(self, key, fcn, *args):
+        self.enter(key)
+        try:
+            return fcn(*args)
+        finally:
+            self.exit()
+
+    def wrap(self, key, fcn):
+        def profiled(*args):
+            return self.call(key, fcn, *args)
+        if hasattr(fcn, "paramNames"):
+            profiled.paramNames = fcn.paramNames
+        return profiled
+
+    def clear(self):
+        self.stats = {}
+
+    def label(self, key):
+        name, pos = key
+        field = None if pos is None else self.fieldPattern.search(pos)
+        line = None if pos is None else self.linePattern.search(pos)
+        if field is not None and field.group(1) != name:
+            name = "{0} [{1}]".format(name, field.group(1))
+        return self.engineName, 0 if line is None else int(line.group(1)), name
+
+    def report(self, sort="cumulativeTime"):
+        out = []
+        for (name, pos), (primitiveCalls, calls, selfTime, cumulativeTime, callers) in self.stats.items():
+            out.append({"name": name, "pos": pos, "calls": calls, "primitiveCalls": primitiveCalls, "selfTime": selfTime, "cumulativeTime": cumulativeTime})
+        out.sort(key=lambda x: x[sort], reverse=True)
+        return out
+
+    def dump(self, fileName):
+        stats = {}
+        for key, (primitiveCalls, calls, selfTime, cumulativeTime, callers) in self.stats.items():
+            stats[self.label(key)] = (primitiveCalls, calls, selfTime, cumulativeTime, dict((self.label(k), (v[0], v[1], v[2], v[3])) for k, v in callers.items()))
+        with open(fileName, "wb") as f:
+            marshal.dump(stats, f)